@@ -14,10 +14,23 @@ import json
 import tkinter as tk
 import tkinter.ttk as ttk 
 import traceback
+import argparse
+import struct
+import zlib
+import hashlib
+import shutil
+import multiprocessing
+from multiprocessing import shared_memory
+import asyncio
+import queue
+import functools
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import io
+import contextlib
 import collections
+from types import MappingProxyType
 import shapefile
-from shapely.geometry import LineString, Polygon
-import pickle
+from shapely.geometry import LineString
 
 
 def resource_path(relative_path):
@@ -69,6 +82,7 @@ DEFAULT_SHOW_RANGE_RINGS = False
 DEFAULT_RANGE_RING_SPACING_NM_STR = "10"
 DEFAULT_MAX_RANGE_RINGS = 20
 DEFAULT_SHOW_ALL_TRANSIT_STRIPS = False
+DEFAULT_SHOW_SHADOW_HEATMAP = False
 DEFAULT_SHOW_VELOCITY_VECTOR = True
 
 # --- Constants ---
@@ -90,7 +104,8 @@ SUN_ANGULAR_DIAMETER_DEG = 0.53; MOON_ANGULAR_DIAMETER_DEG = 0.50
 DATA_RETENTION_SECONDS = 1800 
 # --- Global variables ---
 active_glideslopes = {}; dialog_runway_end_result_storage = [None]; dialog_runway_end_thread = None
-aircraft_dict = {}; event_dict = {}; history_event_count = 0
+event_dict = {}; history_event_count = 0
+prediction_stats = {} # Per-cycle pipeline counters, read by the status panel
 DUMP1090_CONNECTED = False; start_time = datetime.now(timezone.utc)
 INITIAL_MAP_RANGE_KM = 30 * 2.0 # Default derived from conflict radius
 MIN_MAP_RANGE_KM = 1.0; MAX_MAP_RANGE_KM = 1000.0; ZOOM_FACTOR = 1.25
@@ -114,6 +129,7 @@ DEFAULT_VECTOR_LAYERS_VISIBILITY = {
     "urban_areas_fill": False, "populated_places_points": False, "geography_regions_fill": False,
 }
 SHOW_ALL_TRANSIT_STRIPS = DEFAULT_SHOW_ALL_TRANSIT_STRIPS
+SHOW_SHADOW_HEATMAP = DEFAULT_SHOW_SHADOW_HEATMAP
 VELOCITY_VECTOR_MINUTES = DEFAULT_VELOCITY_VECTOR_MINUTES
 VELOCITY_VECTOR_SECONDS = DEFAULT_VELOCITY_VECTOR_MINUTES * 60.0
 SHOW_VELOCITY_VECTOR = DEFAULT_SHOW_VELOCITY_VECTOR
@@ -136,9 +152,9 @@ VECTOR_LAYER_CONFIGS = {
 for layer_key, config_val in VECTOR_LAYER_CONFIGS.items():
     VECTOR_LAYERS_VISIBILITY[layer_key] = config_val.get("default_on", False)
 
-# --- CONSTANT TOLERANCE FOR VECTOR MAPS ---
-DEFAULT_SIMPLIFICATION_TOLERANCE_DEG = 0.005  # Fixed tolerance (degrees)
-# Example values: 0.01 is quite coarse, 0.001 is finer. Adjust as needed for your data.
+# --- VECTOR MAP LEVELS OF DETAIL ---
+VECTOR_LOD_TOLERANCES_DEG = (0.0, 0.001, 0.002, 0.004, 0.008, 0.016, 0.032, 0.064)  # Douglas-Peucker tolerance per level (0 = full detail)
+VECTOR_LOD_PIXEL_TOLERANCE = 1.0  # A level is drawn while its tolerance is within this many screen pixels
 
 map_features_geodata = {key: [] for key in VECTOR_LAYER_CONFIGS.keys()} # Initialize
 map_manager = None 
@@ -158,6 +174,7 @@ def load_config(config_path):
         "show_glideslope": DEFAULT_SHOW_GLIDESLOPE, "show_range_rings": DEFAULT_SHOW_RANGE_RINGS,
         "range_ring_spacing_nm_str": DEFAULT_RANGE_RING_SPACING_NM_STR, "max_range_rings": DEFAULT_MAX_RANGE_RINGS,
         "show_all_transit_strips": DEFAULT_SHOW_ALL_TRANSIT_STRIPS,
+        "show_shadow_heatmap": DEFAULT_SHOW_SHADOW_HEATMAP,
         "velocity_vector_minutes": DEFAULT_VELOCITY_VECTOR_MINUTES,
         "show_velocity_vector": DEFAULT_SHOW_VELOCITY_VECTOR,
         "vector_layers_visibility": default_vector_visibility
@@ -211,6 +228,7 @@ def load_config(config_path):
                     if key == "vector_layers_visibility": config[key] = default_vector_visibility.copy()
             else: print(f"Info: Config key '{key}' not found, using default: {default_value}"); config[key] = default_value
         if not isinstance(config.get("show_all_transit_strips"), bool): config["show_all_transit_strips"] = DEFAULT_SHOW_ALL_TRANSIT_STRIPS
+        if not isinstance(config.get("show_shadow_heatmap"), bool): config["show_shadow_heatmap"] = DEFAULT_SHOW_SHADOW_HEATMAP
         if not isinstance(config.get("show_velocity_vector"), bool): config["show_velocity_vector"] = DEFAULT_SHOW_VELOCITY_VECTOR
         vv_mins = config.get("velocity_vector_minutes", DEFAULT_VELOCITY_VECTOR_MINUTES)
         if not isinstance(vv_mins, (int, float)) or float(vv_mins) not in VELOCITY_VECTOR_OPTIONS_MIN: config["velocity_vector_minutes"] = DEFAULT_VELOCITY_VECTOR_MINUTES
@@ -246,6 +264,7 @@ def save_config(config_path, config_data_dict):
     try:
         config_to_save = config_data_dict.copy(); config_to_save.pop('_requires_restart', None)
         if not isinstance(config_to_save.get("show_all_transit_strips"), bool): config_to_save["show_all_transit_strips"] = DEFAULT_SHOW_ALL_TRANSIT_STRIPS
+        if not isinstance(config_to_save.get("show_shadow_heatmap"), bool): config_to_save["show_shadow_heatmap"] = DEFAULT_SHOW_SHADOW_HEATMAP
         if not isinstance(config_to_save.get("show_velocity_vector"), bool): config_to_save["show_velocity_vector"] = DEFAULT_SHOW_VELOCITY_VECTOR
         vv_mins_save = config_to_save.get("velocity_vector_minutes", DEFAULT_VELOCITY_VECTOR_MINUTES)
         if not isinstance(vv_mins_save, (int, float)) or float(vv_mins_save) not in VELOCITY_VECTOR_OPTIONS_MIN: config_to_save["velocity_vector_minutes"] = DEFAULT_VELOCITY_VECTOR_MINUTES
@@ -277,6 +296,7 @@ SHOW_AIRCRAFT_HISTORY = loaded_settings["show_history"]; SHOW_EVENT_LOCATIONS =
 SHOW_GLIDESLOPE = loaded_settings["show_glideslope"]; SHOW_RANGE_RINGS = loaded_settings["show_range_rings"]
 RANGE_RING_SPACING_NM_STR = loaded_settings["range_ring_spacing_nm_str"]; MAX_RANGE_RINGS = loaded_settings["max_range_rings"]
 SHOW_ALL_TRANSIT_STRIPS = loaded_settings["show_all_transit_strips"]
+SHOW_SHADOW_HEATMAP = loaded_settings["show_shadow_heatmap"]
 VELOCITY_VECTOR_MINUTES = loaded_settings["velocity_vector_minutes"]
 VELOCITY_VECTOR_SECONDS = VELOCITY_VECTOR_MINUTES * 60.0
 SHOW_VELOCITY_VECTOR = loaded_settings["show_velocity_vector"]
@@ -292,7 +312,7 @@ except (ValueError, KeyError):
 
 print("-" * 20 + " Runtime Configuration " + "-" * 20)
 print(f" Initial Map Range for Loading: {INITIAL_MAP_RANGE_KM:.1f} km")
-print(f" Vector Map Simplification Tolerance: {DEFAULT_SIMPLIFICATION_TOLERANCE_DEG}° (Fixed)")
+print(f" Vector Map Levels of Detail: {', '.join(f'{tol:g}°' for tol in VECTOR_LOD_TOLERANCES_DEG)}")
 print("-" * (42 + len(" Runtime Configuration ")))
 
 
@@ -313,27 +333,89 @@ def calculate_panel_layout(screen_width, screen_height):
     return pygame.Rect(0, 0, left_width, panel_height), pygame.Rect(left_width, 0, right_width, panel_height), panel_height
 
 
+# --- Command Line (capture recording / offline replay) ---
+def parse_command_line(argv):
+    parser = argparse.ArgumentParser(description="ADS-B Transit Predictor")
+    parser.add_argument("--record", metavar="PATH", help="append the live BaseStation feed to a capture file")
+    parser.add_argument("--replay", metavar="PATH", help="replay a capture file instead of connecting to dump1090")
+    parser.add_argument("--speed", default="1", help="replay speed factor, or 'max' for as fast as possible (default 1)")
+    parser.add_argument("--replay-from", type=float, default=0.0, metavar="SEC", help="start the replay SEC seconds into the capture")
+    parser.add_argument("--workers", type=int, default=-1, metavar="N", help="prediction worker processes (0 = in-process, default: CPU count - 1, at most 4)")
+    parser.add_argument("--benchmark", action="store_true", help="run the headless prediction benchmark on synthetic traffic and exit")
+    parser.add_argument("--bench-sizes", default="50,100,200,400", metavar="N,N,...", help="aircraft counts to benchmark (default 50,100,200,400)")
+    parser.add_argument("--bench-repeats", type=int, default=5, metavar="K", help="timed cycles per stage and size (default 5)")
+    parser.add_argument("--bench-epoch", metavar="ISO", help="UTC epoch of the synthetic scenario, e.g. 2025-06-21T12:00:00 (default now)")
+    parser.add_argument("--bench-seed", type=int, default=0, help="random seed for the synthetic traffic")
+    parser.add_argument("--bench-radius-km", type=float, default=150.0, metavar="KM", help="radius of the synthetic traffic area (density)")
+    parser.add_argument("--bench-json", metavar="PATH", help="also write the benchmark results to a JSON file")
+    args, _ = parser.parse_known_args(argv)
+    args.speed = None if str(args.speed).lower() == "max" else float(args.speed)
+    if args.workers < 0: args.workers = max(0, min(4, (os.cpu_count() or 1) - 1))
+    return args
+CLI = parse_command_line(sys.argv[1:] if __name__ == "__main__" else [])
+
 dump1090_process = None
-try:
-    dump1090_executable_relative = os.path.join("dump1090", "dump1090.exe")
-    dump1090_executable_absolute = os.path.join(app_dir, dump1090_executable_relative)
-    if not os.path.isfile(dump1090_executable_absolute): raise FileNotFoundError(f"dump1090 not found: {dump1090_executable_absolute}")
-    dump1090_cmd = [dump1090_executable_absolute, "--net", "--device-index", str(DUMP1090_DEVICE_INDEX), "--gain", str(DUMP1090_GAIN)]
-    dump1090_creation_flags = 0
-    if sys.platform == "win32": dump1090_creation_flags = subprocess.CREATE_NO_WINDOW
-    print(f"Attempting to start dump1090: {' '.join(dump1090_cmd)}")
-    dump1090_process = subprocess.Popen(dump1090_cmd, creationflags=dump1090_creation_flags)
-    print("dump1090 process started (PID:", dump1090_process.pid, ")")
-    time.sleep(2)
-except FileNotFoundError as fnf_error: print(f"Error: {fnf_error}\nContinuing without dump1090 auto-start.")
-except Exception as e: print(f"Error starting dump1090: {e}"); traceback.print_exc(); print("Continuing without dump1090 auto-start.")
+def start_dump1090():
+    """Auto-start dump1090 next to the app; called from __main__ only, so worker imports never spawn it."""
+    if CLI.replay or CLI.benchmark: print(f"{'Benchmark' if CLI.benchmark else 'Replay'} mode: dump1090 auto-start skipped."); return None
+    try:
+        dump1090_executable_relative = os.path.join("dump1090", "dump1090.exe")
+        dump1090_executable_absolute = os.path.join(app_dir, dump1090_executable_relative)
+        if not os.path.isfile(dump1090_executable_absolute): raise FileNotFoundError(f"dump1090 not found: {dump1090_executable_absolute}")
+        dump1090_cmd = [dump1090_executable_absolute, "--net", "--device-index", str(DUMP1090_DEVICE_INDEX), "--gain", str(DUMP1090_GAIN)]
+        dump1090_creation_flags = 0
+        if sys.platform == "win32": dump1090_creation_flags = subprocess.CREATE_NO_WINDOW
+        print(f"Attempting to start dump1090: {' '.join(dump1090_cmd)}")
+        process = subprocess.Popen(dump1090_cmd, creationflags=dump1090_creation_flags)
+        print("dump1090 process started (PID:", process.pid, ")")
+        time.sleep(2)
+        return process
+    except FileNotFoundError as fnf_error: print(f"Error: {fnf_error}\nContinuing without dump1090 auto-start.")
+    except Exception as e: print(f"Error starting dump1090: {e}"); traceback.print_exc(); print("Continuing without dump1090 auto-start.")
+    return None
 
 eph = None; ts = None; observer_topos = None
 A = 6378.137; F = 1 / 298.257223563; B = A * (1 - F)
 airports_data = []; runways_data = collections.defaultdict(list); navaids_data = []
 csv_headers = ['msg_type', 'icao', 'callsign', 'altitude', 'speed', 'track', 'lat', 'lon', 'vs', 'squawk', 'timestamp']
 CSV_OUTPUT = False; CSV_FILENAME = 'adsb_data.csv'
-def add_log(msg): print(f"[LOG] {datetime.now(timezone.utc).strftime('%H:%M:%S')} - {msg}")
+# --- Clock ---
+class VirtualClock:
+    """
+    Time source for everything that reasons about "now" (ingest, predictors, cleaners, display).
+    Live: the system UTC clock. Replay: starts at the capture's first receive time and advances at
+    `speed` x real time, or (speed None) is driven by the replay itself via advance().
+    """
+    def __init__(self):
+        self.live = True; self.speed = 1.0; self.finished = False
+        self._anchor_v = 0.0; self._anchor_r = 0.0; self._t = 0.0
+        self._cond = threading.Condition()
+    def start_replay(self, t0_epoch, speed):
+        with self._cond:
+            self.live = False; self.speed = speed; self.finished = False
+            self._anchor_v, self._anchor_r, self._t = t0_epoch, time.monotonic(), t0_epoch
+    def epoch(self):
+        if self.live: return time.time()
+        if self.speed is None: return self._t
+        return self._anchor_v + (time.monotonic() - self._anchor_r) * self.speed
+    def now(self): return datetime.now(timezone.utc) if self.live else datetime.fromtimestamp(self.epoch(), timezone.utc)
+    def advance(self, t_epoch):
+        """As-fast-as-possible replay: move virtual time forward to t_epoch and wake sleepers."""
+        with self._cond:
+            if t_epoch > self._t: self._t = t_epoch; self._cond.notify_all()
+    def finish(self):
+        with self._cond: self.finished = True; self._cond.notify_all()
+    def sleep(self, seconds):
+        """Sleep for `seconds` of clock time."""
+        if self.live or self.finished: time.sleep(seconds)
+        elif self.speed is not None: time.sleep(seconds / self.speed)
+        else:
+            with self._cond:
+                target = self._t + seconds
+                while running and not self.finished and self._t < target: self._cond.wait(0.5)
+clock = VirtualClock()
+def utc_now(): return clock.now()
+def add_log(msg): print(f"[LOG] {utc_now().strftime('%H:%M:%S')} - {msg}")
 def feet_to_km(feet): return feet * 0.3048 / 1000.0
 def m_to_km(meters): return meters / 1000.0
 def calculate_bearing(lat1_deg, lon1_deg, lat2_deg, lon2_deg):
@@ -356,22 +438,168 @@ def point_line_segment_distance(px, py, x1, y1, x2, y2):
     if l_mag_sq==0:return hypot(px-x1,py-y1)
     t=max(0,min(1,((px-x1)*(x2-x1)+(py-y1)*(y2-y1))/l_mag_sq))
     return hypot(px-(x1+t*(x2-x1)),py-(y1+t*(y2-y1)))
+def normalize_icao(field):
+    """ICAO hex address as the aircraft key: stripped, upper-case, exactly 6 characters (str or bytes in), else None."""
+    if isinstance(field, bytes): field = field.decode('ascii', 'ignore')
+    icao = field.strip().upper()
+    return icao if len(icao) == 6 else None
 def parse_basestation_line(line):
     fields=line.strip().split(',')
     if len(fields)<22 or fields[0]!='MSG':return None
     try:
-        msg_type,icao=fields[1],fields[4].upper();
-        if not icao or len(icao)!=6:return None
+        msg_type,icao=fields[1],normalize_icao(fields[4])
+        if icao is None:return None
         callsign=fields[10].strip()or None;altitude=int(fields[11])if fields[11]else None
         speed=float(fields[12])if fields[12]else None;track=float(fields[13])if fields[13]else None
         lat=float(fields[14])if fields[14]else None;lon=float(fields[15])if fields[15]else None
         vs=int(fields[16])if fields[16]else None;squawk=fields[17]if fields[17]else None
-        timestamp=datetime.now(timezone.utc)
+        timestamp=utc_now()
         if lat is not None and not(-90<=lat<=90):lat=None
         if lon is not None and not(-180<=lon<=180):lon=None
         vs_eff=0 if vs is not None and abs(vs)<64 else vs
         return{'msg_type':msg_type,'icao':icao,'callsign':callsign,'altitude':altitude,'speed':speed,'track':track,'lat':lat,'lon':lon,'vs':vs_eff,'squawk':squawk,'timestamp':timestamp,'conflict':None,'event_ids':set()}
     except(ValueError,IndexError):return None
+# --- Batched SBS Ingest ---
+_NAN = float('nan')
+def parse_basestation_batch(lines, timestamp=None):
+    """
+    Parse a list of raw BaseStation lines (bytes) into columns in one pass.
+    Same validation (and normalize_icao keys) as parse_basestation_line; invalid lines are skipped. All messages share one
+    receive timestamp. Returns {'timestamp', 'icao', 'msg_type', 'callsign', 'squawk', 'num'} where
+    'num' is an (M, 6) float array in STATE_KEYS order (lat, lon, altitude, speed, track, vs), NaN = absent.
+    """
+    icaos, msg_types, callsigns, squawks, num = [], [], [], [], []
+    for line in lines:
+        f = line.split(b',')
+        if len(f) < 22 or f[0] != b'MSG': continue
+        icao = normalize_icao(f[4])
+        if icao is None: continue
+        try:
+            lat = float(f[14]) if f[14] else _NAN; lon = float(f[15]) if f[15] else _NAN
+            alt = int(f[11]) if f[11] else _NAN; vs = int(f[16]) if f[16] else _NAN
+            spd = float(f[12]) if f[12] else _NAN; trk = float(f[13]) if f[13] else _NAN
+        except ValueError: continue
+        if not -90 <= lat <= 90: lat = _NAN
+        if not -180 <= lon <= 180: lon = _NAN
+        if abs(vs) < 64: vs = 0
+        cs = f[10].strip()
+        icaos.append(icao); msg_types.append(f[1].decode('ascii', 'ignore'))
+        callsigns.append(cs.decode('ascii', 'ignore') if cs else None); squawks.append(f[17].decode('ascii', 'ignore') if f[17] else None)
+        num.extend((lat, lon, alt, spd, trk, vs))
+    return {'timestamp': timestamp or utc_now(), 'icao': icaos, 'msg_type': msg_types,
+            'callsign': callsigns, 'squawk': squawks, 'num': np.array(num, dtype=np.float64).reshape(-1, 6)}
+class SBSStreamFramer:
+    """
+    Frames a BaseStation byte stream into complete lines.
+    Data is received straight into a preallocated buffer (recv_into via memoryview) and each chunk
+    is framed with a single bytes.split; the partial tail line is carried over to the next chunk.
+    """
+    def __init__(self, size=1 << 16):
+        self.buf = bytearray(size); self.view = memoryview(self.buf); self.fill = 0
+    def recv_from(self, sock):
+        """Receive once from sock; returns the complete lines, or None when the peer closed."""
+        if self.fill == len(self.buf): self.fill = 0 # A line longer than the buffer is garbage
+        n = sock.recv_into(self.view[self.fill:])
+        if n == 0: return None
+        self.fill += n
+        return self._drain()
+    def feed(self, data):
+        """Append bytes from any other source; returns the complete lines."""
+        lines = []
+        data = memoryview(data)
+        while len(data):
+            if self.fill == len(self.buf): self.fill = 0
+            n = min(len(data), len(self.buf) - self.fill)
+            self.view[self.fill:self.fill + n] = data[:n]; self.fill += n; data = data[n:]
+            lines.extend(self._drain())
+        return lines
+    def _drain(self):
+        end = self.buf.rfind(b'\n', 0, self.fill)
+        if end < 0: return []
+        lines = self.buf[:end].split(b'\n')
+        rest = self.fill - end - 1
+        self.buf[:rest] = self.buf[end + 1:self.fill]; self.fill = rest
+        return [ln for ln in lines if len(ln) > 1]
+ingest_stats = {'lines': 0, 'messages': 0, 'msg_rate': 0.0, 'line_rate': 0.0, 'capacity': 0.0} # Read by the status panel
+_ingest_window = {'start': time.monotonic(), 'lines': 0, 'messages': 0, 'busy': 0.0}
+def ingest_sbs_lines(lines, timestamp=None):
+    """Parse a batch of raw lines and apply it under one lock acquisition; updates ingest_stats."""
+    t0 = time.perf_counter()
+    batch = parse_basestation_batch(lines, timestamp)
+    n = update_aircraft_batch(batch) if batch['icao'] else 0
+    now_m = time.monotonic(); w = _ingest_window
+    w['lines'] += len(lines); w['messages'] += n; w['busy'] += time.perf_counter() - t0
+    elapsed = now_m - w['start']
+    if elapsed >= 1.0:
+        with lock:
+            ingest_stats['lines'] += w['lines']; ingest_stats['messages'] += w['messages']
+            ingest_stats['line_rate'] = w['lines'] / elapsed; ingest_stats['msg_rate'] = w['messages'] / elapsed
+            ingest_stats['capacity'] = w['messages'] / w['busy'] if w['busy'] > 0 else 0.0 # msg/s if parsing+applying were all we did
+        w.update(start=now_m, lines=0, messages=0, busy=0.0)
+    return n
+# --- SBS Capture Files ---
+# Layout: CAPTURE_MAGIC, then self-describing chunks: header (first_ts, last_ts, n_lines, comp_len)
+# followed by comp_len bytes of zlib-compressed "<receive epoch>,<raw line>\n" records.
+# Chunk headers double as the index: a reader walks them without decompressing anything.
+CAPTURE_MAGIC = b'SBSCAP1\n'
+CAPTURE_CHUNK_HEADER = struct.Struct('<ddII')
+CAPTURE_CHUNK_LINES = 5000; CAPTURE_CHUNK_SEC = 10.0
+class CaptureRecorder:
+    """Appends raw BaseStation lines with their receive timestamps to a capture file."""
+    def __init__(self, path):
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not new:
+            with open(path, 'rb') as f:
+                if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC: raise ValueError(f"Not a capture file: {path}")
+        self.f = open(path, 'ab')
+        if new: self.f.write(CAPTURE_MAGIC)
+        self.pending = []; self.first_ts = self.last_ts = None; self.opened_at = time.monotonic()
+    def record(self, lines, timestamp):
+        ts_s = timestamp.timestamp(); prefix = b'%.6f,' % ts_s
+        self.pending.extend(prefix + ln for ln in lines)
+        if self.first_ts is None: self.first_ts = ts_s
+        self.last_ts = ts_s
+        if len(self.pending) >= CAPTURE_CHUNK_LINES or time.monotonic() - self.opened_at >= CAPTURE_CHUNK_SEC: self.flush()
+    def flush(self):
+        if self.pending:
+            data = zlib.compress(b'\n'.join(self.pending) + b'\n', 6)
+            self.f.write(CAPTURE_CHUNK_HEADER.pack(self.first_ts, self.last_ts, len(self.pending), len(data)) + data)
+            self.f.flush()
+        self.pending = []; self.first_ts = self.last_ts = None; self.opened_at = time.monotonic()
+    def close(self):
+        self.flush(); self.f.close()
+class CaptureReader:
+    """Chunk-indexed reader; a truncated trailing chunk (recorder killed mid-write) is ignored."""
+    def __init__(self, path):
+        self.path = path; self.index = [] # (offset, first_ts, last_ts, n_lines, comp_len)
+        with open(path, 'rb') as f:
+            if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC: raise ValueError(f"Not a capture file: {path}")
+            size = os.fstat(f.fileno()).st_size
+            while True:
+                off = f.tell(); hdr = f.read(CAPTURE_CHUNK_HEADER.size)
+                if len(hdr) < CAPTURE_CHUNK_HEADER.size: break
+                first_ts, last_ts, n, comp_len = CAPTURE_CHUNK_HEADER.unpack(hdr)
+                if off + CAPTURE_CHUNK_HEADER.size + comp_len > size: break
+                self.index.append((off, first_ts, last_ts, n, comp_len)); f.seek(comp_len, 1)
+    @property
+    def start_ts(self): return self.index[0][1] if self.index else None
+    @property
+    def end_ts(self): return self.index[-1][2] if self.index else None
+    def batches(self, from_ts=None):
+        """Yield (receive_epoch, [raw lines]) in recorded order, one per original receive chunk."""
+        with open(self.path, 'rb') as f:
+            for off, first_ts, last_ts, n, comp_len in self.index:
+                if from_ts is not None and last_ts < from_ts: continue
+                f.seek(off + CAPTURE_CHUNK_HEADER.size)
+                cur_ts, cur = None, []
+                for rec in zlib.decompress(f.read(comp_len)).split(b'\n'):
+                    if not rec: continue
+                    ts_b, _, line = rec.partition(b',')
+                    ts_s = float(ts_b)
+                    if from_ts is not None and ts_s < from_ts: continue
+                    if ts_s != cur_ts and cur: yield cur_ts, cur; cur = []
+                    cur_ts = ts_s; cur.append(line)
+                if cur: yield cur_ts, cur
 def haversine(lat1, lon1, lat2, lon2):
     R=EARTH_RADIUS_KM;
     if None in[lat1,lon1,lat2,lon2]:return float('inf')
@@ -413,6 +641,79 @@ def predict_position(lat, lon, altitude_ft, speed_kts, track_deg, delta_t_sec, v
     d_lon_r=atan2(l2_y,l2_x)if not(abs(l2_y)<1e-12 and abs(l2_x)<1e-12)else 0.0
     n_lon_r=lon_r+d_lon_r;n_lat,n_lon=degrees(n_lat_r),degrees(n_lon_r)
     return n_lat,(n_lon+180)%360-180,new_alt
+# --- Vectorized Batch Propagation ---
+def prediction_time_grid(horizon_sec=None, step_sec=None):
+    """Coarse search time offsets (seconds) shared by both predictors."""
+    horizon_sec = PREDICTION_HORIZON if horizon_sec is None else horizon_sec
+    step_sec = PREDICTION_STEP if step_sec is None else step_sec
+    return np.arange(0, horizon_sec + step_sec, step_sec)
+def aircraft_state_arrays(ac_list):
+    """
+    Pack the kinematic state of a list of aircraft dicts into NumPy arrays.
+    Returns (lat, lon, altitude_ft, speed_kts, track_deg, vs_fpm), each of shape (N,).
+    """
+    cols = np.array([[ac['lat'], ac['lon'], ac['altitude'], ac['speed'], ac['track'], ac['vs']] for ac in ac_list], dtype=np.float64).reshape(-1, 6)
+    return tuple(cols[:, k] for k in range(6))
+def predict_positions_batch(lat, lon, altitude_ft, speed_kts, track_deg, vs_fpm, t_offsets):
+    """
+    Vectorized equivalent of predict_position for N aircraft over a time grid in one call.
+    State inputs are arrays of shape (N,). t_offsets is either a shared grid of shape (T,)
+    or any array broadcastable against (N, 1), e.g. per-aircraft offsets of shape (N, 1).
+    Returns a geodetic tensor of shape (N, T, 3): [..., 0]=lat, [..., 1]=lon, [..., 2]=altitude (ft).
+    """
+    lat = np.asarray(lat, dtype=np.float64).reshape(-1, 1)
+    lon = np.asarray(lon, dtype=np.float64).reshape(-1, 1)
+    alt = np.asarray(altitude_ft, dtype=np.float64).reshape(-1, 1)
+    spd = np.asarray(speed_kts, dtype=np.float64).reshape(-1, 1)
+    trk = np.asarray(track_deg, dtype=np.float64).reshape(-1, 1)
+    vs = np.asarray(vs_fpm, dtype=np.float64).reshape(-1, 1)
+    t = np.asarray(t_offsets, dtype=np.float64)
+    if t.ndim == 1: t = t[None, :]
+    # Vertical profile (same dead band as predict_position)
+    vs_eff = np.where(np.abs(vs) < 64, 0.0, vs)
+    alt_chg = (vs_eff / 60.0) * t
+    new_alt = alt + alt_chg
+    # Local ellipsoid radius evaluated at the mid-segment altitude
+    lat_r = np.radians(lat)
+    cos_lat_sq, sin_lat_sq = np.cos(lat_r)**2, np.sin(lat_r)**2
+    r_local = np.sqrt((A**4 * cos_lat_sq + B**4 * sin_lat_sq) / (A**2 * cos_lat_sq + B**2 * sin_lat_sq))
+    eff_rad = r_local + feet_to_km(alt + alt_chg / 2.0)
+    # Great-circle step along the track
+    dist_km = spd * 1.852 / 3600.0 * t
+    delta_a = dist_km / eff_rad
+    brg_r = np.radians(trk)
+    s_l1, c_l1 = np.sin(lat_r), np.cos(lat_r)
+    c_d, s_d = np.cos(delta_a), np.sin(delta_a)
+    n_lat_r = np.arcsin(np.clip(s_l1 * c_d + c_l1 * s_d * np.cos(brg_r), -1.0, 1.0))
+    l2_y = np.sin(brg_r) * s_d * c_l1
+    l2_x = c_d - s_l1 * np.sin(n_lat_r)
+    degenerate = (np.abs(l2_y) < 1e-12) & (np.abs(l2_x) < 1e-12)
+    d_lon_r = np.where(degenerate, 0.0, np.arctan2(l2_y, l2_x))
+    n_lon = (np.degrees(np.radians(lon) + d_lon_r) + 180) % 360 - 180
+    # Stationary aircraft keep their reported position untouched
+    stationary = (dist_km == 0)
+    out_lat = np.where(stationary, lat, np.degrees(n_lat_r))
+    out_lon = np.where(stationary, lon, n_lon)
+    return np.stack(np.broadcast_arrays(out_lat, out_lon, new_alt), axis=-1)
+def geodetic_to_ecef_batch(geo):
+    """
+    Vectorized spherical_to_cartesian. geo[..., 0:3] = (lat, lon, altitude_ft).
+    Returns WGS84 ECEF coordinates (km) with the same leading shape and a trailing axis of 3.
+    """
+    geo = np.asarray(geo, dtype=np.float64)
+    lat_r, lon_r = np.radians(geo[..., 0]), np.radians(geo[..., 1])
+    h = feet_to_km(geo[..., 2])
+    e2 = 2 * F - F**2
+    sin_l, cos_l = np.sin(lat_r), np.cos(lat_r)
+    N = A / np.sqrt(1 - e2 * sin_l**2)
+    return np.stack(((N + h) * cos_l * np.cos(lon_r), (N + h) * cos_l * np.sin(lon_r), (N * (1 - e2) + h) * sin_l), axis=-1)
+def propagate_aircraft_batch(ac_list, t_offsets):
+    """
+    Propagate every aircraft in ac_list over t_offsets in one vectorized pass.
+    Returns (geo, ecef), both of shape (N_aircraft, N_steps, 3): geo is (lat, lon, alt_ft), ecef is in km.
+    """
+    geo = predict_positions_batch(*aircraft_state_arrays(ac_list), t_offsets)
+    return geo, geodetic_to_ecef_batch(geo)
 # --- High-precision Solver Helper Functions ---
 def get_3d_pos_at_t(ac_data, t_offset):
     """
@@ -424,11 +725,38 @@ def get_3d_pos_at_t(ac_data, t_offset):
     )
     if lat is None: return None
     return spherical_to_cartesian(lat, lon, alt)
+SOLVER_FIT_SAMPLES = 5 # Samples across the refinement window for the closed-form solver
+SOLVER_FIT_TOL_KM = 0.002 # AC-AC: max quadratic fit residual (km) before falling back to golden section
+SOLVER_FIT_TOL_CHORD = 2e-5 # AC-body: same for the LOS unit-vector difference (~0.001°)
+def quadratic_closest_approach(t_samples, rel):
+    """
+    Closed-form minimum of |rel(t)| over [t_samples[0], t_samples[-1]].
+    rel has shape (K, D); each component is fitted with a quadratic in t, so |rel|^2 is a quartic
+    whose stationary points are the real roots of a cubic.
+    Returns (t_min, fit_residual) where fit_residual is the largest component misfit at the samples.
+    """
+    t = np.asarray(t_samples, dtype=np.float64)
+    rel = np.asarray(rel, dtype=np.float64)
+    tc = t.mean(); tau = t - tc
+    c2, c1, c0 = np.polyfit(tau, rel, 2)
+    residual = float(np.max(np.abs(np.vander(tau, 3) @ np.stack((c2, c1, c0)) - rel)))
+    # d/dtau |c2 tau^2 + c1 tau + c0|^2
+    roots = np.roots([4 * c2 @ c2, 6 * c1 @ c2, 2 * (c1 @ c1 + 2 * c0 @ c2), 2 * c0 @ c1])
+    cand = np.concatenate(([tau[0], tau[-1]], roots[np.abs(roots.imag) < 1e-9].real))
+    cand = cand[(cand >= tau[0]) & (cand <= tau[-1])]
+    model = np.sum((np.outer(cand**2, c2) + np.outer(cand, c1) + c0)**2, axis=1)
+    return float(tc + cand[np.argmin(model)]), residual
+def summarize_solver_runs(infos):
+    """Per-cycle totals of solver_info dicts: {'events', 'analytic', 'iterations', 'evaluations'}."""
+    return {'events': len(infos), 'analytic': sum(1 for i in infos if i['method'] == 'analytic'),
+            'iterations': sum(i['iterations'] for i in infos), 'evaluations': sum(i['evaluations'] for i in infos)}
 def solve_closest_approach(ac1, ac2, t_center, window=1.5):
     """
-    Perform a golden section search within the interval [t_center - window, t_center + window]
-    to find the exact time (t_min) and distance (d_min) of the closest approach 
-    between two aircraft.
+    Find the exact time (t_min) and distance (d_min) of the closest approach between two aircraft
+    within [t_center - window, t_center + window].
+    The relative ECEF track is fitted with a quadratic and solved in closed form; golden section
+    search is only used when the fit residual exceeds SOLVER_FIT_TOL_KM.
+    Returns (t_min, d_min, solver_info) with solver_info = {'method', 'iterations', 'evaluations'}.
     """
     phi = (1 + sqrt(5)) / 2 
     resphi = 2 - phi
@@ -440,6 +768,14 @@ def solve_closest_approach(ac1, ac2, t_center, window=1.5):
         p2 = get_3d_pos_at_t(ac2, t)
         if not p1 or not p2: return float('inf')
         return (p1[0]-p2[0])**2 + (p1[1]-p2[1])**2 + (p1[2]-p2[2])**2
+    # closed form
+    t_s = np.linspace(a, b, SOLVER_FIT_SAMPLES)
+    _, ecef = propagate_aircraft_batch([ac1, ac2], t_s)
+    rel = ecef[0] - ecef[1]
+    if np.all(np.isfinite(rel)):
+        t_min, residual = quadratic_closest_approach(t_s, rel)
+        if residual <= SOLVER_FIT_TOL_KM:
+            return t_min, sqrt(distance_sq_func(t_min)), {'method': 'analytic', 'iterations': 1, 'evaluations': SOLVER_FIT_SAMPLES + 1}
     # iter
     c = a + resphi * (b - a)
     d = b - resphi * (b - a)
@@ -460,170 +796,375 @@ def solve_closest_approach(ac1, ac2, t_center, window=1.5):
             fd = distance_sq_func(d)
     t_min = (a + b) / 2
     min_dist_km = sqrt(distance_sq_func(t_min))
-    return t_min, min_dist_km
-def calculate_transit_rectangle_for_aircraft(icao_code, current_time_utc):
+    return t_min, min_dist_km, {'method': 'golden', 'iterations': 20, 'evaluations': SOLVER_FIT_SAMPLES + 23}
+# --- Transit Strips ---
+TRANSIT_STRIP_STEP_SEC = 10.0 # Spacing of the strip slices along the predicted track
+TRANSIT_STRIP_MIN_BODY_ALT_DEG = 0.5 # Below this the projection distance h/tan(alt) runs away; the strip stops
+SHADOW_GRID_DEG = 2.0 # Lat/lon spacing of the Sun/Moon direction grid (direction varies ~1° per 111 km, near-linearly)
+SHADOW_GRID_TIME_SEC = 120.0 # Time spacing of the same grid
+def destination_point_batch(lat_deg, lon_deg, bearing_deg, distance_km):
+    """Vectorized destination_point (spherical Earth, EARTH_RADIUS_KM) for broadcastable arrays."""
+    lat1, lon1, brg = np.radians(lat_deg), np.radians(lon_deg), np.radians(bearing_deg)
+    ang = np.asarray(distance_km, dtype=np.float64) / EARTH_RADIUS_KM
+    sin_lat2 = np.clip(np.sin(lat1) * np.cos(ang) + np.cos(lat1) * np.sin(ang) * np.cos(brg), -1.0, 1.0)
+    lat2 = np.arcsin(sin_lat2)
+    lon2 = lon1 + np.arctan2(np.sin(brg) * np.sin(ang) * np.cos(lat1), np.cos(ang) - np.sin(lat1) * sin_lat2)
+    return np.degrees(lat2), (np.degrees(lon2) + 180) % 360 - 180
+class ShadowDirectionGrid:
     """
-    Calculate the ground projection strip for aircraft transits of celestial bodies (Sun/Moon).
-    Improvement: Uses polyline fitting for accurate path curvature instead of a simple rectangular approximation.
+    Sun/Moon directions for sea-level observers on a coarse lat/lon/time grid covering an area.
+    Every node is one CelestialBodyTable (one vectorized Skyfield call per body); directions anywhere
+    inside are trilinearly interpolated ENU vectors, since they change by about as many degrees as
+    the observer moves over the Earth.
     """
-    global aircraft_dict, eph, ts, lock, PREDICTION_HORIZON, SUN_ANGULAR_DIAMETER_DEG, MOON_ANGULAR_DIAMETER_DEG
-    
-    transit_data = {'sun': None, 'moon': None}
-    
-    if not eph or not ts: return transit_data
-    
-    with lock:
-        ac_data = aircraft_dict.get(icao_code)
-    
-    if not ac_data: return transit_data
-    
-    # Fetch basic aircraft telemetry/data
-    lat, lon, alt, spd, trk, vs = (ac_data.get(k) for k in ('lat', 'lon', 'altitude', 'speed', 'track', 'vs'))
-    if None in [lat, lon, alt, spd, trk, vs]: return transit_data
-    
-    # Helper function: Calculate the shadow slice (Left, Right, Center) at a specific timestamp
-    def get_shadow_slice(t_offset, body_name, ang_dia_deg):
-        # 1. Predict aircraft position
-        p_lat, p_lon, p_alt = predict_position(lat, lon, alt, spd, trk, t_offset, vs)
-        if p_lat is None: return None
-        
-        # 2. Calculate the celestial body's topocentric position for this location and time
-        # Note: We assume the projection surface is at sea level (elevation_m=0), 
-        # which determines the shadow's footprint location on the ground.
-        g_obs = Topos(latitude_degrees=p_lat, longitude_degrees=p_lon, elevation_m=0.0)
-        t_target = ts.utc(current_time_utc + timedelta(seconds=t_offset))
-        
+    def __init__(self, lat_min, lat_max, lon_min, lon_max, start_time_utc, horizon_sec):
+        pad = SHADOW_GRID_DEG / 2.0
+        self.axes = (np.linspace(lat_min - pad, lat_max + pad, ceil((lat_max - lat_min + 2 * pad) / SHADOW_GRID_DEG) + 1),
+                     np.linspace(lon_min - pad, lon_max + pad, ceil((lon_max - lon_min + 2 * pad) / SHADOW_GRID_DEG) + 1),
+                     np.linspace(0.0, horizon_sec, max(2, ceil(horizon_sec / SHADOW_GRID_TIME_SEC) + 1)))
+        lats, lons, t_offsets = self.axes
+        earth = eph['earth']
+        self.enu = {body: np.empty((len(lats), len(lons), len(t_offsets), 3)) for body in CelestialBodyTable.BODIES}
+        for i, la in enumerate(lats):
+            for j, lo in enumerate(lons):
+                table = CelestialBodyTable(earth + Topos(latitude_degrees=float(la), longitude_degrees=float(lo), elevation_m=0.0), start_time_utc, t_offsets)
+                for body in CelestialBodyTable.BODIES: self.enu[body][i, j] = table.enu[body]
+    def altaz(self, body, lat, lon, t_sec):
+        """Interpolated (alt_deg, az_deg) of body for observers at (lat, lon) and offsets t_sec (broadcastable)."""
+        lat, lon, t_sec = np.broadcast_arrays(*(np.asarray(v, dtype=np.float64) for v in (lat, lon, t_sec)))
+        idx, frac = [], []
+        for axis, v in zip(self.axes, (lat, lon, t_sec)):
+            f = np.clip((v - axis[0]) / (axis[1] - axis[0]), 0.0, len(axis) - 1.0)
+            i0 = np.minimum(np.floor(f).astype(np.int64), len(axis) - 2)
+            idx.append(i0); frac.append((f - i0)[..., None])
+        grid = self.enu[body]; v = 0.0
+        for di in (0, 1):
+            for dj in (0, 1):
+                for dk in (0, 1):
+                    w = (frac[0] if di else 1 - frac[0]) * (frac[1] if dj else 1 - frac[1]) * (frac[2] if dk else 1 - frac[2])
+                    v = v + w * grid[idx[0] + di, idx[1] + dj, idx[2] + dk]
+        return enu_to_altaz(v)
+def calculate_transit_strips(icao_codes, current_time_utc):
+    """
+    Ground projection strips of Sun/Moon transits for many aircraft in one vectorized pass.
+    Each aircraft's predicted track is sampled every TRANSIT_STRIP_STEP_SEC; at every slice the body
+    direction (ShadowDirectionGrid) projects the aircraft onto the ground: the shadow centre lies
+    h/tan(alt) beyond the sub-aircraft point, away from the body, and the shadow is
+    h*tan(d/2)/sin(alt) wide on each side for angular diameter d. A strip ends at the first slice
+    where the body is too low (or the aircraft on the ground); strips need two slices.
+    Returns {icao: {'sun': strip or None, 'moon': strip or None}} where a strip is
+    {'polygon': (2K, 2) array L0..Lk, Rk..R0 of (lat, lon), 'centerline': (K, 2) array}.
+    """
+    result = {icao: {'sun': None, 'moon': None} for icao in icao_codes}
+    if not eph or not ts: return result
+    snap = get_aircraft_snapshot()
+    rows = [snap.index[icao] for icao in icao_codes if icao in snap.index]
+    if not rows: return result
+    icaos = [snap.icao[k] for k in rows]
+    t_offsets = np.arange(int(PREDICTION_HORIZON / TRANSIT_STRIP_STEP_SEC) + 1) * TRANSIT_STRIP_STEP_SEC
+    geo = predict_positions_batch(*snap.state_arrays(rows), t_offsets) # (N, S, 3)
+    lat, lon = geo[..., 0], geo[..., 1]
+    h_km = feet_to_km(geo[..., 2])
+    try:
+        grid = ShadowDirectionGrid(lat.min(), lat.max(), lon.min(), lon.max(), current_time_utc, t_offsets[-1])
+    except Exception as e:
+        print(f"Transit strip ephemeris error: {e}"); return result
+    for body, dia in (('sun', SUN_ANGULAR_DIAMETER_DEG), ('moon', MOON_ANGULAR_DIAMETER_DEG)):
+        b_alt, b_az = grid.altaz(body, lat, lon, t_offsets)
+        valid = (b_alt >= TRANSIT_STRIP_MIN_BODY_ALT_DEG) & (h_km > 0)
+        n_valid = np.cumprod(valid, axis=1).sum(axis=1) # Slices before the first invalid one
+        if not (n_valid > 1).any(): continue
+        alt_r = np.radians(np.where(valid, b_alt, 90.0))
+        shadow_bearing = (b_az + 180.0) % 360.0
+        c_lat, c_lon = destination_point_batch(lat, lon, shadow_bearing, h_km / np.tan(alt_r))
+        half_w = h_km * tan(radians(dia / 2.0)) / np.sin(alt_r)
+        l_lat, l_lon = destination_point_batch(c_lat, c_lon, shadow_bearing - 90.0, half_w)
+        r_lat, r_lon = destination_point_batch(c_lat, c_lon, shadow_bearing + 90.0, half_w)
+        centre, left, right = (np.stack(pair, axis=-1) for pair in ((c_lat, c_lon), (l_lat, l_lon), (r_lat, r_lon)))
+        for n in np.flatnonzero(n_valid > 1):
+            k = n_valid[n]
+            result[icaos[n]][body] = {'polygon': np.concatenate((left[n, :k], right[n, k - 1::-1])), 'centerline': centre[n, :k]}
+    return result
+# --- Transit Strip Cache ---
+TRANSIT_STRIP_TTL = 10.0 # Seconds a strip stays valid while its aircraft's state is unchanged
+TRANSIT_STRIP_MIN_AGE = 2.0 # A state update only forces a recompute once the strip is at least this old
+TRANSIT_STRIP_REFRESH_INTERVAL = 0.25 # Seconds between refresh passes on the async core
+class TransitStripCache:
+    """
+    Transit strips keyed by ICAO, tagged with the aircraft's state version and compute time.
+    The render thread only publishes the ICAOs it wants drawn (request) and reads finished strips
+    (get); refresh() runs off the render thread and recomputes the wanted strips that are missing,
+    older than TRANSIT_STRIP_TTL, or built from an older state (after TRANSIT_STRIP_MIN_AGE).
+    """
+    def __init__(self):
+        self.entries = {}; self.wanted = ()
+        self.computed = 0; self.last_refresh_ms = 0.0
+    def request(self, icaos):
+        self.wanted = tuple(icaos)
+    def get(self, icao):
+        e = self.entries.get(icao)
+        return None if e is None else e[3]
+    def is_stale(self, icao, version, now_epoch):
+        e = self.entries.get(icao)
+        if e is None or e[2] != PREDICTION_HORIZON: return True
+        age = now_epoch - e[1]
+        return age > TRANSIT_STRIP_TTL or (e[0] != version and age >= TRANSIT_STRIP_MIN_AGE)
+    def refresh(self):
+        """Recompute every stale wanted strip in one calculate_transit_strips pass."""
+        wanted = self.wanted; snap = get_aircraft_snapshot(); now = utc_now()
+        for icao in [k for k in self.entries if k not in wanted]: self.entries.pop(icao, None)
+        stale = {}
+        for icao in wanted:
+            ac = snap.get(icao)
+            if ac is not None and self.is_stale(icao, ac.get('state_version'), now.timestamp()): stale[icao] = ac.get('state_version')
+        if not stale: return 0
+        t0 = time.perf_counter()
+        for icao, strips in calculate_transit_strips(list(stale), now).items():
+            self.entries[icao] = (stale[icao], now.timestamp(), PREDICTION_HORIZON, strips)
+        self.computed += len(stale); self.last_refresh_ms = (time.perf_counter() - t0) * 1000.0
+        return len(stale)
+transit_strips = TransitStripCache()
+# --- Shadow Heatmap ---
+SHADOW_HEATMAP_CELLS = 256 # Raster cells across the map panel
+SHADOW_HEATMAP_INTERVAL = 2.0 # Seconds between heatmap rebuilds on the async core
+SHADOW_HEATMAP_MAX_SAMPLES = 256 # Cap on samples along / across one strip (very low bodies give huge strips)
+SHADOW_HEATMAP_COLORS = {'sun': (255, 190, 60), 'moon': (110, 230, 255)}
+SHADOW_HEATMAP_ALPHA = (60, 200) # Alpha for shadows at the end of the horizon / passing now
+class ShadowHeatmap:
+    """
+    Raster of every active aircraft's predicted Sun/Moon shadow over the map panel, rebuilt on the
+    async core and handed to the UI as one RGBA image. Per body, each cell keeps the earliest shadow
+    passage (epoch seconds) and the number of strips crossing it; sooner passages are drawn more
+    opaque. Strips come from the heatmap's own TransitStripCache and every strip's rasterized cells
+    are kept with it, so a rebuild only rasterizes strips that changed. The UI sets `extent_km`
+    (half the panel size) each frame and reads `image`: (version, grid key, RGBA array) or None.
+    """
+    def __init__(self):
+        self.strips = TransitStripCache(); self.cells = {} # icao -> (strip entry, grid key, {body: (flat, t_epoch)})
+        self.extent_km = None; self.image = None; self.version = 0
+        self.earliest = {}; self.count = {}; self.last_build_ms = 0.0
+    def grid_key(self):
+        return (USER_LAT, USER_LON, self.extent_km, SHADOW_HEATMAP_CELLS)
+    @staticmethod
+    def rasterize(strip, t0_epoch, key):
+        """(flat cell indices, earliest epoch per cell) covered by one strip on the grid described by key."""
+        lat0, lon0, extent_km, n = key
+        cell_km = 2.0 * extent_km / n
+        poly = strip['polygon']; k = len(poly) // 2
+        # Local equirectangular km, the same projection as the map panel
+        r = effective_radius_at_lat(lat0, 0)
+        xy = np.stack(((poly[:, 1] - lon0) * radians(1) * r * max(0.01, cos(radians(lat0))), (poly[:, 0] - lat0) * radians(1) * r), axis=-1)
+        left, right = xy[:k], xy[k:][::-1]
+        seg = np.linalg.norm(np.diff(left + right, axis=0) / 2.0, axis=1).max() if k > 1 else 0.0
+        width = np.linalg.norm(right - left, axis=1).max()
+        n_u = min(SHADOW_HEATMAP_MAX_SAMPLES, max(1, ceil(seg / (cell_km / 2.0))))
+        n_v = min(SHADOW_HEATMAP_MAX_SAMPLES, max(2, ceil(width / (cell_km / 2.0)) + 1))
+        # Bilinear samples between consecutive slices (u) and across the shadow (v)
+        u = np.linspace(0.0, k - 1.0, (k - 1) * n_u + 1)
+        lu = np.stack([np.interp(u, np.arange(k), left[:, d]) for d in (0, 1)], axis=-1)
+        ru = np.stack([np.interp(u, np.arange(k), right[:, d]) for d in (0, 1)], axis=-1)
+        v = np.linspace(0.0, 1.0, n_v)
+        pts = lu[:, None, :] + v[None, :, None] * (ru - lu)[:, None, :]
+        ix = np.floor((pts[..., 0] + extent_km) / cell_km).astype(np.int64)
+        iy = np.floor((extent_km - pts[..., 1]) / cell_km).astype(np.int64)
+        t_s = np.broadcast_to((t0_epoch + u * TRANSIT_STRIP_STEP_SEC)[:, None], ix.shape)
+        inside = (ix >= 0) & (ix < n) & (iy >= 0) & (iy < n)
+        flat, t_s = (iy * n + ix)[inside], t_s[inside]
+        order = np.lexsort((t_s, flat))
+        flat, t_s = flat[order], t_s[order]
+        first = np.r_[True, flat[1:] != flat[:-1]] if len(flat) else np.zeros(0, dtype=bool)
+        return flat[first], t_s[first]
+    def rebuild(self):
+        """Refresh strips for every active aircraft, rasterize the changed ones and publish a new image."""
+        if self.extent_km is None or self.extent_km <= 0: return False
+        t0 = time.perf_counter()
+        self.strips.request([ac['icao'] for ac in get_active_aircraft()])
+        self.strips.refresh()
+        key = self.grid_key(); n = key[3]
+        for icao in [k for k in self.cells if k not in self.strips.entries]: del self.cells[icao]
+        for icao, entry in list(self.strips.entries.items()):
+            cached = self.cells.get(icao)
+            if cached and cached[0] is entry and cached[1] == key: continue
+            self.cells[icao] = (entry, key, {body: self.rasterize(strip, entry[1], key) for body, strip in entry[3].items() if strip is not None})
+        now_epoch = clock.epoch(); horizon = max(1.0, PREDICTION_HORIZON)
+        rgba = np.zeros((n, n, 4), dtype=np.uint8)
+        for body in ('moon', 'sun'): # Sun drawn over Moon
+            earliest = np.full(n * n, np.inf); count = np.zeros(n * n, dtype=np.int32)
+            parts = [c[2][body] for c in self.cells.values() if body in c[2]]
+            if parts:
+                flat = np.concatenate([p[0] for p in parts]); t_s = np.concatenate([p[1] for p in parts])
+                np.minimum.at(earliest, flat, t_s); np.add.at(count, flat, 1)
+            self.earliest[body], self.count[body] = earliest.reshape(n, n), count.reshape(n, n)
+            lead = earliest - now_epoch
+            live = np.isfinite(lead) & (lead >= -TRANSIT_STRIP_STEP_SEC)
+            if not live.any(): continue
+            alpha = SHADOW_HEATMAP_ALPHA[1] - (SHADOW_HEATMAP_ALPHA[1] - SHADOW_HEATMAP_ALPHA[0]) * np.clip(lead / horizon, 0.0, 1.0)
+            px = rgba.reshape(-1, 4)
+            px[live, :3] = SHADOW_HEATMAP_COLORS[body]; px[live, 3] = alpha[live].astype(np.uint8)
+        self.version += 1
+        self.image = (self.version, key, rgba)
+        self.last_build_ms = (time.perf_counter() - t0) * 1000.0
+        return True
+    def clear(self):
+        self.strips.entries.clear(); self.cells.clear(); self.image = None
+shadow_heatmap = ShadowHeatmap()
+# --- OurAirports Cache ---
+OURAIRPORTS_CACHE_DIR = os.path.join(app_dir, "data", "cache", "ourairports")
+OURAIRPORTS_CACHE_FORMAT = 1
+# Columns kept per CSV: float columns (all required, as the row parsers always did), short strings,
+# free text (stored as a UTF-8 blob), the type column (coded) and whether rows get a lat/lon grid.
+OURAIRPORTS_KINDS = {
+    'airports': {'float': {'lat': 'latitude_deg', 'lon': 'longitude_deg'}, 'str': {'ident': 'ident', 'country': 'iso_country'},
+                 'text': {'name': 'name'}, 'type': 'type', 'grid': True},
+    'navaids': {'float': {'lat': 'latitude_deg', 'lon': 'longitude_deg'}, 'str': {'ident': 'ident'},
+                'text': {'name': 'name'}, 'type': 'type', 'grid': True},
+    'runways': {'float': {'le_lat': 'le_latitude_deg', 'le_lon': 'le_longitude_deg', 'he_lat': 'he_latitude_deg', 'he_lon': 'he_longitude_deg', 'length_ft': 'length_ft', 'width_ft': 'width_ft'},
+                'str': {'airport_ident': 'airport_ident', 'le_ident': 'le_ident', 'he_ident': 'he_ident'}, 'text': {}, 'type': None, 'grid': False},
+}
+class OurAirportsTable:
+    """
+    One OurAirports CSV as columns: float64 coordinates, fixed-width ident strings, the type as a
+    uint8 code into `types` and free text as one UTF-8 blob with offsets. Airports and navaids carry
+    a VectorLayer of one-point features as their lat/lon grid; runways are sorted by airport ident.
+    Converted once per CSV and cached as .npy files keyed on its size and mtime (memory-mapped on load),
+    so a type filter change is an array mask instead of a re-read.
+    """
+    def __init__(self, kind, arrays, types=(), rows_read=0, grid=None):
+        self.kind, self.spec, self.arrays, self.types = kind, OURAIRPORTS_KINDS[kind], arrays, tuple(types)
+        self.rows_read, self.grid, self.source = rows_read, grid, None
+    def __len__(self): return len(next(iter(self.arrays.values())))
+    @classmethod
+    def from_csv(cls, filename, kind):
+        spec = OURAIRPORTS_KINDS[kind]
+        floats = {k: [] for k in spec['float']}; strs = {k: [] for k in spec['str']}; texts = {k: [] for k in spec['text']}; types = []
+        rows_read = 0
+        with open(filename, mode='r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                rows_read += 1
+                try:
+                    vals = [float(row[col]) for col in spec['float'].values()]
+                    ty = row[spec['type']] if spec['type'] else ''
+                    if spec['type'] and not ty: continue
+                except (ValueError, TypeError, KeyError): continue
+                for k, v in zip(floats, vals): floats[k].append(v)
+                for k, col in spec['str'].items(): strs[k].append(row.get(col) or '')
+                for k, col in spec['text'].items(): texts[k].append(row.get(col) or '')
+                types.append(ty)
+        arrays = {k: np.array(v, dtype=np.float64) for k, v in floats.items()}
+        arrays.update({k: np.array(v, dtype=np.str_) if v else np.empty(0, dtype='U1') for k, v in strs.items()})
+        for k, v in texts.items():
+            encoded = [s.encode('utf-8') for s in v]
+            arrays[f"{k}_offsets"] = np.concatenate(([0], np.cumsum([len(b) for b in encoded], dtype=np.int64)))
+            arrays[f"{k}_blob"] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        type_names = sorted(set(types))
+        if spec['type']: arrays['type_code'] = np.searchsorted(np.array(type_names), np.array(types)).astype(np.uint8) if types else np.empty(0, dtype=np.uint8)
+        if not spec['grid']:
+            order = np.argsort(arrays['airport_ident'], kind='stable') # Runways of one airport become one slice
+            arrays = {k: (v[order] if k in spec['float'] or k in spec['str'] else v) for k, v in arrays.items()}
+        table = cls(kind, arrays, type_names, rows_read)
+        if spec['grid']: table.grid = VectorLayer.from_features([(np.array([[lon, lat]]), (lon, lon, lat, lat)) for lon, lat in zip(arrays['lon'], arrays['lat'])])
+        return table
+    def text(self, name, i):
+        return bytes(self.arrays[f"{name}_blob"][self.arrays[f"{name}_offsets"][i]:self.arrays[f"{name}_offsets"][i + 1]]).decode('utf-8')
+    def record(self, i):
+        """Row i as the dict the drawing and dialog code use."""
+        rec = {k: str(self.arrays[k][i]) for k in self.spec['str'] if k != 'airport_ident'}
+        if self.spec['type']: rec['type'] = self.types[self.arrays['type_code'][i]]
+        for k in self.spec['text']: rec[k] = self.text(k, i)
+        rec.update({k: float(self.arrays[k][i]) for k in self.spec['float']})
+        return rec
+    def select(self, types):
+        """PointSelection of the rows whose type is in types."""
+        codes = [self.types.index(ty) for ty in types if ty in self.types]
+        return PointSelection(self, np.isin(self.arrays['type_code'], codes))
+    def save(self, cache_dir, source):
+        """Write the columns, the grid (grid/) and meta.json; meta goes last and marks the cache complete."""
+        meta_path = os.path.join(cache_dir, "meta.json")
+        os.makedirs(cache_dir, exist_ok=True)
+        if os.path.exists(meta_path): os.remove(meta_path)
+        for name, arr in self.arrays.items(): np.save(os.path.join(cache_dir, f"{name}.npy"), arr)
+        if self.grid is not None: self.grid.save(os.path.join(cache_dir, "grid"), source)
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump({'format': OURAIRPORTS_CACHE_FORMAT, 'kind': self.kind, 'source': source, 'arrays': list(self.arrays), 'types': list(self.types), 'rows_read': self.rows_read}, f)
+    @classmethod
+    def load(cls, cache_dir, kind, source):
+        """Memory-mapped table from cache_dir, or None if missing or stale."""
         try:
-            app = (eph['earth'] + g_obs).at(t_target).observe(eph[body_name]).apparent()
-            b_alt, b_az, _ = app.altaz()
-            
-            # Only calculate projection if celestial altitude > 0.5° 
-            # (to avoid tangent infinity or near-infinite projection distances)
-            if b_alt.degrees < 0.5: return None
-            
-            # 3. Calculate projection geometry
-            # h_m: Aircraft altitude relative to the ground (meters)
-            h_m = feet_to_km(p_alt) * 1000.0
-            if h_m <= 0: return None
-            
-            # off_m: Horizontal offset from the sub-aircraft point to the shadow center
-            # Formula: dist = h / tan(Elevation)
-            off_m = h_m / tan(b_alt.radians)
-            
-            # 阴影方向是天体方位的反方向 (180度)
-            shadow_bearing = (b_az.degrees + 180) % 360
-            
-            # Shadow bearing is the reciprocal of the celestial body's azimuth (180° offset)
-            # Coordinates of the shadow center
-            c_lat, c_lon = destination_point(p_lat, p_lon, shadow_bearing, m_to_km(off_m))
-            
-            # 4. Calculate shadow width (W)
-            # Width is determined by celestial angular diameter and aircraft altitude. 
-            # Approx: W = 2 * h * tan(AngDia/2) / sin(Elevation)
-            
-            # Simpler geometric approximation for long projections: W = off_m * tan(AngDia)
-            
-            # Alternative: simple physical occlusion geometry:
-            # Half-width of field of view = h / tan(Elevation) * tan(AngDia/2) ?
-            
-            # Using simple tangent projection:
-            # half_w_perp: Width perpendicular to light rays = h * tan(ang_dia/2)
-            # half_w_ground: Projected width on the ground = half_w_perp / sin(Elevation)
-            
-            half_w_ground_m = (h_m * tan(radians(ang_dia_deg / 2.0))) / sin(b_alt.radians)
-            
-            # Calculate the left and right vertices of the slice (perpendicular to shadow bearing)
-            l_lat, l_lon = destination_point(c_lat, c_lon, (shadow_bearing - 90) % 360, m_to_km(half_w_ground_m))
-            r_lat, r_lon = destination_point(c_lat, c_lon, (shadow_bearing + 90) % 360, m_to_km(half_w_ground_m))
-            
-            return (l_lat, l_lon), (r_lat, r_lon), (c_lat, c_lon)
-            
-        except Exception:
-            return None
-
-    # Generate multi-segment polygon
-    # Number of segments: e.g., sampled every 10 seconds, or determined dynamically based on prediction horizon
-
-    step_sec = 10.0
-    steps = int(PREDICTION_HORIZON / step_sec) + 1
-    
-    for body, dia in [('sun', SUN_ANGULAR_DIAMETER_DEG), ('moon', MOON_ANGULAR_DIAMETER_DEG)]:
-        left_points = []
-        right_points = []
-        centers = [] 
-        
-        valid_strip = True
-        for i in range(steps):
-            dt = i * step_sec
-            res = get_shadow_slice(dt, body, dia)
-            if res:
-                lp, rp, cp = res
-                left_points.append(lp)
-                right_points.append(rp)
-                centers.append(cp)
-            else:
-                # If the sequence is interrupted (e.g., sunset), stop or break for rendering safety
-                # Simple implementation: return None if it starts empty; 
-                # if it breaks midway, only render up to the point of interruption.
-                if i == 0: valid_strip = False
-                break
-        
-        if valid_strip and len(left_points) > 1:
-            # Construct a closed polygon vertex sequence: L0 -> Ln -> Rn -> R0
-            poly_geo = left_points + right_points[::-1]
-            transit_data[body] = {
-                'polygon': poly_geo, 
-                'centerline': centers
-            }
-
-    return transit_data
+            with open(os.path.join(cache_dir, "meta.json"), 'r', encoding='utf-8') as f: meta = json.load(f)
+        except (OSError, ValueError): return None
+        if meta.get('format') != OURAIRPORTS_CACHE_FORMAT or meta.get('kind') != kind or meta.get('source') != source: return None
+        grid = None
+        if OURAIRPORTS_KINDS[kind]['grid']:
+            grid = VectorLayer.load(os.path.join(cache_dir, "grid"), source)
+            if grid is None: return None
+        arrays = {name: np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode='r') for name in meta['arrays']}
+        return cls(kind, arrays, meta['types'], meta['rows_read'], grid)
+class PointSelection:
+    """Airports or navaids of the selected types: iterates as record dicts, in_view() goes through the grid."""
+    def __init__(self, table, mask):
+        self.table, self.mask = table, mask
+        self.rows = np.flatnonzero(mask)
+    def __len__(self): return len(self.rows)
+    def __iter__(self): return (self.table.record(i) for i in self.rows)
+    def in_view(self, min_lat, max_lat, min_lon, max_lon):
+        ids = self.table.grid.query(min_lon, max_lon, min_lat, max_lat)
+        return [self.table.record(i) for i in ids[self.mask[ids]]]
+class RunwaysByAirport:
+    """Runway records by airport ident over a runway table sorted on that column (lookups are two bisections)."""
+    def __init__(self, table):
+        self.table = table; self.idents = table.arrays['airport_ident']
+    def _span(self, ident):
+        return np.searchsorted(self.idents, ident, 'left'), np.searchsorted(self.idents, ident, 'right')
+    def __contains__(self, ident):
+        if not ident: return False
+        lo, hi = self._span(ident); return hi > lo
+    def __getitem__(self, ident):
+        lo, hi = self._span(ident) if ident else (0, 0)
+        return [self.table.record(i) for i in range(lo, hi)]
+    def __len__(self): return len(self.idents)
+def points_in_view(points, min_lat, max_lat, min_lon, max_lon):
+    """Records of an airport/navaid collection inside the view box (grid query, or a scan for plain lists)."""
+    if isinstance(points, PointSelection): return points.in_view(min_lat, max_lat, min_lon, max_lon)
+    return [p for p in points if min_lat <= p['lat'] <= max_lat and min_lon <= p['lon'] <= max_lon]
+ourairports_tables = {} # kind -> OurAirportsTable, kept so filter changes only re-mask
+def load_ourairports_table(filename, kind):
+    """The cached table for one OurAirports CSV, converting it first if the cache is missing or stale."""
+    st = os.stat(filename); source = [st.st_size, st.st_mtime_ns]
+    table = ourairports_tables.get(kind)
+    if table is not None and table.source == source: return table
+    cache_dir = os.path.join(OURAIRPORTS_CACHE_DIR, kind)
+    try: table = OurAirportsTable.load(cache_dir, kind, source)
+    except Exception as e: print(f"Cache load failed for {kind}, rebuilding... ({e})"); table = None
+    if table is None:
+        table = OurAirportsTable.from_csv(filename, kind)
+        try:
+            table.save(cache_dir, source)
+            print(f"Built cache for {kind}")
+        except Exception as e:
+            print(f"Failed to write cache for {kind}: {e}")
+    table.source = source
+    ourairports_tables[kind] = table
+    return table
 def load_airports(filename=AIRPORTS_CSV, types_to_show=None):
     if types_to_show is None: types_to_show=[]
-    data,valid_types=[],set(types_to_show)
     try:
-        with open(filename,mode='r',encoding='utf-8')as f:
-            r=csv.DictReader(f);c,s=0,0
-            for row in r:
-                try:
-                    ty,la,lo=row.get('type'),row.get('latitude_deg'),row.get('longitude_deg')
-                    if ty in valid_types and la and lo:data.append({'ident':row['ident'],'type':ty,'name':row['name'],'lat':float(la),'lon':float(lo),'country':row.get('iso_country','')});c+=1
-                    else:s+=1
-                except(ValueError,TypeError,KeyError):s+=1
+        data=load_ourairports_table(filename,'airports').select(types_to_show);c=len(data);s=data.table.rows_read-c
         print(f"Loaded {c} airports ({'/'.join(types_to_show)}) from {filename}. Skipped {s} rows.")
         return data
     except FileNotFoundError:print(f"Error: Airports file not found: {filename}");return[]
     except Exception as e:print(f"Error loading airports: {e}");traceback.print_exc();return[]
-def load_runways(filename=RUNWAYS_CSV, airport_idents_to_load=None):
-    if airport_idents_to_load is None:airport_idents_to_load=set()
-    data=collections.defaultdict(list)
-    if not airport_idents_to_load:print("Warning: No airport idents for runway load.");return data
+def load_runways(filename=RUNWAYS_CSV):
+    """Runways of every airport, looked up by airport ident (only the selected airports' are ever drawn)."""
     try:
-        with open(filename,mode='r',encoding='utf-8')as f:
-            r=csv.DictReader(f);c,s=0,0
-            for row in r:
-                try:
-                    ap_id=row.get('airport_ident')
-                    if ap_id in airport_idents_to_load:
-                        le_lat,le_lon,he_lat,he_lon,le,wi=float(row['le_latitude_deg']),float(row['le_longitude_deg']),float(row['he_latitude_deg']),float(row['he_longitude_deg']),float(row.get('length_ft',0)),float(row.get('width_ft',0))
-                        data[ap_id].append({'le_lat':le_lat,'le_lon':le_lon,'he_lat':he_lat,'he_lon':he_lon,'length_ft':le,'width_ft':wi,'le_ident':row.get('le_ident',''),'he_ident':row.get('he_ident','')});c+=1
-                    else:s+=1
-                except(ValueError,TypeError,KeyError):s+=1
-        print(f"Loaded {c} runways for {len(airport_idents_to_load)} airport(s) from {filename}. Skipped {s} rows.")
+        table=load_ourairports_table(filename,'runways');data=RunwaysByAirport(table)
+        print(f"Loaded {len(table)} runways from {filename}. Skipped {table.rows_read-len(table)} rows.")
         return data
-    except FileNotFoundError:print(f"Error: Runways file not found: {filename}");return data
-    except Exception as e:print(f"Error loading runways: {e}");traceback.print_exc();return data
+    except FileNotFoundError:print(f"Error: Runways file not found: {filename}");return collections.defaultdict(list)
+    except Exception as e:print(f"Error loading runways: {e}");traceback.print_exc();return collections.defaultdict(list)
 def load_navaids(filename=NAVAIDS_CSV, types_to_show=None):
     if types_to_show is None:types_to_show=[]
-    data,valid_types=[],set(types_to_show)
     try:
-        with open(filename,mode='r',encoding='utf-8')as f:
-            r=csv.DictReader(f);c,s=0,0
-            for row in r:
-                try:
-                    ty,la,lo=row.get('type'),row.get('latitude_deg'),row.get('longitude_deg')
-                    if ty in valid_types and la and lo:data.append({'ident':row['ident'],'type':ty,'name':row['name'],'lat':float(la),'lon':float(lo)});c+=1
-                    else:s+=1
-                except(ValueError,TypeError,KeyError):s+=1
+        data=load_ourairports_table(filename,'navaids').select(types_to_show);c=len(data);s=data.table.rows_read-c
         print(f"Loaded {c} navaids ({'/'.join(types_to_show)}) from {filename}. Skipped {s} rows.")
         return data
     except FileNotFoundError:print(f"Error: Navaids file not found: {filename}");return[]
@@ -642,573 +1183,1332 @@ def calculate_glideslope_details(runway_info, selected_runway_end_ident, airport
     if s_lat is None or app_brg is None:return None
     e_lat,e_lon=destination_point(s_lat,s_lon,app_brg,gs_len)
     return{'start_lat':s_lat,'start_lon':s_lon,'end_lat':e_lat,'end_lon':e_lon,'bearing_deg':app_brg,'length_km':gs_len,'runway_end_ident':selected_runway_end_ident}
+# --- Incremental Prediction ---
+# An aircraft's 'state_version' only changes when a report disagrees with the dead-reckoned
+# reference state by more than these tolerances; routine position updates along a steady track keep it.
+STATE_TOL_POS_KM = 0.15; STATE_TOL_ALT_FT = 100; STATE_TOL_SPEED_KTS = 5.0
+STATE_TOL_TRACK_DEG = 1.0; STATE_TOL_VS_FPM = 128
+PREDICTION_CACHE_MAX_AGE = 15.0 # Seconds before a cached result is recomputed even if nothing changed
+NEGATIVE_RESULT_MAX_SHIFT_STEPS = 4 # A cached "no event" may lag the current horizon by this many PREDICTION_STEPs
+STATE_KEYS = ('lat', 'lon', 'altitude', 'speed', 'track', 'vs')
+def state_vectors_changed(ref, cur):
+    """
+    Row-wise over (n, 7) arrays of (epoch_seconds, lat, lon, altitude, speed, track, vs).
+    True where cur is not explained by propagating ref to cur's timestamp, or ref is unset (NaN).
+    """
+    ref = np.asarray(ref, dtype=np.float64).reshape(-1, 7); cur = np.asarray(cur, dtype=np.float64).reshape(-1, 7)
+    p = predict_positions_batch(*ref[:, 1:].T, (cur[:, 0] - ref[:, 0])[:, None])[:, 0]
+    lat1, lat2, d_lon = np.radians(p[:, 0]), np.radians(cur[:, 1]), np.radians(cur[:, 2] - p[:, 1])
+    h = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(d_lon / 2)**2
+    dist_km = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+    steady = ((np.abs(cur[:, 4] - ref[:, 4]) <= STATE_TOL_SPEED_KTS) & (np.abs(cur[:, 6] - ref[:, 6]) <= STATE_TOL_VS_FPM) &
+              (np.abs((cur[:, 5] - ref[:, 5] + 180) % 360 - 180) <= STATE_TOL_TRACK_DEG) &
+              (np.abs(cur[:, 3] - p[:, 2]) <= STATE_TOL_ALT_FT) & (dist_km <= STATE_TOL_POS_KM))
+    return ~steady # NaN anywhere compares False, i.e. "changed"
+def state_vector_changed(ref, cur):
+    """
+    Scalar twin of state_vectors_changed for single messages.
+    ref/cur: (epoch_seconds, lat, lon, altitude, speed, track, vs); ref may be None.
+    """
+    if ref is None or ref[0] != ref[0]: return True
+    t0, lat0, lon0, alt0, spd0, trk0, vs0 = ref
+    t1, lat1, lon1, alt1, spd1, trk1, vs1 = cur
+    if abs(spd1 - spd0) > STATE_TOL_SPEED_KTS or abs(vs1 - vs0) > STATE_TOL_VS_FPM: return True
+    if abs((trk1 - trk0 + 180) % 360 - 180) > STATE_TOL_TRACK_DEG: return True
+    p_lat, p_lon, p_alt = predict_position(lat0, lon0, alt0, spd0, trk0, t1 - t0, vs0)
+    if p_lat is None: return True
+    return abs(alt1 - p_alt) > STATE_TOL_ALT_FT or haversine(p_lat, p_lon, lat1, lon1) > STATE_TOL_POS_KM
+class PredictionCache:
+    """
+    Per-thread store of prediction results keyed by aircraft/pair, tagged with the state versions
+    they were computed from. A hit requires identical versions, an unchanged context (observer
+    and prediction settings) and an age below the entry's max_age (PREDICTION_CACHE_MAX_AGE by default).
+    """
+    def __init__(self):
+        self.entries = {}; self.context = None
+    def begin_cycle(self, context):
+        if context != self.context:
+            self.entries.clear(); self.context = context
+    def lookup(self, key, versions, now):
+        """Returns (hit, result)."""
+        e = self.entries.get(key)
+        if e is None or e[0] != versions or (now - e[1]).total_seconds() > e[3]: return False, None
+        return True, e[2]
+    def store(self, key, versions, now, result, max_age=PREDICTION_CACHE_MAX_AGE):
+        self.entries[key] = (versions, now, result, max_age)
+    def prune(self, live_keys):
+        for key in [k for k in self.entries if k not in live_keys]: del self.entries[key]
+def negative_result_max_age():
+    """
+    Seconds a cached "no event" stays valid for an unchanged state, in both predictors. The horizon
+    slides forward by the entry's age, so an event entering at its far end is seen that much later:
+    capped at a few coarse steps, and at a tenth of CONFLICT_ANGLE_DEG of Sun/Moon motion.
+    """
+    return min(NEGATIVE_RESULT_MAX_SHIFT_STEPS * PREDICTION_STEP, 0.1 * CONFLICT_ANGLE_DEG / CELESTIAL_MAX_RATE_DEG_S)
+def prediction_context():
+    """Settings whose change invalidates every cached prediction."""
+    return (USER_LAT, USER_LON, USER_ALT, CONFLICT_ANGLE_DEG, CONFLICT_RADIUS_KM, PREDICTION_HORIZON, PREDICTION_STEP, REFRACTION_CORRECTION)
+# --- Aircraft Store ---
+class AircraftView:
+    """
+    Dict-like handle on one AircraftStore row, for code written against the old dict-of-dicts.
+    Reads convert columns back to the parsed types (None for unknown); only valid while the row
+    belongs to the same aircraft, so hold the lock while using it.
+    """
+    __slots__ = ('_store', '_row', 'icao')
+    def __init__(self, store, row, icao):
+        self._store, self._row, self.icao = store, row, icao
+    def __getitem__(self, key):
+        st, r = self._store, self._row
+        if key == 'icao': return self.icao
+        if key in st.col: return st.value(r, key)
+        if key == 'timestamp': return datetime.fromtimestamp(st.timestamp[r], timezone.utc)
+        if key == 'history': return st.history(r)
+        if key == 'state_version': return int(st.state_version[r])
+        if key in st.obj: return st.obj[key][r]
+        raise KeyError(key)
+    def __setitem__(self, key, value):
+        st, r = self._store, self._row
+        if key in st.col: st.set_value(r, key, value)
+        elif key in st.obj: st.obj[key][r] = value
+        else: raise KeyError(key)
+    def __contains__(self, key): return key in AircraftStore.KEYS
+    def get(self, key, default=None):
+        try: return self[key]
+        except KeyError: return default
+    def setdefault(self, key, default=None):
+        v = self.get(key)
+        if v is None: self[key] = v = default
+        return v
+    def keys(self): return AircraftStore.KEYS
+    def copy(self): return {k: self[k] for k in AircraftStore.KEYS}
+class AircraftStore:
+    """
+    Columnar aircraft table replacing the dict of per-aircraft dicts.
+    Kinematic fields live in preallocated float64 columns (NaN = unknown) with an ICAO -> row index;
+    rows of removed aircraft are reused. Position history is a per-row ring buffer.
+    Text and bookkeeping fields (callsign, conflict, event_ids, ...) sit in per-row object slots.
+    Mapping-style access (get/items/values/del) returns AircraftView handles. Not thread-safe:
+    callers hold the global lock.
+    """
+    NUMERIC = STATE_KEYS # lat, lon, altitude, speed, track, vs
+    INTEGER = ('altitude', 'vs')
+    OBJECT = ('msg_type', 'callsign', 'squawk', 'conflict', 'event_ids')
+    KEYS = ('icao', 'timestamp', 'history', 'state_version') + NUMERIC + OBJECT
+    def __init__(self, capacity=256, history_len=MAX_HISTORY_POINTS_PER_AC):
+        self.col = {f: k for k, f in enumerate(self.NUMERIC)}
+        self.history_len = history_len
+        self.index = {}; self.free = []; self.size = 0
+        self._alloc(capacity)
+    def _alloc(self, capacity):
+        """(Re)allocate every column to capacity rows, keeping existing rows."""
+        def column(name, shape, fill, dtype=np.float64):
+            new, old = np.full((capacity,) + shape, fill, dtype=dtype), getattr(self, name, None)
+            if old is not None: new[:len(old)] = old
+            setattr(self, name, new)
+        column('icao', (), None, object)
+        column('num', (len(self.NUMERIC),), np.nan)
+        column('timestamp', (), 0.0)
+        column('state_version', (), 0, np.int64)
+        column('state_ref', (7,), np.nan) # t, lat, lon, alt, speed, track, vs of the last version bump
+        column('hist_t', (self.history_len,), 0.0)
+        column('hist_pos', (self.history_len, 3), 0.0, np.float32) # lat, lon, alt_ft
+        column('hist_head', (), 0, np.int32); column('hist_count', (), 0, np.int32); column('hist_limit', (), 0, np.int32)
+        obj = getattr(self, 'obj', {})
+        self.obj = {}
+        for f in self.OBJECT:
+            self.obj[f] = np.empty(capacity, dtype=object)
+            if f in obj: self.obj[f][:len(obj[f])] = obj[f]
+    def _new_row(self, icao):
+        if self.free: row = self.free.pop()
+        else:
+            if self.size == self.icao.shape[0]: self._alloc(2 * self.size)
+            row = self.size; self.size += 1
+        self.icao[row] = icao; self.num[row] = np.nan; self.state_version[row] = 0; self.state_ref[row] = np.nan
+        self.hist_head[row] = self.hist_count[row] = 0
+        self.hist_limit[row] = min(max(int(AIRCRAFT_HISTORY_MINUTES*60/PREDICTION_INTERVAL)+5,50),self.history_len)
+        for f in self.OBJECT: self.obj[f][row] = None
+        self.obj['event_ids'][row] = set()
+        self.index[icao] = row
+        return row
+    def value(self, row, field):
+        v = self.num[row, self.col[field]]
+        if v != v: return None
+        return int(v) if field in self.INTEGER else float(v)
+    def set_value(self, row, field, value):
+        self.num[row, self.col[field]] = np.nan if value is None else value
+    def history(self, row):
+        """Chronological list of (datetime, lat, lon, alt_ft)."""
+        n, lim, head = self.hist_count[row], self.hist_limit[row], self.hist_head[row]
+        order = [(head - n + k) % lim for k in range(n)]
+        return [(datetime.fromtimestamp(self.hist_t[row, k], timezone.utc), *map(float, self.hist_pos[row, k])) for k in order]
+    def update(self, data):
+        """Merge one parsed message (same semantics as the old dict merge: None never overwrites)."""
+        msg = [data.get(f) for f in self.NUMERIC]
+        row = self.merge(data['icao'], data['timestamp'].timestamp(), msg, data.get('msg_type'), data.get('callsign'), data.get('squawk'))
+        if any(v is not None for v in msg):
+            cur = [self.timestamp[row]] + self.num[row].tolist()
+            if all(v == v for v in cur) and state_vector_changed(self.state_ref[row].tolist(), cur):
+                self.state_version[row] += 1
+                self.state_ref[row] = cur
+        return row
+    def apply_batch(self, batch):
+        """Merge a parse_basestation_batch result in arrival order; returns the number of messages applied."""
+        ts_s = batch['timestamp'].timestamp()
+        rows = [self.merge(icao, ts_s, [None if v != v else v for v in row_num], mt, cs, sq)
+                for icao, row_num, mt, cs, sq in zip(batch['icao'], batch['num'].tolist(), batch['msg_type'], batch['callsign'], batch['squawk'])]
+        # State versions are settled once per batch, on the final state of each aircraft touched by kinematic data
+        kinematic = ~np.isnan(batch['num']).all(axis=1)
+        if kinematic.any(): self.refresh_versions(np.asarray(rows)[kinematic])
+        return len(rows)
+    def merge(self, icao, ts_s, msg, msg_type=None, callsign=None, squawk=None):
+        """Core field merge (no version bookkeeping): msg holds the NUMERIC fields, None for absent values."""
+        row = self.index.get(icao)
+        if row is None: row = self._new_row(icao)
+        kinematic = any(v is not None for v in msg)
+        if kinematic:
+            state = self.num[row].tolist()
+            state = [s if v is None else v for s, v in zip(state, msg)]
+            self.num[row] = state
+        if msg_type is not None: self.obj['msg_type'][row] = msg_type
+        if callsign is not None: self.obj['callsign'][row] = callsign
+        if squawk is not None: self.obj['squawk'][row] = squawk
+        self.timestamp[row] = ts_s
+        lat, lon, alt = msg[0], msg[1], msg[2]
+        if lat is not None and lon is not None and alt is not None:
+            head, lim = int(self.hist_head[row]), int(self.hist_limit[row])
+            self.hist_t[row, head] = ts_s; self.hist_pos[row, head] = (lat, lon, alt)
+            self.hist_head[row] = (head + 1) % lim; self.hist_count[row] = min(int(self.hist_count[row]) + 1, lim)
+        return row
+    def refresh_versions(self, rows):
+        """Bump state_version of the given rows whose state vector changed (see state_vectors_changed)."""
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        cur = np.column_stack((self.timestamp[rows], self.num[rows]))
+        complete = ~np.isnan(cur).any(axis=1)
+        rows, cur = rows[complete], cur[complete]
+        changed = state_vectors_changed(self.state_ref[rows], cur)
+        self.state_version[rows[changed]] += 1
+        self.state_ref[rows[changed]] = cur[changed]
+    def remove(self, icao):
+        row = self.index.pop(icao)
+        self.icao[row] = None
+        for f in self.OBJECT: self.obj[f][row] = None
+        self.free.append(row)
+    def expire(self, cutoff_ts):
+        """Drop aircraft not heard from since cutoff_ts (epoch seconds); their rows are reused."""
+        stale = [icao for icao, row in self.index.items() if self.timestamp[row] < cutoff_ts]
+        for icao in stale: self.remove(icao)
+        return stale
+    def complete_rows(self):
+        """Rows whose kinematic state is fully known."""
+        rows = np.fromiter(self.index.values(), dtype=np.int64, count=len(self.index))
+        return rows[~np.isnan(self.num[rows]).any(axis=1)]
+    def activity_counts(self, cutoff_ts):
+        """(aircraft heard since cutoff_ts, of which without a position)."""
+        rows = np.fromiter(self.index.values(), dtype=np.int64, count=len(self.index))
+        active = rows[self.timestamp[rows] >= cutoff_ts]
+        no_pos = np.isnan(self.num[active, self.col['lat']]) | np.isnan(self.num[active, self.col['lon']])
+        return len(active), int(no_pos.sum())
+    def records(self, rows):
+        """Plain dicts (csv_headers + state_version) for the given rows."""
+        num, ts_col = self.num[rows].tolist(), self.timestamp[rows].tolist()
+        out = []
+        for k, row in enumerate(rows):
+            rec = dict(zip(self.NUMERIC, num[k]))
+            for f in self.INTEGER: rec[f] = int(rec[f])
+            rec.update(icao=self.icao[row], msg_type=self.obj['msg_type'][row], callsign=self.obj['callsign'][row],
+                       squawk=self.obj['squawk'][row], timestamp=datetime.fromtimestamp(ts_col[k], timezone.utc),
+                       state_version=int(self.state_version[row]))
+            out.append(rec)
+        return out
+    # Mapping compatibility
+    def __len__(self): return len(self.index)
+    def __contains__(self, icao): return icao in self.index
+    def __getitem__(self, icao): return AircraftView(self, self.index[icao], icao)
+    def __delitem__(self, icao): self.remove(icao)
+    def get(self, icao, default=None):
+        row = self.index.get(icao)
+        return default if row is None else AircraftView(self, row, icao)
+    def keys(self): return list(self.index)
+    def items(self): return [(icao, AircraftView(self, row, icao)) for icao, row in self.index.items()]
+    def values(self): return [AircraftView(self, row, icao) for icao, row in self.index.items()]
+aircraft_dict = AircraftStore() # ICAO -> aircraft; columnar storage behind a dict-like interface
 def update_aircraft(data):
+    global _snapshot_dirty
     with lock:
-        icao,now,lat,lon,alt=data['icao'],data['timestamp'],data.get('lat'),data.get('lon'),data.get('altitude')
-        if icao in aircraft_dict:
-            entry=aircraft_dict[icao]
-            ev_ids=entry.get('event_ids',set())
-            for k,v in data.items():
-                if v is not None:entry[k]=v
-                elif k not in entry:entry[k]=None
-            entry['timestamp'],entry['event_ids']=now,ev_ids
-            if lat is not None and lon is not None and alt is not None:
-                if'history'not in entry:entry['history']=collections.deque(maxlen=min(max(int(AIRCRAFT_HISTORY_MINUTES*60/PREDICTION_INTERVAL)+5,50),MAX_HISTORY_POINTS_PER_AC))
-                entry['history'].append((now,lat,lon,alt))
-        else:
-            base={k:None for k in csv_headers if k!='timestamp'};base.update(data);base['timestamp'],base['event_ids']=now,set()
-            base['history']=collections.deque(maxlen=min(max(int(AIRCRAFT_HISTORY_MINUTES*60/PREDICTION_INTERVAL)+5,50),MAX_HISTORY_POINTS_PER_AC))
-            if lat is not None and lon is not None and alt is not None:base['history'].append((now,lat,lon,alt))
-            aircraft_dict[icao]=base
+        aircraft_dict.update(data)
+        _snapshot_dirty=True
+        if time.monotonic()-_snapshot_published_at>=SNAPSHOT_MIN_INTERVAL:publish_aircraft_snapshot()
+def update_aircraft_batch(batch):
+    """Bulk counterpart of update_aircraft: one lock acquisition per parsed batch."""
+    global _snapshot_dirty
+    with lock:
+        n=aircraft_dict.apply_batch(batch)
+        _snapshot_dirty=True
+        if time.monotonic()-_snapshot_published_at>=SNAPSHOT_MIN_INTERVAL:publish_aircraft_snapshot()
+    return n
+# --- Aircraft Snapshot ---
+SNAPSHOT_MIN_INTERVAL = 0.1 # Seconds between snapshot publications by the listener
+SNAPSHOT_FIELDS = ('lat', 'lon', 'altitude', 'speed', 'track', 'vs')
+class AircraftSnapshot:
+    """
+    Immutable, columnar picture of every aircraft with a complete kinematic state, sorted by ICAO.
+    It is built on the writer side and published by swapping a single reference, so readers take
+    it without the lock and without copying. Columns are read-only arrays; records are read-only
+    mappings (use .copy() for a private dict).
+    """
+    __slots__ = ('created', 'icao', 'index', 'timestamp', 'state_version', 'columns', 'records')
+    def __init__(self, created, records):
+        records = sorted(records, key=lambda r: r['icao'])
+        self.created = created
+        self.icao = tuple(r['icao'] for r in records)
+        self.index = {icao: k for k, icao in enumerate(self.icao)}
+        self.timestamp = np.array([r['timestamp'].timestamp() for r in records], dtype=np.float64)
+        self.state_version = np.array([r.get('state_version', 0) for r in records], dtype=np.int64)
+        self.columns = {f: np.array([r[f] for r in records], dtype=np.float64) for f in SNAPSHOT_FIELDS}
+        for arr in (self.timestamp, self.state_version, *self.columns.values()): arr.flags.writeable = False
+        self.records = tuple(MappingProxyType(r) for r in records)
+    def __len__(self): return len(self.icao)
+    def get(self, icao):
+        k = self.index.get(icao)
+        return None if k is None else self.records[k]
+    def active_indices(self, now=None):
+        """Rows seen within AIRCRAFT_TIMEOUT of now (sorted by ICAO)."""
+        now = utc_now() if now is None else now
+        return np.flatnonzero(now.timestamp() - self.timestamp <= AIRCRAFT_TIMEOUT)
+    def active_records(self, now=None):
+        return [self.records[k] for k in self.active_indices(now)]
+    def state_arrays(self, idx=None):
+        """Same layout as aircraft_state_arrays: (lat, lon, altitude_ft, speed_kts, track_deg, vs_fpm)."""
+        return tuple(self.columns[f] if idx is None else self.columns[f][idx] for f in SNAPSHOT_FIELDS)
+aircraft_snapshot = AircraftSnapshot(start_time, [])
+_snapshot_dirty = False; _snapshot_published_at = 0.0
+def publish_aircraft_snapshot():
+    """Rebuild and swap in the shared snapshot (call with lock held)."""
+    global aircraft_snapshot, _snapshot_dirty, _snapshot_published_at
+    records = aircraft_dict.records(aircraft_dict.complete_rows())
+    aircraft_snapshot = AircraftSnapshot(utc_now(), records)
+    _snapshot_dirty = False; _snapshot_published_at = time.monotonic()
+def get_aircraft_snapshot():
+    """
+    Latest published snapshot. Normally a plain reference read; only when the listener has gone
+    quiet with unpublished updates does the reader publish them itself.
+    """
+    if _snapshot_dirty and time.monotonic() - _snapshot_published_at >= SNAPSHOT_MIN_INTERVAL:
+        with lock:
+            if _snapshot_dirty: publish_aircraft_snapshot()
+    return aircraft_snapshot
 def get_active_aircraft():
     """
-    Retrieve currently active aircraft for map display.
-    Instead of purging timed-out entries immediately, they are filtered based on their timestamp.
+    Retrieve currently active aircraft for map display and prediction.
+    Returns the read-only records of the shared snapshot (no lock, no copies), filtered by timestamp;
+    timed-out entries are kept in aircraft_dict until the garbage collector removes them.
     """
-    now = datetime.now(timezone.utc)
-    active = []
-    
-    with lock:
-    # Read-only operation; dictionary is not modified here to ensure maximum performance.
-        for icao, ac in aircraft_dict.items():
-            # Only aircraft seen within the last AIRCRAFT_TIMEOUT seconds are considered "active" for display.
-            # Expired entries are retained in aircraft_dict to maintain continuity, 
-            # awaiting re-acquisition by new signals or removal by the garbage collector (GC).
-            if (now - ac['timestamp']).total_seconds() <= AIRCRAFT_TIMEOUT:
-                if all(ac.get(k) is not None for k in ('lat', 'lon', 'altitude', 'speed', 'track', 'vs')):
-                    active.append(ac.copy())
-    
-    active.sort(key=lambda x: x['icao'])
-    return active
-def clean_expired_events():
-    global history_event_count
-    while running:
-        now = datetime.now(timezone.utc)
+    return get_aircraft_snapshot().active_records()
+# --- AC-AC Broad Phase ---
+BROAD_PHASE_CHUNK_SEC = 10.0 # Time slice over which each aircraft's sky track is bounded by one cone
+AC_AC_MAX_ALT_DIFF_FT = 5000 # Vertical separation threshold for AC-AC candidates
+def sky_track_candidate_pairs(los, t_grid, threshold_deg, altitudes_ft=None, chunk_sec=BROAD_PHASE_CHUNK_SEC):
+    """
+    Sort-and-sweep broad phase on observer line-of-sight (LOS) unit vectors.
+    los: (N, T, 3) unit vectors sampled on t_grid. The horizon is cut into chunk_sec slices; within
+    each slice every aircraft's sampled sky track is bounded by a cone (mean axis, max half-angle).
+    Cones are swept along the Cartesian axis with the largest spread (a projection never exceeds the
+    arc length, so the 1-D overlap test is conservative) and surviving pairs are confirmed with the
+    exact cone-vs-cone test. Returns a sorted (K, 2) int array of pairs (i < j).
+    """
+    n = los.shape[0]
+    if n < 2: return np.empty((0, 2), dtype=np.int64)
+    thr = radians(threshold_deg)
+    step = (t_grid[1] - t_grid[0]) if len(t_grid) > 1 else chunk_sec
+    samples_per_chunk = max(1, int(round(chunk_sec / step)))
+    found = []
+    for k0 in range(0, los.shape[1], samples_per_chunk):
+        seg = los[:, k0:k0 + samples_per_chunk, :]
+        axis = seg.mean(axis=1)
+        axis_norm = np.linalg.norm(axis, axis=1, keepdims=True)
+        axis = np.divide(axis, axis_norm, out=np.zeros_like(axis), where=axis_norm > 1e-9)
+        radius = np.arccos(np.clip(np.einsum('ntk,nk->nt', seg, axis), -1.0, 1.0)).max(axis=1)
+        radius[axis_norm[:, 0] <= 1e-9] = np.pi # Degenerate track: cone covers the whole sky
+        # Sweep along the most discriminating axis
+        coord = axis[:, int(np.argmax(axis.std(axis=0)))]
+        half_w = radius + thr / 2.0
+        order = np.argsort(coord - half_w)
+        lo_s, hi_s = (coord - half_w)[order], (coord + half_w)[order]
+        ends = np.searchsorted(lo_s, hi_s, side='right')
+        counts = np.maximum(ends - np.arange(n) - 1, 0)
+        if not counts.any(): continue
+        first = np.repeat(np.arange(n), counts)
+        second = first + 1 + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+        a, b = order[first], order[second]
+        # Exact cone overlap test
+        axis_ang = np.arccos(np.clip(np.einsum('nk,nk->n', axis[a], axis[b]), -1.0, 1.0))
+        keep = axis_ang <= radius[a] + radius[b] + thr
+        found.append(np.stack((np.minimum(a, b)[keep], np.maximum(a, b)[keep]), axis=1))
+    if not found: return np.empty((0, 2), dtype=np.int64)
+    pairs = np.unique(np.concatenate(found), axis=0)
+    if altitudes_ft is not None and len(pairs):
+        alts = np.asarray(altitudes_ft, dtype=np.float64)
+        pairs = pairs[np.abs(alts[pairs[:, 0]] - alts[pairs[:, 1]]) <= AC_AC_MAX_ALT_DIFF_FT]
+    return pairs
+# --- Prediction Scheduling ---
+PREDICTION_BUDGET_FRACTION = 0.5 # Share of PREDICTION_INTERVAL a full cycle may spend refining before deferring the rest
+PRIORITY_SUBDIVISIONS = 4 # Focused refreshes of the high-priority aircraft per PREDICTION_INTERVAL
+PRIORITY_MIN_INTERVAL = 0.2 # Floor on the seconds between focused refreshes
+PRIORITY_BUDGET_FRACTION = 0.5 # Share of priority_interval() a focus cycle may spend refining before deferring the rest
+PRIORITY_TIME_SEC = 30.0 # Predicted events (or unrefined coarse hits) sooner than this are high priority
+PRIORITY_WAVE = 16 # Work units refined between budget checks (per worker when pooled)
+class PriorityScheduler:
+    """
+    Fine-phase work ordering for one predictor. Work units (pairs or aircraft) run soonest coarse
+    hit first, then smallest angular margin; units deferred by the previous cycle go ahead of
+    everything so nothing starves. After each full cycle the aircraft with an event within
+    PRIORITY_TIME_SEC, or a coarse hit that soon still awaiting refinement, form the hot set that
+    the async core re-predicts every priority_interval().
+    """
+    def __init__(self):
+        self.hot = frozenset(); self.deferred = set(); self.focus_cycles = 0
+    def order(self, keys, t_first, margin):
+        """Processing order (indices into keys)."""
+        late = np.array([k in self.deferred for k in keys], dtype=bool)
+        return np.lexsort((margin, t_first, ~late))
+    def run(self, units, compute, wave, budget_sec):
+        """
+        Feed ordered units to compute(wave_units) -> (results, solver_runs) until budget_sec is spent
+        (None: no limit). Returns (results, solver_runs, deferred_units, seconds_used).
+        """
+        t0 = time.perf_counter(); results, solver_runs = [], []; k = 0
+        while k < len(units):
+            if budget_sec is not None and k and time.perf_counter() - t0 > budget_sec: break
+            r, s = compute(units[k:k + wave]); results.extend(r); solver_runs.extend(s); k += wave
+        return results, solver_runs, units[k:], time.perf_counter() - t0
+acac_scheduler = PriorityScheduler(); celestial_scheduler = PriorityScheduler()
+def priority_interval():
+    """Seconds between focused refreshes: a fixed share of the (configurable) PREDICTION_INTERVAL."""
+    return max(PRIORITY_MIN_INTERVAL, PREDICTION_INTERVAL / PRIORITY_SUBDIVISIONS)
+def schedule_stats(scheduler, used, budget, done, deferred):
+    return {'used': used, 'budget': budget, 'done': done, 'deferred': deferred, 'hot': len(scheduler.hot), 'focus': scheduler.focus_cycles}
+def state_record(states, k, ident):
+    """Aircraft dict for row k of a (N, 6) SNAPSHOT_FIELDS state array; ident = (icao, callsign, state_version)."""
+    icao, callsign, version = ident
+    rec = dict(zip(SNAPSHOT_FIELDS, (float(x) for x in states[k])))
+    rec.update(icao=icao, callsign=callsign, state_version=version)
+    return rec
+def acac_fine_phase(states, ids, los, los_norm, t_grid, pairs, now):
+    """
+    AC-AC narrow phase for broad-phase candidate pairs (row indices into states/ids/los).
+    Depends only on its arguments and the prediction settings, so a pool worker runs it unchanged.
+    Returns ([(i, j, event dict or None)], solver_runs).
+    """
+    results = []; solver_runs = []
+    frame = get_observer_frame()
+    for i, j in pairs:
+        ac1, ac2 = state_record(states, i, ids[i]), state_record(states, j, ids[j])
+        ed = None
         
-        with lock:
-            # --- 1. clean events  ---
-            all_eids = list(event_dict.keys())
-            to_remove_events = []
-            for eid in all_eids:
-                ev = event_dict.get(eid)
-                if ev:
-                # Remove if last_update has timed out or is missing (anomaly)
-                    if 'last_update' in ev and (now - ev['last_update']).total_seconds() > EVENT_TIMEOUT:
-                        to_remove_events.append(eid)
-                    elif 'last_update' not in ev:
-                        to_remove_events.append(eid)
+        # Coarse search: line-of-sight (LOS) angular separation of the pair over the whole grid
+        ang_series = np.degrees(np.arccos(np.clip(np.einsum('ij,ij->i', los[i], los[j]), -1.0, 1.0)))
+        ang_series[(los_norm[i, :, 0] == 0) | (los_norm[j, :, 0] == 0)] = 180.0
+        
+        # Only the first grid step inside the threshold is refined (one event per pair)
+        for dt in t_grid[np.flatnonzero(ang_series <= CONFLICT_ANGLE_DEG)[:1]]:
+            precise_t, min_dist, solver_info = solve_closest_approach(ac1, ac2, dt, window=PREDICTION_STEP * 1.5)
+            solver_runs.append(solver_info)
             
-            for eid in to_remove_events:
-                ev_data = event_dict.pop(eid, None)
-                if ev_data:
-                    pass 
-                    
-                # Clear event references from associated aircraft records
-                try:
-                    if isinstance(eid, tuple):
-                        for item in eid:
-                            if isinstance(item, str) and len(item) == 6: # ICAO check 
-                                ac = aircraft_dict.get(item)
-                                if ac and 'event_ids' in ac:
-                                    ac['event_ids'].discard(eid)
-                except: pass
-
-            # --- 2. Garbage Collection ---
-            # Purge aircraft records that have been inactive for an extended period (exceeding DATA_RETENTION_SECONDS)
-            # This retains aircraft during short-term signal dropouts, ensuring flight trail continuity.
-            stale_icaos = []
-            for icao, ac in aircraft_dict.items():
-                if (now - ac['timestamp']).total_seconds() > DATA_RETENTION_SECONDS:
-                    stale_icaos.append(icao)
+            # --- Precision Refinement (Narrow Phase) ---
+            p1_f = predict_position(ac1['lat'], ac1['lon'], ac1['altitude'], ac1['speed'], ac1['track'], precise_t, ac1['vs'])
+            p2_f = predict_position(ac2['lat'], ac2['lon'], ac2['altitude'], ac2['speed'], ac2['track'], precise_t, ac2['vs'])
             
-            for icao in stale_icaos:
-                del aircraft_dict[icao]
-                # print(f"GC: Removed stale aircraft {icao}")
-
-            # --- 3. Reset conflict status flags ---
-            active_eids = set()
-            for eid, ev in event_dict.items():
-                if ev['type'] in ['AC-Sun', 'AC-Moon']: active_eids.add(eid[0])
-                elif ev['type'] == 'AC-AC': 
-                    active_eids.add(eid[0])
-                    active_eids.add(eid[1])
+            if p1_f[0] is None or p2_f[0] is None: break
+            event_lat = (p1_f[0] + p2_f[0]) / 2.0
+            event_lon = (p1_f[1] + p2_f[1]) / 2.0
+            event_alt = (p1_f[2] + p2_f[2]) / 2.0 if p1_f[2] and p2_f[2] else 0
+            dist_event_to_user = haversine(USER_LAT, USER_LON, event_lat, event_lon)
             
-            for icao, data in aircraft_dict.items():
-                if icao not in active_eids:
-                    data['conflict'] = None
+            if dist_event_to_user > CONFLICT_RADIUS_KM:
+                break 
+            precise_angle = angle_between(USER_LAT, USER_LON, USER_ALT_FT, 
+                                          p1_f[0], p1_f[1], p1_f[2], 
+                                          p2_f[0], p2_f[1], p2_f[2])
 
-        time.sleep(1) 
-    print("Cleaner thread exiting.")
-def predict_conflicts():
+            pov_data = {'valid': False}
+            try:
+                dt_vec = 2.0
+                p1_v = predict_position(ac1['lat'], ac1['lon'], ac1['altitude'], ac1['speed'], ac1['track'], precise_t + dt_vec, ac1['vs'])
+                p2_v = predict_position(ac2['lat'], ac2['lon'], ac2['altitude'], ac2['speed'], ac2['track'], precise_t + dt_vec, ac2['vs'])
+
+                def get_azel(geo_pos):
+                    if geo_pos[0] is None: return 0, 0
+                    _, alt_deg, az_deg, _ = frame.geodetic_line_of_sight(*geo_pos)
+                    return float(az_deg), float(alt_deg)
+
+                az1, el1 = get_azel(p1_f)
+                az2, el2 = get_azel(p2_f)
+                az1_v, el1_v = get_azel(p1_v)
+                az2_v, el2_v = get_azel(p2_v)
+
+                pov_data = {
+                    'valid': True,
+                    'ac1': {'az': az1, 'el': el1, 'az_vec': az1_v, 'el_vec': el1_v},
+                    'ac2': {'az': az2, 'el': el2, 'az_vec': az2_v, 'el_vec': el2_v}
+                }
+            except: pass
+
+            cs = sorted([ac1.get('callsign') or ac1['icao'], ac2.get('callsign') or ac2['icao']])
+            ed = {
+                'type': 'AC-AC',
+                'callsigns': cs,
+                'time': now + timedelta(seconds=precise_t),
+                'angle': precise_angle,
+                'min_dist_km': min_dist,
+                'precise_t': precise_t,
+                'pov': pov_data,
+                'solver': solver_info,
+                'last_update': now,
+                'lat': event_lat, 'lon': event_lon, 'alt': event_alt,
+                'ac1_state': ac1,
+                'ac2_state': ac2
+            }
+            break 
+        results.append((i, j, ed))
+    return results, solver_runs
+def predict_conflicts(max_cycles=None, cache=None, budget=None, focus=None):
+    # max_cycles: stop after that many cycles (async core / headless benchmark); None loops until shutdown.
+    # cache: PredictionCache kept by the caller across calls; a fresh one otherwise.
+    # budget: seconds of fine-phase work per cycle before the rest is deferred (None: no limit).
+    # focus: only these ICAOs (the scheduler's hot set); cycle-wide stats and cache pruning are skipped.
     # Expand the simulation radius to include distant aircraft,
     # provided their predicted convergence point is within the event horizon.
     SIMULATION_RADIUS_KM = 300.0 
-
-    while running:
-        active_ac = get_active_aircraft()
+    if cache is None: cache = PredictionCache() # (icao1, icao2) -> event dict or None
+    shared = shared_blocks['acac'] # Arrays handed to pool workers (one segment for the session)
+
+    def publish(eid, ed, ac1, ac2):
+        post_event(eid, ed, (ac1['icao'], ac2['icao']), f"CPA: {ed['min_dist_km']:.2f}km / {ed['angle']:.1f}°")
+
+    def pause():
+        if max_cycles is None or cycles < max_cycles: clock.sleep(PREDICTION_INTERVAL)
+
+    cycles = 0
+    while running and (max_cycles is None or cycles < max_cycles):
+        cycles += 1
+        now = utc_now()
+        snapshot = get_aircraft_snapshot()
+        active_idx = snapshot.active_indices(now)
+        if focus is not None: active_idx = active_idx[np.array([snapshot.icao[k] in focus for k in active_idx], dtype=bool)]
+        active_ac = [snapshot.records[k] for k in active_idx]
         n_active = len(active_ac)
-        now = datetime.now(timezone.utc)
+        cache.begin_cycle(prediction_context())
         
-        earth_obj = None
-        user_obs = None
-        if eph and observer_topos:
-            earth_obj = eph['earth']
-            user_obs = earth_obj + observer_topos
-
-        for i in range(n_active):
-            for j in range(i + 1, n_active):
-                ac1, ac2 = active_ac[i], active_ac[j]
-                
-                # 1. Basic position sanity check
-                ac1_lat, ac1_lon = ac1.get('lat'), ac1.get('lon')
-                ac2_lat, ac2_lon = ac2.get('lat'), ac2.get('lon')
-                if None in [ac1_lat, ac1_lon, ac2_lat, ac2_lon]: continue
-                
-                # 2.Larger SIMULATION_RADIUS
+        # Propagate every aircraft over the whole horizon once, then reuse the
+        # observer-relative line-of-sight unit vectors for all pair checks.
+        t_grid = prediction_time_grid()
+        candidate_pairs = []
+        if n_active >= 2:
+            states = np.column_stack(snapshot.state_arrays(active_idx))
+            ac_ecef = geodetic_to_ecef_batch(predict_positions_batch(*states.T, t_grid))
+            # Geometric (unrefracted) directions: refraction is a display correction, not a separation one
+            los, _, _, los_norm = get_observer_frame().line_of_sight(ac_ecef, refraction=False)
+            los_norm = los_norm[..., None]
+
+            # Broad phase: only aircraft inside SIMULATION_RADIUS whose sky tracks can come within
+            # CONFLICT_ANGLE_DEG (and within the altitude band) are passed to the fine search.
+            lat0, lon0, alt0 = (snapshot.columns[f][active_idx] for f in ('lat', 'lon', 'altitude'))
+            in_range = np.flatnonzero([haversine(USER_LAT, USER_LON, la, lo) <= SIMULATION_RADIUS_KM for la, lo in zip(lat0, lon0)])
+            local_pairs = sky_track_candidate_pairs(los[in_range], t_grid, CONFLICT_ANGLE_DEG, altitudes_ft=alt0[in_range])
+            candidate_pairs = in_range[local_pairs].tolist()
+        if focus is None:
+            with lock:
+                prediction_stats['acac_pairs_total'] = n_active * (n_active - 1) // 2
+                prediction_stats['acac_pairs_candidates'] = len(candidate_pairs)
+
+        # Reuse the last result while neither aircraft's state vector has changed
+        reused = 0; live_keys = set(); misses = []; hot = set()
+        for i, j in candidate_pairs:
+            ac1, ac2 = active_ac[i], active_ac[j]
+            pair_key = (ac1['icao'], ac2['icao'])
+            live_keys.add(pair_key)
+            hit, cached = cache.lookup(pair_key, (ac1.get('state_version'), ac2.get('state_version')), now)
+            if hit and (cached is None or cached['time'] > now):
+                reused += 1
+                if cached is not None:
+                    ed = dict(cached, last_update=now, precise_t=(cached['time'] - now).total_seconds())
+                    publish(tuple(sorted(pair_key)) + ('AC-AC',), ed, ac1, ac2)
+                    if ed['precise_t'] < PRIORITY_TIME_SEC: hot.update(pair_key)
+            else: misses.append((i, j))
+
+        # Fine phase for the rest: most urgent pairs first (coarse time to the threshold, then
+        # margin), split across the worker pool when there is enough work, within the cycle budget
+        fine, solver_runs, deferred, used = [], [], [], 0.0
+        if misses:
+            pi, pj = np.array(misses).T
+            sep = np.degrees(np.arccos(np.clip(np.einsum('ptk,ptk->pt', los[pi], los[pj]), -1.0, 1.0)))
+            sep[(los_norm[pi, :, 0] == 0) | (los_norm[pj, :, 0] == 0)] = 180.0
+            within = sep <= CONFLICT_ANGLE_DEG
+            t_first = np.where(within.any(axis=1), t_grid[within.argmax(axis=1)], np.inf)
+            margin = sep.min(axis=1) - CONFLICT_ANGLE_DEG
+            keys = [(active_ac[i]['icao'], active_ac[j]['icao']) for i, j in misses]
+            order = acac_scheduler.order(keys, t_first, margin)
+            misses = [misses[k] for k in order]; t_first = t_first[order]
+            ids = [(ac['icao'], ac.get('callsign'), ac.get('state_version')) for ac in active_ac]
+            pool = prediction_pool if len(misses) >= POOL_MIN_PAIRS else None
+            ref = None
+            def compute(wave):
+                nonlocal pool, ref
+                if pool:
+                    try:
+                        if ref is None: ref = shared.publish(states=states, los=los, los_norm=los_norm)
+                        return pool.run(acac_pool_task, wave, ref, prediction_context(), ids, now)
+                    except Exception as e: print(f"[!] AC-AC pool error ({e}); refining in-process."); pool = None
+                return acac_fine_phase(states, ids, los, los_norm, t_grid, wave, now)
+            fine, solver_runs, deferred, used = acac_scheduler.run(misses, compute, PRIORITY_WAVE * (pool.workers if pool else 1), budget)
+            for (i, j), t_f in zip(deferred, t_first[len(fine):]):
+                if t_f < PRIORITY_TIME_SEC: hot.update((active_ac[i]['icao'], active_ac[j]['icao']))
+
+        for i, j, ed in fine:
+            ac1, ac2 = active_ac[i], active_ac[j]
+            cache.store((ac1['icao'], ac2['icao']), (ac1.get('state_version'), ac2.get('state_version')), now, ed,
+                        max_age=PREDICTION_CACHE_MAX_AGE if ed is not None else negative_result_max_age())
+            if ed is None: continue
+            publish(tuple(sorted((ac1['icao'], ac2['icao']))) + ('AC-AC',), ed, ac1, ac2)
+            if ed['precise_t'] < PRIORITY_TIME_SEC: hot.update((ac1['icao'], ac2['icao']))
+            add_log(f"Conflict: {ed['callsigns'][0]}-{ed['callsigns'][1]}, Dist: {ed['min_dist_km']:.2f}km, EventDist: {haversine(USER_LAT, USER_LON, ed['lat'], ed['lon']):.1f}km")
+
+        if focus is None:
+            cache.prune(live_keys)
+            acac_scheduler.hot = frozenset(hot)
+            acac_scheduler.deferred = {(active_ac[i]['icao'], active_ac[j]['icao']) for i, j in deferred}
+            with lock:
+                prediction_stats['acac_solver'] = summarize_solver_runs(solver_runs)
+                prediction_stats['acac_reused'] = (reused, len(candidate_pairs))
+                prediction_stats['acac_schedule'] = schedule_stats(acac_scheduler, used, budget, len(fine), len(deferred))
+        else:
+            acac_scheduler.focus_cycles += 1
+            acac_scheduler.deferred |= {(active_ac[i]['icao'], active_ac[j]['icao']) for i, j in deferred} # First in line next cycle
+        pause()
+# --- Observer Local ENU Frame ---
+REFRACTION_CORRECTION = False # Apply standard-atmosphere refraction to aircraft and body elevations
+def altaz_to_enu(alt_deg, az_deg):
+    """Alt/az (degrees) to local East-North-Up unit vectors, trailing axis of 3."""
+    alt_r, az_r = np.radians(alt_deg), np.radians(az_deg)
+    return np.stack((np.cos(alt_r) * np.sin(az_r), np.cos(alt_r) * np.cos(az_r), np.sin(alt_r)), axis=-1)
+def enu_to_altaz(enu):
+    """Inverse of altaz_to_enu: returns (alt_deg, az_deg) for (possibly non-unit) ENU vectors."""
+    enu = np.asarray(enu, dtype=np.float64)
+    alt = np.degrees(np.arctan2(enu[..., 2], np.hypot(enu[..., 0], enu[..., 1])))
+    az = np.degrees(np.arctan2(enu[..., 0], enu[..., 1])) % 360.0
+    return alt, az
+def angular_separation_deg(u, v):
+    """Angle (degrees) between unit vectors along the trailing axis."""
+    return np.degrees(np.arccos(np.clip(np.sum(u * v, axis=-1), -1.0, 1.0)))
+def refraction_correction_deg(alt_deg):
+    """Standard-atmosphere refraction (Saemundsson, 10°C / 1010 mbar): true -> apparent elevation offset, degrees."""
+    h = np.clip(alt_deg, -1.0, 90.0)
+    return np.maximum(1.02 / np.tan(np.radians(h + 10.3 / (h + 5.11))) / 60.0, 0.0)
+class ObserverFrame:
+    """
+    Observer-fixed East-North-Up frame on the WGS84 ellipsoid (A, F, B).
+    Converts batched aircraft ECEF positions (km) into line-of-sight unit vectors and alt/az
+    with plain NumPy; light-time and aberration are irrelevant for targets a few km away.
+    """
+    def __init__(self, lat_deg, lon_deg, alt_m):
+        self.key = (lat_deg, lon_deg, alt_m)
+        self.origin = geodetic_to_ecef_batch(np.array([lat_deg, lon_deg, alt_m * 3.28084]))
+        sp, cp = sin(radians(lat_deg)), cos(radians(lat_deg))
+        sl, cl = sin(radians(lon_deg)), cos(radians(lon_deg))
+        self.rotation = np.array([[-sl, cl, 0.0], [-sp * cl, -sp * sl, cp], [cp * cl, cp * sl, sp]])
+    def to_enu(self, ecef):
+        """ECEF (km, trailing axis of 3) -> observer-relative ENU (km)."""
+        return (np.asarray(ecef, dtype=np.float64) - self.origin) @ self.rotation.T
+    def line_of_sight(self, ecef, refraction=None):
+        """
+        Returns (unit_enu, alt_deg, az_deg, range_km) for ECEF positions of any leading shape.
+        Points coinciding with the observer get a zero unit vector.
+        """
+        if refraction is None: refraction = REFRACTION_CORRECTION
+        enu = self.to_enu(ecef)
+        rng = np.linalg.norm(enu, axis=-1)
+        alt, az = enu_to_altaz(enu)
+        if refraction:
+            alt = alt + refraction_correction_deg(alt)
+            unit = np.where(rng[..., None] > 0, altaz_to_enu(alt, az), 0.0)
+        else:
+            unit = np.divide(enu, rng[..., None], out=np.zeros_like(enu), where=rng[..., None] > 0)
+        return unit, alt, az, rng
+    def geodetic_line_of_sight(self, lat, lon, alt_ft, refraction=None):
+        """Convenience wrapper for geodetic inputs (scalars or arrays)."""
+        geo = np.stack(np.broadcast_arrays(np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64), np.asarray(alt_ft, dtype=np.float64)), axis=-1)
+        return self.line_of_sight(geodetic_to_ecef_batch(geo), refraction)
+_observer_frame = None
+def get_observer_frame():
+    """ENU frame for the configured USER_LAT/USER_LON/USER_ALT, rebuilt only when the location changes."""
+    global _observer_frame
+    key = (USER_LAT, USER_LON, USER_ALT)
+    frame = _observer_frame
+    if frame is None or frame.key != key:
+        frame = ObserverFrame(*key)
+        _observer_frame = frame
+    return frame
+# --- Celestial Body Ephemeris Table ---
+class CelestialBodyTable:
+    """
+    Topocentric apparent Sun/Moon positions for one prediction cycle.
+    Each body is evaluated once over the whole horizon grid with a single vectorized
+    Skyfield call (Time arrays); sub-step times are linearly interpolated.
+    """
+    BODIES = ('sun', 'moon')
+    def __init__(self, observer, start_time_utc, t_offsets):
+        self.start_time_utc = start_time_utc
+        self.t_offsets = np.asarray(t_offsets, dtype=np.float64)
+        t0 = ts.from_datetime(start_time_utc)
+        t_arr = ts.tt_jd(t0.tt + self.t_offsets / 86400.0)
+        self.alt_deg, self.az_deg, self.enu = {}, {}, {}
+        for body in self.BODIES:
+            alt, az, _ = observer.at(t_arr).observe(eph[body]).apparent().altaz()
+            alt_deg = alt.degrees + refraction_correction_deg(alt.degrees) if REFRACTION_CORRECTION else alt.degrees
+            self.alt_deg[body], self.az_deg[body] = alt_deg, az.degrees
+            self.enu[body] = altaz_to_enu(alt_deg, az.degrees)
+    def unit_vectors(self, body, t_sec):
+        """Interpolated ENU unit vector(s) of body at offset(s) t_sec (seconds from start)."""
+        t = np.asarray(t_sec, dtype=np.float64)
+        grid = self.enu[body]
+        v = np.stack([np.interp(t, self.t_offsets, grid[:, k]) for k in range(3)], axis=-1)
+        return v / np.linalg.norm(v, axis=-1, keepdims=True)
+    def altaz(self, body, t_sec):
+        """Interpolated (alt_deg, az_deg) of body at offset(s) t_sec."""
+        return enu_to_altaz(self.unit_vectors(body, t_sec))
+CELESTIAL_BODIES = (('sun', 'Sun'), ('moon', 'Moon'))
+ADAPTIVE_STEPPING = True # Coarse celestial search skips grid steps that provably cannot reach CONFLICT_ANGLE_DEG
+CELESTIAL_MAX_RATE_DEG_S = 0.0045 # Upper bound on the Sun's/Moon's apparent motion (~15°/h)
+ADAPTIVE_SAFETY = 0.8 # Fraction of the angular margin the skip bound may use (refraction, curvature)
+PREFILTER_PAD_DEG = 0.5 # Extra slack on the prefilter cone test (refraction, Earth curvature)
+def celestial_prefilter(states, frame, body_table, t_grid):
+    """
+    Per-cycle early-out before the coarse search. Returns a (N, bodies) mask of aircraft/body
+    combinations that can possibly come within CONFLICT_ANGLE_DEG over t_grid.
+    A body that stays below the horizon for the whole horizon rejects every aircraft. Otherwise the
+    body's up-time path is bounded by a cone (centre, radius) and each aircraft by the cone its line
+    of sight can reach from its current position: asin(v*T/r) for speed v, horizon T and range r.
+    Aircraft whose cone never rises above the horizon, or never reaches the body cone, are rejected.
+    """
+    n, n_steps = len(states), len(t_grid)
+    mask = np.zeros((n, len(CELESTIAL_BODIES)), dtype=bool)
+    geo = predict_positions_batch(*states.T, t_grid[:1])
+    unit, alt, _, rng = frame.line_of_sight(geodetic_to_ecef_batch(geo[:, 0]))
+    speed_kms = np.hypot(states[:, 3] * 1.852 / 3600.0, feet_to_km(states[:, 5]) / 60.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        travel = speed_kms * t_grid[-1] / rng
+    # Once it can cover its own range the aircraft may appear anywhere in the sky
+    reach = np.where(np.isfinite(travel) & (travel < 1.0), np.degrees(np.arcsin(np.clip(travel, 0.0, 1.0))), 180.0) + PREFILTER_PAD_DEG
+    ac_possible = np.isfinite(alt) & (alt + reach >= 0) # [Filter 1] never above the horizon
+    for b, (body, _) in enumerate(CELESTIAL_BODIES):
+        up = body_table.alt_deg[body][:n_steps] >= 0
+        if not up.any(): continue # [Filter 2] body below the horizon all horizon long
+        path = body_table.enu[body][:n_steps][up]
+        centre = path.sum(axis=0); centre /= np.linalg.norm(centre)
+        radius = angular_separation_deg(path, centre).max()
+        # [Filter 3] cone rejection
+        mask[:, b] = ac_possible & (angular_separation_deg(unit, centre) - radius - reach <= CONFLICT_ANGLE_DEG)
+    return mask
+def celestial_coarse_search(states, frame, body_table, t_grid, adaptive=None, candidates=None):
+    """
+    Coarse Sun/Moon search on the prediction grid for (N, 6) SNAPSHOT_FIELDS states.
+    Returns (hits, min_sep, samples): hits (N, T, bodies) marks grid steps where the aircraft and
+    the body are both above the horizon and within CONFLICT_ANGLE_DEG; min_sep (N,) is the smallest
+    such separation seen; samples is the number of aircraft-time evaluations. candidates is an
+    optional (N, bodies) mask from celestial_prefilter; rejected combinations are never evaluated.
+    Adaptive mode marches every aircraft along the grid at once, jumping as far as its angular
+    margin allows: an aircraft at range r moving at v turns its line of sight by at most
+    asin(v*dt/r), and the body moves at most CELESTIAL_MAX_RATE_DEG_S, so skipped steps cannot be
+    hits and the mask equals the uniform one.
+    """
+    adaptive = ADAPTIVE_STEPPING if adaptive is None else adaptive
+    n, n_steps = len(states), len(t_grid)
+    body_enu = [body_table.enu[body][:n_steps] for body, _ in CELESTIAL_BODIES]
+    body_up = [body_table.alt_deg[body][:n_steps] >= 0 for body, _ in CELESTIAL_BODIES]
+    if candidates is None: candidates = np.ones((n, len(CELESTIAL_BODIES)), dtype=bool)
+    hits = np.zeros((n, n_steps, len(CELESTIAL_BODIES)), dtype=bool); min_sep = np.full(n, np.inf)
+    live = np.flatnonzero(candidates.any(axis=1))
+    if not adaptive:
+        if not len(live): return hits, min_sep, 0
+        ac_unit, ac_alt_deg, _, _ = frame.line_of_sight(geodetic_to_ecef_batch(predict_positions_batch(*states[live].T, t_grid)))
+        # Aircraft altitude check: aircraft below the horizon (or with incomplete state) never hit
+        ac_visible = np.isfinite(ac_alt_deg) & (ac_alt_deg >= 0)
+        for b, (enu, up) in enumerate(zip(body_enu, body_up)):
+            # Body altitude check
+            sep = np.where(ac_visible & up & candidates[live, b, None], angular_separation_deg(ac_unit, enu), np.inf)
+            hits[live, :, b] = sep <= CONFLICT_ANGLE_DEG
+            min_sep[live] = np.minimum(min_sep[live], sep.min(axis=1))
+        return hits, min_sep, len(live) * n_steps
+
+    speed_kms = np.hypot(states[:, 3] * 1.852 / 3600.0, feet_to_km(states[:, 5]) / 60.0)
+    body_rate = np.radians(CELESTIAL_MAX_RATE_DEG_S)
+    k = np.zeros(n, dtype=np.int64); samples = 0
+    while len(live):
+        kl = k[live]; samples += len(live)
+        geo = predict_positions_batch(*states[live].T, t_grid[kl][:, None])
+        unit, alt, _, rng = frame.line_of_sight(geodetic_to_ecef_batch(geo[:, 0]))
+        visible = np.isfinite(alt) & (alt >= 0)
+        margin = np.full(len(live), np.inf)
+        for b, (enu, up) in enumerate(zip(body_enu, body_up)):
+            sep = np.where(candidates[live, b], angular_separation_deg(unit, enu[kl]), np.inf)
+            ok = visible & up[kl]
+            hits[live, kl, b] = ok & (sep <= CONFLICT_ANGLE_DEG)
+            min_sep[live] = np.minimum(min_sep[live], np.where(ok, sep, np.inf))
+            margin = np.minimum(margin, sep - CONFLICT_ANGLE_DEG)
+        # Largest dt over which neither the aircraft nor the body can use up half the margin
+        half = np.radians(np.clip(margin * ADAPTIVE_SAFETY, 0.0, 179.0)) / 2.0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dt = np.minimum(np.where(speed_kms[live] > 0, rng * np.sin(half) / speed_kms[live], np.inf), half / body_rate)
+        skip = np.where(np.isfinite(dt), np.floor(dt / PREDICTION_STEP), n_steps)
+        k[live] = kl + np.maximum(1, np.minimum(skip, n_steps)).astype(np.int64)
+        live = live[k[live] < n_steps]
+    return hits, min_sep, samples
+def ac_enu_at(frame, pl, pn, pa):
+    """Aircraft (alt_deg, az_deg, ENU unit vector) seen from the observer frame."""
+    unit, alt_deg, az_deg, _ = frame.geodetic_line_of_sight(pl, pn, pa)
+    return float(alt_deg), float(az_deg), unit
+def minimize_separation(ac_base, frame, body_table, body, t_center_sec):
+    """
+    Find the exact timestamp of minimum angular separation near t_center_sec.
+    The aircraft-minus-body LOS unit-vector difference (a chord, monotonic in the angle) is
+    solved in closed form; golden section is the fallback when the quadratic fit is poor.
+    Returns (t_min, min_sep_deg, solver_info).
+    """
+    # Search window: interval spanning one step before and after coarse detection
+    window = PREDICTION_STEP * 1.5
+    a = max(0, t_center_sec - window)
+    b = t_center_sec + window
 
-                if haversine(USER_LAT, USER_LON, ac1_lat, ac1_lon) > SIMULATION_RADIUS_KM or \
-                   haversine(USER_LAT, USER_LON, ac2_lat, ac2_lon) > SIMULATION_RADIUS_KM:
-                    continue
-                
-                # Altitude filtering (Vertical separation threshold: 5000ft)
-                alt1, alt2 = ac1.get('altitude'), ac2.get('altitude')
-                if alt1 is not None and alt2 is not None:
-                    if abs(alt1 - alt2) > 5000: continue
-                else: continue
-                
-                conflict_found = False
-                
-                for dt in np.arange(0, PREDICTION_HORIZON + PREDICTION_STEP, PREDICTION_STEP):
-                    # Coarse prediction (broad phase search)
-                    p1 = predict_position(ac1['lat'], ac1['lon'], alt1, ac1['speed'], ac1['track'], dt, ac1['vs'])
-                    p2 = predict_position(ac2['lat'], ac2['lon'], alt2, ac2['speed'], ac2['track'], dt, ac2['vs'])
+    # Golden ratio constants
+    phi = (1 + sqrt(5)) / 2
+    resphi = 2 - phi
+
+    # Define target function: calculate angular separation at a specific timestamp
+    def get_sep_at(t_sec):
+        # 1. Predict aircraft geodetic position
+        pl, pn, pa = predict_position(
+            ac_base['lat'], ac_base['lon'], ac_base['altitude'], 
+            ac_base['speed'], ac_base['track'], t_sec, ac_base['vs']
+        )
+        if pl is None: return 999.0
+
+        # 2. Aircraft line of sight in the observer frame; body interpolated from the cycle table
+        _, _, ac_vec = ac_enu_at(frame, pl, pn, pa)
+
+        # 3. Return angular separation (degrees)
+        return float(angular_separation_deg(ac_vec, body_table.unit_vectors(body, t_sec)))
+
+    # Closed-form solution from a few batched samples across the window
+    t_s = np.linspace(a, b, SOLVER_FIT_SAMPLES)
+    _, ecef = propagate_aircraft_batch([ac_base], t_s)
+    ac_unit = frame.line_of_sight(ecef[0])[0]
+    rel = ac_unit - body_table.unit_vectors(body, t_s)
+    if np.all(np.isfinite(rel)):
+        t_min, residual = quadratic_closest_approach(t_s, rel)
+        if residual <= SOLVER_FIT_TOL_CHORD:
+            return t_min, get_sep_at(t_min), {'method': 'analytic', 'iterations': 1, 'evaluations': SOLVER_FIT_SAMPLES + 1}
+
+    # Iterative solver execution
+    c = a + resphi * (b - a)
+    d = b - resphi * (b - a)
+    fc = get_sep_at(c)
+    fd = get_sep_at(d)
+
+    # 15 iterations are sufficient to reach millisecond-level precision
+    for _ in range(15):
+        if fc < fd:
+            b = d
+            d = c
+            fd = fc
+            c = a + resphi * (b - a)
+            fc = get_sep_at(c)
+        else:
+            a = c
+            c = d
+            fc = fd
+            d = b - resphi * (b - a)
+            fd = get_sep_at(d)
+
+    t_min = (a + b) / 2
+    min_sep = get_sep_at(t_min)
+    return t_min, min_sep, {'method': 'golden', 'iterations': 15, 'evaluations': SOLVER_FIT_SAMPLES + 18}
+def celestial_fine_phase(states, ids, rows, hits, body_table, now):
+    """
+    Sun/Moon refinement for aircraft with coarse hits. rows index states/ids; hits[n] is the
+    (T, bodies) coarse hit mask of rows[n]. Like acac_fine_phase it only reads its arguments and
+    the prediction settings. Returns ([(row, eid, event dict)], solver_runs).
+    """
+    frame = get_observer_frame(); t_grid = prediction_time_grid()
+    results = []; solver_runs = []
+    for n_row, row in enumerate(rows):
+        ac = state_record(states, row, ids[row])
+        icao = ac['icao']
+        csign = ac.get('callsign') or icao
+        lat, lon, alt, spd, trk, vs = (ac.get(k) for k in ('lat', 'lon', 'altitude', 'speed', 'track', 'vs'))
+
+        conflict_found = False
+        # Coarse hits in time order, Sun before Moon at each step
+        for k in np.flatnonzero(hits[n_row].any(axis=1)):
+            dt = float(t_grid[k])
+            for b_idx in np.flatnonzero(hits[n_row, k]):
+                body, body_label = CELESTIAL_BODIES[b_idx]
+                try:
+                    # [Refinement] Closed-form fit of the closest approach, golden section if the fit is poor
+                    precise_t, precise_ang, solver_info = minimize_separation(ac, frame, body_table, body, dt)
+                    solver_runs.append(solver_info)
                     
-                    if p1[0] is None or p2[0] is None: continue
+                    # Only record if refined angle meets threshold and is not an anomaly/outlier
+                    if not (precise_ang <= CONFLICT_ANGLE_DEG and precise_ang < 20.0): continue
+
+                    eid = (icao, f'AC-{body_label}')
+                    pt_final = now + timedelta(seconds=precise_t)
                     
-                    # Line-of-sight (LOS) angular separation check
-                    ang = angle_between(USER_LAT, USER_LON, USER_ALT_FT, p1[0], p1[1], p1[2], p2[0], p2[1], p2[2])
+                    # Re-calculate position at the exact refined timestamp for POV (Point of View) rendering
+                    pl_f, pn_f, pa_f = predict_position(lat, lon, alt, spd, trk, precise_t, vs)
+                    if pl_f is None: continue
+                    alt_f, az_f, _ = ac_enu_at(frame, pl_f, pn_f, pa_f)
+                    b_alt_f, b_az_f = body_table.altaz(body, precise_t)
                     
-                    if ang <= CONFLICT_ANGLE_DEG:
-                        precise_t, min_dist = solve_closest_approach(ac1, ac2, dt, window=PREDICTION_STEP * 1.5)
-                        
-                        # --- Precision Refinement (Narrow Phase) ---
-                        p1_f = predict_position(ac1['lat'], ac1['lon'], ac1['altitude'], ac1['speed'], ac1['track'], precise_t, ac1['vs'])
-                        p2_f = predict_position(ac2['lat'], ac2['lon'], ac2['altitude'], ac2['speed'], ac2['track'], precise_t, ac2['vs'])
-                        
-                        if p1_f[0] is None or p2_f[0] is None: break
-                        event_lat = (p1_f[0] + p2_f[0]) / 2.0
-                        event_lon = (p1_f[1] + p2_f[1]) / 2.0
-                        event_alt = (p1_f[2] + p2_f[2]) / 2.0 if p1_f[2] and p2_f[2] else 0
-                        dist_event_to_user = haversine(USER_LAT, USER_LON, event_lat, event_lon)
-                        
-                        if dist_event_to_user > CONFLICT_RADIUS_KM:
-                            break 
-                        precise_angle = angle_between(USER_LAT, USER_LON, USER_ALT_FT, 
-                                                      p1_f[0], p1_f[1], p1_f[2], 
-                                                      p2_f[0], p2_f[1], p2_f[2])
-
-                        pov_data = {'valid': False}
-                        if user_obs and earth_obj:
-                            try:
-                                t_cpa = ts.utc(now + timedelta(seconds=precise_t))
-                                dt_vec = 2.0
-                                t_vec = ts.utc(now + timedelta(seconds=precise_t + dt_vec))
-                                p1_v = predict_position(ac1['lat'], ac1['lon'], ac1['altitude'], ac1['speed'], ac1['track'], precise_t + dt_vec, ac1['vs'])
-                                p2_v = predict_position(ac2['lat'], ac2['lon'], ac2['altitude'], ac2['speed'], ac2['track'], precise_t + dt_vec, ac2['vs'])
-
-                                def get_azel(geo_pos, time_obj):
-                                    if geo_pos[0] is None: return 0, 0
-                                    pos = wgs84.latlon(geo_pos[0], geo_pos[1], elevation_m=feet_to_km(geo_pos[2])*1000.0)
-                                    app = user_obs.at(time_obj).observe(earth_obj + pos).apparent()
-                                    alt_deg, az_deg, _ = app.altaz()
-                                    return az_deg.degrees, alt_deg.degrees
-
-                                az1, el1 = get_azel(p1_f, t_cpa)
-                                az2, el2 = get_azel(p2_f, t_cpa)
-                                az1_v, el1_v = get_azel(p1_v, t_vec)
-                                az2_v, el2_v = get_azel(p2_v, t_vec)
-
-                                pov_data = {
-                                    'valid': True,
-                                    'ac1': {'az': az1, 'el': el1, 'az_vec': az1_v, 'el_vec': el1_v},
-                                    'ac2': {'az': az2, 'el': el2, 'az_vec': az2_v, 'el_vec': el2_v}
-                                }
-                            except: pass
-
-                        pt = now + timedelta(seconds=precise_t)
-                        eid = tuple(sorted((ac1['icao'], ac2['icao']))) + ('AC-AC',)
-                        cs = sorted([ac1.get('callsign') or ac1['icao'], ac2.get('callsign') or ac2['icao']])
-                        
-                        ed = {
-                            'type': 'AC-AC',
-                            'callsigns': cs,
-                            'time': pt,
-                            'angle': precise_angle,
-                            'min_dist_km': min_dist,
-                            'precise_t': precise_t,
-                            'pov': pov_data,
-                            'last_update': now,
-                            'lat': event_lat, 'lon': event_lon, 'alt': event_alt,
-                            'ac1_state': ac1.copy(),
-                            'ac2_state': ac2.copy()
+                    # Calculate velocity vector (sampled 1 second later)
+                    dt_vec = 1.0
+                    pl_v, pn_v, pa_v = predict_position(lat, lon, alt, spd, trk, precise_t + dt_vec, vs)
+                    az_vec, el_vec = az_f, alt_f
+                    if pl_v is not None:
+                        el_vec, az_vec, _ = ac_enu_at(frame, pl_v, pn_v, pa_v)
+
+                    ed = {
+                        'type': f'AC-{body_label}',
+                        'callsigns': [csign],
+                        'time': pt_final,
+                        'angle': precise_ang, 
+                        'solver': solver_info,
+                        'last_update': now,
+                        'lat': pl_f, 'lon': pn_f, 'alt': pa_f,
+                        'pov': {
+                            'valid': True,
+                            'body_type': body_label,
+                            'body_az': float(b_az_f),
+                            'body_el': float(b_alt_f),
+                            'ac_az': az_f,
+                            'ac_el': alt_f,
+                            'ac_az_vec': az_vec,
+                            'ac_el_vec': el_vec
                         }
-                        
-                        with lock:
-                            event_dict[eid] = ed
-                            conflict_msg = f"CPA: {min_dist:.2f}km / {precise_angle:.1f}°"
-                            ac1m = aircraft_dict.get(ac1['icao'])
-                            if ac1m: 
-                                ac1m.setdefault('event_ids', set()).add(eid)
-                                ac1m['conflict'] = conflict_msg
-                            ac2m = aircraft_dict.get(ac2['icao'])
-                            if ac2m: 
-                                ac2m.setdefault('event_ids', set()).add(eid)
-                                ac2m['conflict'] = conflict_msg
-
-                        if not conflict_found:
-                            add_log(f"Conflict: {cs[0]}-{cs[1]}, Dist: {min_dist:.2f}km, EventDist: {dist_event_to_user:.1f}km")
-                            conflict_found = True
-                        
-                        break 
-
-        with lock:
-            active_eids = {eid[0] for eid, ev in event_dict.items() if ev['type'] in ['AC-Sun', 'AC-Moon']} | \
-                          {eid[i] for eid, ev in event_dict.items() if ev['type'] == 'AC-AC' for i in range(2)}
-            for icao, data in aircraft_dict.items():
-                if icao not in active_eids:
-                    data['conflict'] = None
+                    }
                     
-        time.sleep(PREDICTION_INTERVAL)
-def predict_celestial_conflicts():
+                    results.append((row, eid, ed))
+                    conflict_found = True
+                    break
+                except (ValueError, TypeError, ArithmeticError, np.linalg.LinAlgError) as e:
+                    print(f"[!] Celestial refinement failed for {icao} ({body_label}): {e}")
+
+            if conflict_found: break
+    return results, solver_runs
+def predict_celestial_conflicts(max_cycles=None, cache=None, budget=None, focus=None):
     """
-    Perform high-precision celestial-aircraft proximity prediction using the Skyfield WGS84 model.
+    Perform high-precision celestial-aircraft proximity prediction.
     Includes:
     1. Horizon filtering (Altitude > 0)
-    2. Golden section search for precise Time of Closest Approach (TCA/CPA)
+    2. Closed-form (quadratic fit) Time of Closest Approach, golden section search as the fallback
+    Sun/Moon positions come from a per-cycle CelestialBodyTable; aircraft directions come from the
+    observer's ENU frame (ObserverFrame), so the coarse search is a handful of array operations.
+    budget/focus work as in predict_conflicts: refinement runs most urgent aircraft first and is
+    cut off after `budget` seconds; a focus cycle only re-predicts the scheduler's hot set.
     """
     if eph is None or observer_topos is None:
         print("Celestial (user view) predictions disabled (No ephemeris).")
         return
 
-    print("Celestial prediction thread started (High Accuracy WGS84 Mode).")
+    if max_cycles is None: print("Celestial prediction thread started (High Accuracy WGS84 Mode).")
     
     # Pre-fetch celestial objects to optimize loop performance
-    sun_obj = eph['sun']
-    moon_obj = eph['moon']
     earth_obj = eph['earth']
 
-    # --- 内Internal Helper: Precision Refinement Solver ---
-    def minimize_separation(ac_base, body_target, t_center_sec, start_time_base):
-        """
-        Find the exact timestamp of minimum angular separation near t_center_sec.
-        """
-        # Search window: interval spanning one step before and after coarse detection
-        window = PREDICTION_STEP * 1.5
-        a = max(0, t_center_sec - window)
-        b = t_center_sec + window
-        
-        # Golden ratio constants
-        phi = (1 + sqrt(5)) / 2
-        resphi = 2 - phi
-        
-        # Define target function: calculate angular separation at a specific timestamp
-        def get_sep_at(t_sec):
-            # 1. Predict aircraft geodetic position
-            pl, pn, pa = predict_position(
-                ac_base['lat'], ac_base['lon'], ac_base['altitude'], 
-                ac_base['speed'], ac_base['track'], t_sec, ac_base['vs']
-            )
-            if pl is None: return 999.0
-            
-            try:
-                # 2. Construct Skyfield WGS84 position object
-                pos_wgs84 = wgs84.latlon(pl, pn, elevation_m=feet_to_km(pa)*1000.0)
-                t_inst = ts.utc(start_time_base + timedelta(seconds=t_sec))
-                
-                # 3. Perform observation from topocentric location
-                user_obs = earth_obj + observer_topos
-                ac_app = user_obs.at(t_inst).observe(earth_obj + pos_wgs84).apparent()
-                body_app = user_obs.at(t_inst).observe(body_target).apparent()
-                
-                # 4. Return angular separation (degrees)
-                return body_app.separation_from(ac_app).degrees
-            except:
-                return 999.0
-
-        # Iterative solver execution
-        c = a + resphi * (b - a)
-        d = b - resphi * (b - a)
-        fc = get_sep_at(c)
-        fd = get_sep_at(d)
-        
-        # 15 iterations are sufficient to reach millisecond-level precision
-        for _ in range(15):
-            if fc < fd:
-                b = d
-                d = c
-                fd = fc
-                c = a + resphi * (b - a)
-                fc = get_sep_at(c)
-            else:
-                a = c
-                c = d
-                fc = fd
-                d = b - resphi * (b - a)
-                fd = get_sep_at(d)
-        
-        t_min = (a + b) / 2
-        min_sep = get_sep_at(t_min)
-        return t_min, min_sep
+    def publish(icao, eid, ed):
+        post_event(eid, ed, (icao,), f"{ed['pov']['body_type'].upper()} CAPTURE! {ed['angle']:.2f}° in {(ed['time'] - ed['last_update']).total_seconds():.1f}s")
 
-    while running:
+    def pause():
+        if max_cycles is None or cycles < max_cycles: clock.sleep(PREDICTION_INTERVAL)
+
+    if cache is None: cache = PredictionCache() # icao -> (eid, event dict) or None
+    shared = shared_blocks['celestial'] # Arrays handed to pool workers (one segment for the session)
+    cycles = 0
+    while running and (max_cycles is None or cycles < max_cycles):
+        cycles += 1
         active_ac = get_active_aircraft()
-        now = datetime.now(timezone.utc)
+        if focus is not None: active_ac = [ac for ac in active_ac if ac['icao'] in focus]
+        now = utc_now()
+        frame = get_observer_frame()
+        cache.begin_cycle(prediction_context())
         
         # Define observer location (Topocentric)
         user_observer = earth_obj + observer_topos
 
-        for ac in active_ac:
-            icao = ac['icao']
-            csign = ac.get('callsign') or icao
-            
-            # Fetch aircraft state and telemetry
-            lat, lon, alt, spd, trk, vs = (ac.get(k) for k in ('lat', 'lon', 'altitude', 'speed', 'track', 'vs'))
-            if None in [lat, lon, alt, spd, trk, vs]: continue
-
-            # Coarse Search
-            for dt in np.arange(0, PREDICTION_HORIZON + PREDICTION_STEP, PREDICTION_STEP):
-                # 1. Coarse prediction (Broad-phase search)
-                pl, pn, pa = predict_position(lat, lon, alt, spd, trk, dt, vs)
-                if pl is None: continue
-
-                try:
-                    ac_pos_wgs84 = wgs84.latlon(pl, pn, elevation_m=feet_to_km(pa)*1000.0)
-                except: continue
-
-                t_sky = ts.utc(now + timedelta(seconds=dt))
-                
-                # 2. Calculate aircraft apparent position
-                ac_astrometric = user_observer.at(t_sky).observe(earth_obj + ac_pos_wgs84)
-                ac_apparent = ac_astrometric.apparent()
-                
-                # [Filter 1] Aircraft altitude check: skip if the aircraft is below the horizon
-                ac_alt_obj, ac_az_obj, _ = ac_apparent.altaz()
-                if ac_alt_obj.degrees < 0: 
-                    continue
-
-                conflict_found_this_step = False
-
-                # --- Check Sun Proximity ---
-                try:
-                    sun_astrometric = user_observer.at(t_sky).observe(sun_obj)
-                    sun_apparent = sun_astrometric.apparent()
-                    s_alt_obj, _, _ = sun_apparent.altaz()
-                    if s_alt_obj.degrees < 0:
-                        pass # [Filter 2] Sun altitude check: skip if Sun is below the horizon
-                    else:
-                        # 粗略角度
-                        ang_s_coarse = sun_apparent.separation_from(ac_apparent).degrees
-
-                        if ang_s_coarse <= CONFLICT_ANGLE_DEG:
-                            # [Refinement] Initiate golden section search for sub-second precision
-                            precise_t, precise_ang = minimize_separation(ac, sun_obj, dt, now)
-                            
-                            # Only record if refined angle meets threshold and is not an anomaly/outlier
-                            if precise_ang <= CONFLICT_ANGLE_DEG and precise_ang < 20.0:
-                                eid = (icao, 'AC-Sun')
-                                pt_final = now + timedelta(seconds=precise_t)
-                                
-                                #  Precise azimuth/elevation data is required for POV (Point of View) rendering
-                                t_final = ts.utc(pt_final)
-                                
-                                # Re-calculate position at the exact refined timestamp for POV logging
-                                pl_f, pn_f, pa_f = predict_position(lat, lon, alt, spd, trk, precise_t, vs)
-                                pos_f = wgs84.latlon(pl_f, pn_f, elevation_m=feet_to_km(pa_f)*1000.0)
-                                ac_app_f = user_observer.at(t_final).observe(earth_obj + pos_f).apparent()
-                                sun_app_f = user_observer.at(t_final).observe(sun_obj).apparent()
-                                
-                                alt_f, az_f, _ = ac_app_f.altaz()
-                                s_alt_f, s_az_f, _ = sun_app_f.altaz()
-                                
-                                # Calculate velocity vector (sampled 1 second later)
-                                dt_vec = 1.0
-                                pl_v, pn_v, pa_v = predict_position(lat, lon, alt, spd, trk, precise_t + dt_vec, vs)
-                                az_vec, el_vec = az_f.degrees, alt_f.degrees
-                                if pl_v is not None:
-                                    try:
-                                        pos_v = wgs84.latlon(pl_v, pn_v, elevation_m=feet_to_km(pa_v)*1000.0)
-                                        t_vec = ts.utc(now + timedelta(seconds=precise_t + dt_vec))
-                                        ac_app_v = user_observer.at(t_vec).observe(earth_obj + pos_v).apparent()
-                                        alt_v, az_v, _ = ac_app_v.altaz()
-                                        az_vec, el_vec = az_v.degrees, alt_v.degrees
-                                    except: pass
+        # Sun/Moon for the whole horizon (plus the refinement window) in one vectorized evaluation each
+        t_grid = prediction_time_grid()
+        n_steps = len(t_grid)
+        try:
+            body_table = CelestialBodyTable(user_observer, now, prediction_time_grid(PREDICTION_HORIZON + 2 * PREDICTION_STEP))
+        except Exception as e:
+            print(f"Celestial table error: {e}"); pause(); continue
 
-                                ed = {
-                                    'type': 'AC-Sun',
-                                    'callsigns': [csign],
-                                    'time': pt_final,
-                                    'angle': precise_ang, 
-                                    'last_update': now,
-                                    'lat': pl_f, 'lon': pn_f, 'alt': pa_f,
-                                    'pov': {
-                                        'valid': True,
-                                        'body_type': 'Sun',
-                                        'body_az': s_az_f.degrees,
-                                        'body_el': s_alt_f.degrees,
-                                        'ac_az': az_f.degrees,
-                                        'ac_el': alt_f.degrees,
-                                        'ac_az_vec': az_vec,
-                                        'ac_el_vec': el_vec
-                                    }
-                                }
-                                
-                                with lock:
-                                    event_dict[eid] = ed
-                                    ace = aircraft_dict.get(icao)
-                                    if ace:
-                                        ace.setdefault('event_ids', set()).add(eid)
-                                        ace['conflict'] = f"SUN CAPTURE! {precise_ang:.2f}° in {precise_t:.1f}s"
-                                
-                                conflict_found_this_step = True
-                except Exception as e:
-                    pass
-
-                if conflict_found_this_step: break 
-
-                # --- Check Moon Proximity ---
+        # Aircraft whose state vector is unchanged since their last (recent) prediction reuse it
+        stale = []; hot = set()
+        for ac in active_ac:
+            hit, cached = cache.lookup(ac['icao'], ac.get('state_version'), now)
+            if hit and (cached is None or cached[1]['time'] > now):
+                if cached is not None:
+                    publish(ac['icao'], cached[0], dict(cached[1], last_update=now))
+                    if (cached[1]['time'] - now).total_seconds() < PRIORITY_TIME_SEC: hot.add(ac['icao'])
+            else:
+                stale.append(ac)
+        if focus is None:
+            cache.prune({ac['icao'] for ac in active_ac})
+            with lock:
+                prediction_stats['celestial_reused'] = (len(active_ac) - len(stale), len(active_ac))
+        active_ac = stale
+
+        def end_cycle(solver_runs, used=0.0, done=0, deferred=()):
+            if focus is not None:
+                celestial_scheduler.focus_cycles += 1
+                celestial_scheduler.deferred |= {active_ac[row]['icao'] for row in deferred} # First in line next cycle
+                return
+            celestial_scheduler.hot = frozenset(hot)
+            celestial_scheduler.deferred = {active_ac[row]['icao'] for row in deferred}
+            with lock:
+                prediction_stats['celestial_solver'] = summarize_solver_runs(solver_runs)
+                prediction_stats['celestial_schedule'] = schedule_stats(celestial_scheduler, used, budget, done, len(deferred))
+
+        if not active_ac:
+            end_cycle([]); pause(); continue
+
+        # Coarse search for all aircraft at once against each body's grid
+        states = np.column_stack(aircraft_state_arrays(active_ac))
+        candidates = celestial_prefilter(states, frame, body_table, t_grid)
+        hits, min_sep, samples = celestial_coarse_search(states, frame, body_table, t_grid, candidates=candidates)
+        if focus is None:
+            with lock:
+                prediction_stats['celestial_samples'] = (samples, len(active_ac) * n_steps)
+                prediction_stats['celestial_skipped'] = (int(candidates.size - candidates.sum()), candidates.size)
+        any_hit = hits.any(axis=2)
+        t_first = np.where(any_hit.any(axis=1), t_grid[any_hit.argmax(axis=1)], np.inf)
+        margin = min_sep - CONFLICT_ANGLE_DEG
+        hot.update(active_ac[k]['icao'] for k in np.flatnonzero(t_first < PRIORITY_TIME_SEC))
+
+        # Fine phase for aircraft with coarse hits: soonest first, split across the worker pool when
+        # there are enough of them, within the cycle budget
+        rows = np.flatnonzero(any_hit.any(axis=1))
+        rows = rows[celestial_scheduler.order([active_ac[k]['icao'] for k in rows], t_first[rows], margin[rows])]
+        ids = [(ac['icao'], ac.get('callsign'), ac.get('state_version')) for ac in active_ac]
+        pool = prediction_pool if len(rows) >= POOL_MIN_AIRCRAFT else None
+        ref = None
+        def compute(wave):
+            nonlocal pool, ref
+            if pool:
                 try:
-                    moon_astrometric = user_observer.at(t_sky).observe(moon_obj)
-                    moon_apparent = moon_astrometric.apparent()
-                    
-                    # [Filter 2] Moon altitude check
-                    m_alt_obj, _, _ = moon_apparent.altaz()
-                    if m_alt_obj.degrees < 0:
-                        pass
-                    else:
-                        ang_m_coarse = moon_apparent.separation_from(ac_apparent).degrees
-
-                        if ang_m_coarse <= CONFLICT_ANGLE_DEG:
-                            precise_t, precise_ang = minimize_separation(ac, moon_obj, dt, now)
-
-                            if precise_ang <= CONFLICT_ANGLE_DEG and precise_ang < 20.0:
-                                eid = (icao, 'AC-Moon')
-                                pt_final = now + timedelta(seconds=precise_t)
-                                t_final = ts.utc(pt_final)
-                                
-                                pl_f, pn_f, pa_f = predict_position(lat, lon, alt, spd, trk, precise_t, vs)
-                                pos_f = wgs84.latlon(pl_f, pn_f, elevation_m=feet_to_km(pa_f)*1000.0)
-                                ac_app_f = user_observer.at(t_final).observe(earth_obj + pos_f).apparent()
-                                moon_app_f = user_observer.at(t_final).observe(moon_obj).apparent()
-                                
-                                alt_f, az_f, _ = ac_app_f.altaz()
-                                m_alt_f, m_az_f, _ = moon_app_f.altaz()
-
-                                dt_vec = 1.0
-                                pl_v, pn_v, pa_v = predict_position(lat, lon, alt, spd, trk, precise_t + dt_vec, vs)
-                                az_vec, el_vec = az_f.degrees, alt_f.degrees
-                                if pl_v is not None:
-                                    try:
-                                        pos_v = wgs84.latlon(pl_v, pn_v, elevation_m=feet_to_km(pa_v)*1000.0)
-                                        t_vec = ts.utc(now + timedelta(seconds=precise_t + dt_vec))
-                                        ac_app_v = user_observer.at(t_vec).observe(earth_obj + pos_v).apparent()
-                                        alt_v, az_v, _ = ac_app_v.altaz()
-                                        az_vec, el_vec = az_v.degrees, alt_v.degrees
-                                    except: pass
-
-                                ed = {
-                                    'type': 'AC-Moon', 
-                                    'callsigns': [csign],
-                                    'time': pt_final,
-                                    'angle': precise_ang, 
-                                    'last_update': now,
-                                    'lat': pl_f, 'lon': pn_f, 'alt': pa_f,
-                                    'pov': {
-                                        'valid': True,
-                                        'body_type': 'Moon', 
-                                        'body_az': m_az_f.degrees,
-                                        'body_el': m_alt_f.degrees,
-                                        'ac_az': az_f.degrees,
-                                        'ac_el': alt_f.degrees,
-                                        'ac_az_vec': az_vec,
-                                        'ac_el_vec': el_vec
-                                    }
-                                }
-                                
-                                with lock:
-                                    event_dict[eid] = ed
-                                    ace = aircraft_dict.get(icao)
-                                    if ace:
-                                        ace.setdefault('event_ids', set()).add(eid)
-                                        ace['conflict'] = f"MOON CAPTURE! {precise_ang:.2f}° in {precise_t:.1f}s"
-                                
-                                conflict_found_this_step = True
-                except Exception as e:
-                    pass
-                
-                if conflict_found_this_step: break
-
-        time.sleep(PREDICTION_INTERVAL)
-def clean_expired_events():
+                    if ref is None: ref = shared.publish(states=states, hits=hits)
+                    return pool.run(celestial_pool_task, wave, ref, prediction_context(), ids, body_table, now)
+                except Exception as e: print(f"[!] Celestial pool error ({e}); refining in-process."); pool = None
+            return celestial_fine_phase(states, ids, wave, hits[wave], body_table, now)
+        fine, solver_runs, deferred, used = celestial_scheduler.run(rows, compute, PRIORITY_WAVE * (pool.workers if pool else 1), budget)
+
+        # Deferred aircraft stay uncached so the next cycle picks them up first
+        deferred_rows = set(deferred.tolist())
+        for row, ac in enumerate(active_ac):
+            # "No hit" holds only while the horizon and the Sun/Moon have barely moved
+            if row not in deferred_rows: cache.store(ac['icao'], ac.get('state_version'), now, None, max_age=negative_result_max_age())
+        for row, eid, ed in fine:
+            ac = active_ac[row]
+            publish(ac['icao'], eid, ed)
+            cache.store(ac['icao'], ac.get('state_version'), now, (eid, ed))
+
+        end_cycle(solver_runs, used, len(rows) - len(deferred), deferred)
+        pause()
+def sweep_expired_events():
+    """One expiry pass: retire timed-out events, clear stale conflict labels, free long-silent aircraft."""
     global history_event_count
-    while running:
-        now,to_remove=datetime.now(timezone.utc),[]
-        with lock:
-            all_eids=list(event_dict.keys())
-            for eid in all_eids:
-                ev=event_dict.get(eid)
-                if ev and'last_update'in ev:
-                    if(now-ev['last_update']).total_seconds()>EVENT_TIMEOUT:to_remove.append(eid)
-                elif ev:to_remove.append(eid) # Should not happen if last_update is always set
-            for eid in to_remove:
-                ev_data_to_log = event_dict.pop(eid, None) # Pop first
-                if ev_data_to_log: # Check if pop was successful
-                    pt=ev_data_to_log.get('time')
-                    et,ecs=ev_data_to_log.get('type','UNK'),ev_data_to_log.get('callsigns',[])
-                    if pt and pt<=now:history_event_count+=1;add_log(f"Event Recorded: {et} involving {ecs} (Predicted @ {pt.strftime('%H:%M:%S')})")
-                    else:add_log(f"Prediction Expired: {et} involving {ecs} (Was predicted @ {pt.strftime('%H:%M:%S')if pt else'N/A'})")
-                    try:
-                        if et=='AC-AC'and len(eid)==3:
-                            i1,i2,_=eid;a1,a2=aircraft_dict.get(i1),aircraft_dict.get(i2)
-                            if a1 and 'event_ids' in a1:a1['event_ids'].discard(eid)
-                            if a2 and 'event_ids' in a2:a2['event_ids'].discard(eid)
-                        elif et in['AC-Sun','AC-Moon']and len(eid)==2:
-                            i,_=eid;ace=aircraft_dict.get(i)
-                            if ace and 'event_ids' in ace:ace['event_ids'].discard(eid)
-                    except Exception as e_d:print(f"Warn: Error discarding event ID {eid}: {e_d}")
-            active_eids={eid[0]for eid,ev in event_dict.items()if ev['type']in['AC-Sun','AC-Moon']}|{eid[i]for eid,ev in event_dict.items()if ev['type']=='AC-AC'for i in range(2)}
-            for icao,data in aircraft_dict.items():
-                if icao not in active_eids:data['conflict']=None
-        time.sleep(1)
-    print("Event cleaner thread exiting.")
-def start_listener():
+    now,to_remove=utc_now(),[]
+    with lock:
+        all_eids=list(event_dict.keys())
+        for eid in all_eids:
+            ev=event_dict.get(eid)
+            if ev and'last_update'in ev:
+                if(now-ev['last_update']).total_seconds()>EVENT_TIMEOUT:to_remove.append(eid)
+            elif ev:to_remove.append(eid) # Should not happen if last_update is always set
+        for eid in to_remove:
+            ev_data_to_log = event_dict.pop(eid, None) # Pop first
+            if ev_data_to_log: # Check if pop was successful
+                pt=ev_data_to_log.get('time')
+                et,ecs=ev_data_to_log.get('type','UNK'),ev_data_to_log.get('callsigns',[])
+                if pt and pt<=now:history_event_count+=1;add_log(f"Event Recorded: {et} involving {ecs} (Predicted @ {pt.strftime('%H:%M:%S')})")
+                else:add_log(f"Prediction Expired: {et} involving {ecs} (Was predicted @ {pt.strftime('%H:%M:%S')if pt else'N/A'})")
+                try:
+                    if et=='AC-AC'and len(eid)==3:
+                        i1,i2,_=eid;a1,a2=aircraft_dict.get(i1),aircraft_dict.get(i2)
+                        if a1 and 'event_ids' in a1:a1['event_ids'].discard(eid)
+                        if a2 and 'event_ids' in a2:a2['event_ids'].discard(eid)
+                    elif et in['AC-Sun','AC-Moon']and len(eid)==2:
+                        i,_=eid;ace=aircraft_dict.get(i)
+                        if ace and 'event_ids' in ace:ace['event_ids'].discard(eid)
+                except Exception as e_d:print(f"Warn: Error discarding event ID {eid}: {e_d}")
+        active_eids={eid[0]for eid,ev in event_dict.items()if ev['type']in['AC-Sun','AC-Moon']}|{eid[i]for eid,ev in event_dict.items()if ev['type']=='AC-AC'for i in range(2)}
+        for icao,data in aircraft_dict.items():
+            if icao not in active_eids:data['conflict']=None
+        aircraft_dict.expire(now.timestamp()-DATA_RETENTION_SECONDS) # Long-silent aircraft free their rows
+def start_replay(path, speed=1.0, start_offset_sec=0.0):
+    """
+    Offline data source: feeds a capture file through the normal batched ingest path with the
+    recorded receive timestamps, driving the virtual clock (speed x real time, or None = max).
+    """
     global DUMP1090_CONNECTED
-    while running:
-        print(f"[*] Connecting to dump1090 at {HOST}:{PORT}...")
-        try:
-            with socket.socket(socket.AF_INET,socket.SOCK_STREAM)as s:
-                s.settimeout(10.0);s.connect((HOST,PORT));print("[*] Connected to dump1090.")
-                with lock:DUMP1090_CONNECTED=True
-                s.settimeout(None);buffer=''
+    try: reader = CaptureReader(path)
+    except (OSError, ValueError) as e: print(f"[!] Cannot open capture {path}: {e}"); return
+    if not reader.index: print(f"[!] Capture {path} is empty."); return
+    t_start = reader.start_ts + start_offset_sec
+    clock.start_replay(t_start, speed)
+    print(f"[*] Replaying {path} ({reader.end_ts - reader.start_ts:.0f}s of data, {len(reader.index)} chunks) at {'max' if speed is None else f'{speed:g}x'} speed.")
+    with lock: DUMP1090_CONNECTED = True
+    n_msgs = 0; t0 = time.perf_counter()
+    for ts_s, lines in reader.batches(from_ts=t_start):
+        if not running: break
+        if speed is None: clock.advance(ts_s)
+        else:
+            wait = (ts_s - clock.epoch()) / speed
+            if wait > 0: time.sleep(wait)
+        try: n_msgs += ingest_sbs_lines(lines, datetime.fromtimestamp(ts_s, timezone.utc))
+        except Exception as e: print(f"[!] Error processing replay data: {e}"); traceback.print_exc()
+    clock.finish()
+    with lock: DUMP1090_CONNECTED = False
+    print(f"[*] Replay finished: {n_msgs} messages in {time.perf_counter() - t0:.1f}s.")
+# --- Prediction Worker Pool ---
+POOL_MIN_PAIRS = 48 # Fewer AC-AC candidate pairs than this are refined in-process (a round trip costs more)
+POOL_MIN_AIRCRAFT = 16 # Same for aircraft with coarse Sun/Moon hits
+class SharedStateBlock:
+    """
+    Per-cycle arrays in one multiprocessing.shared_memory segment, kept for the session (one block
+    per predictor in shared_blocks) and regrown when too small. publish() copies the arrays in and
+    returns a small picklable reference (slot, segment name, layout) that workers resolve with
+    attach_shared_arrays().
+    """
+    def __init__(self, slot):
+        self.slot = slot; self.shm = None
+    def publish(self, **arrays):
+        layout, size = [], 0
+        for name, arr in arrays.items():
+            arr = np.ascontiguousarray(arr)
+            layout.append((name, arr.shape, arr.dtype.str, size)); size += (arr.nbytes + 7) // 8 * 8
+        if self.shm is None or self.shm.size < size:
+            self.close()
+            self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1 << 16) * 2)
+        for (name, shape, dtype, off), arr in zip(layout, arrays.values()):
+            np.ndarray(shape, dtype, buffer=self.shm.buf, offset=off)[...] = arr
+        return self.slot, self.shm.name, tuple(layout)
+    def close(self):
+        if self.shm is None: return
+        try: self.shm.close(); self.shm.unlink()
+        except (OSError, BufferError): pass
+        self.shm = None
+shared_blocks = {'acac': SharedStateBlock('acac'), 'celestial': SharedStateBlock('celestial')}
+_attached_blocks = {} # Worker side: slot -> (segment name, SharedMemory)
+def attach_shared_arrays(ref):
+    """Worker side: read-only views of the arrays published under ref (no copy)."""
+    slot, name, layout = ref
+    cached = _attached_blocks.get(slot)
+    if cached is None or cached[0] != name: # First use, or the parent regrew the block
+        if cached is not None:
+            try: cached[1].close()
+            except (OSError, BufferError): pass
+        cached = _attached_blocks[slot] = (name, shared_memory.SharedMemory(name=name))
+    shm = cached[1]
+    views = {}
+    for key, shape, dtype, off in layout:
+        views[key] = np.ndarray(shape, dtype, buffer=shm.buf, offset=off); views[key].flags.writeable = False
+    return views
+def apply_prediction_settings(context):
+    """Worker side: adopt the parent's prediction_context() before computing."""
+    global USER_LAT, USER_LON, USER_ALT, USER_ALT_FT, CONFLICT_ANGLE_DEG, CONFLICT_RADIUS_KM, PREDICTION_HORIZON, PREDICTION_STEP, REFRACTION_CORRECTION
+    if context == prediction_context(): return
+    USER_LAT, USER_LON, USER_ALT, CONFLICT_ANGLE_DEG, CONFLICT_RADIUS_KM, PREDICTION_HORIZON, PREDICTION_STEP, REFRACTION_CORRECTION = context
+    USER_ALT_FT = USER_ALT * 3.28084
+def acac_pool_task(pairs, ref, context, ids, now):
+    apply_prediction_settings(context)
+    arr = attach_shared_arrays(ref)
+    return acac_fine_phase(arr['states'], ids, arr['los'], arr['los_norm'], prediction_time_grid(), [tuple(p) for p in pairs], now)
+def celestial_pool_task(rows, ref, context, ids, body_table, now):
+    apply_prediction_settings(context)
+    arr = attach_shared_arrays(ref)
+    return celestial_fine_phase(arr['states'], ids, rows, arr['hits'][rows], body_table, now)
+class PredictionPool:
+    """
+    Worker processes for the AC-AC and celestial fine phases, so refinement runs outside the GIL
+    shared with the render loop and the feed. Workers are spawned once; each cycle's work is cut
+    into one chunk per worker and the results are merged in submission order.
+    """
+    def __init__(self, workers):
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        self.warmup = [self.executor.submit(os.getpid) for _ in range(workers)] # Spawn (and import) now, not mid-cycle
+    def run(self, task, items, *args):
+        """task(chunk, *args) -> (results, solver_runs) for each chunk of items; returns the merged pair."""
+        chunks = [c for c in np.array_split(np.asarray(items), self.workers) if len(c)]
+        futures = [self.executor.submit(task, c, *args) for c in chunks]
+        results, solver_runs = [], []
+        for f in futures:
+            r, s = f.result(); results.extend(r); solver_runs.extend(s)
+        return results, solver_runs
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+prediction_pool = None
+def start_prediction_pool(workers):
+    global prediction_pool
+    if workers < 1 or prediction_pool is not None: return
+    try:
+        prediction_pool = PredictionPool(workers)
+        print(f"Prediction pool: {workers} worker processes.")
+    except Exception as e: print(f"Prediction pool unavailable ({e}); predicting in-process."); prediction_pool = None
+def stop_prediction_pool():
+    global prediction_pool
+    if prediction_pool is not None: prediction_pool.shutdown(); prediction_pool = None
+    for block in shared_blocks.values(): block.close()
+# --- Async Core ---
+FEED_CONNECT_TIMEOUT = 10.0 # Seconds allowed for the dump1090 TCP connect
+FEED_RECONNECT_MIN_SEC = 1.0; FEED_RECONNECT_MAX_SEC = 30.0 # Reconnect backoff, doubled per failed attempt
+EVENT_SWEEP_INTERVAL = 1.0 # Seconds between expiry sweeps
+event_updates = queue.SimpleQueue() # (eid, event, icaos, conflict label) from the predictors, drained by the UI
+def post_event(eid, ed, icaos, conflict_msg):
+    """Predictor side: hand a new/updated event to the UI instead of writing event_dict directly."""
+    event_updates.put((eid, ed, icaos, conflict_msg))
+def apply_event_updates():
+    """UI side: merge every queued event into event_dict and the aircraft records in one lock hold."""
+    items = []
+    try:
+        while True: items.append(event_updates.get_nowait())
+    except queue.Empty: pass
+    if not items: return 0
+    with lock:
+        for eid, ed, icaos, conflict_msg in items:
+            event_dict[eid] = ed
+            for icao in icaos:
+                ac = aircraft_dict.get(icao)
+                if ac:
+                    ac.setdefault('event_ids', set()).add(eid)
+                    ac['conflict'] = conflict_msg
+    return len(items)
+async def clock_sleep(seconds):
+    """Awaitable clock.sleep(): scaled real time, or (as-fast-as-possible replay) virtual time in a worker."""
+    if clock.live or clock.finished: await asyncio.sleep(seconds)
+    elif clock.speed is not None: await asyncio.sleep(seconds / clock.speed)
+    else: await asyncio.get_running_loop().run_in_executor(None, clock.sleep, seconds)
+async def listen_feed():
+    """dump1090 BaseStation client on asyncio streams, reconnecting with exponential backoff."""
+    global DUMP1090_CONNECTED
+    recorder = None
+    if CLI.record:
+        try: recorder = CaptureRecorder(CLI.record); print(f"[*] Recording feed to {CLI.record}")
+        except (OSError, ValueError) as e: print(f"[!] Cannot record to {CLI.record}: {e}")
+    backoff = FEED_RECONNECT_MIN_SEC
+    try:
+        while running:
+            print(f"[*] Connecting to dump1090 at {HOST}:{PORT}...")
+            writer = None
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(HOST, PORT), FEED_CONNECT_TIMEOUT)
+                print("[*] Connected to dump1090."); backoff = FEED_RECONNECT_MIN_SEC
+                with lock: DUMP1090_CONNECTED = True
+                framer = SBSStreamFramer()
                 while running:
+                    data = await reader.read(len(framer.buf))
+                    if not data: print("[!] Connection closed by remote host."); break
                     try:
-                        data=s.recv(4096)
-                        if not data:print("[!] Connection closed by remote host.");break
-                        buffer+=data.decode('utf-8',errors='ignore')
-                        while'\n'in buffer:
-                            line,buffer=buffer.split('\n',1)
-                            if not line.strip():continue
-                            parsed=parse_basestation_line(line)
-                            if parsed:update_aircraft(parsed)
-                    except socket.timeout:print("[!] Socket read timeout (unexpected).");break
-                    except OSError as e:print(f"[!] Socket error: {e}");break
-                    except Exception as e:print(f"[!] Error processing data: {e}");traceback.print_exc();continue
-        except socket.timeout:print(f"[*] Connection attempt timed out. Retrying...")
-        except ConnectionRefusedError:print(f"[*] Connection refused by {HOST}:{PORT}. Is dump1090 running? Retrying...")
-        except OSError as e:print(f"[*] OS Error connecting: {e}. Retrying...")
-        except Exception as e:print(f"[*] Unexpected error connecting: {e}. Retrying...")
-        with lock:DUMP1090_CONNECTED=False
-        if running:print("[*] Waiting 5 seconds before retry...");time.sleep(5)
-    print("Listener thread exiting.")
+                        lines = framer.feed(data)
+                        if lines:
+                            rx_t = utc_now()
+                            if recorder: recorder.record(lines, rx_t)
+                            ingest_sbs_lines(lines, rx_t)
+                    except Exception as e: print(f"[!] Error processing data: {e}"); traceback.print_exc()
+            except asyncio.TimeoutError: print("[*] Connection attempt timed out.")
+            except ConnectionRefusedError: print(f"[*] Connection refused by {HOST}:{PORT}. Is dump1090 running?")
+            except OSError as e: print(f"[*] Socket error: {e}")
+            finally:
+                if writer: writer.close()
+            with lock: DUMP1090_CONNECTED = False
+            if recorder: recorder.flush()
+            if running:
+                print(f"[*] Retrying in {backoff:g} seconds..."); await asyncio.sleep(backoff)
+                backoff = min(FEED_RECONNECT_MAX_SEC, backoff * 2)
+    finally:
+        if recorder: recorder.close()
+        print("Feed listener stopped.")
+async def schedule_predictor(name, predict_cycle, scheduler, executor):
+    """
+    Runs a full predict_cycle() in the executor every PREDICTION_INTERVAL, measured start to start,
+    so a slow cycle is followed directly by the next instead of by a further full interval of sleep.
+    Full cycles get PREDICTION_BUDGET_FRACTION of the interval; in between, the scheduler's hot set
+    is re-predicted every priority_interval() within PRIORITY_BUDGET_FRACTION of that interval, as
+    long as the refresh (sleep plus budget) still fits before the next full cycle.
+    """
+    loop = asyncio.get_running_loop()
+    async def run(**kw):
+        try: await loop.run_in_executor(executor, functools.partial(predict_cycle, **kw))
+        except Exception as e: print(f"[!] {name} prediction cycle failed: {e}"); traceback.print_exc()
+    while running:
+        t0 = clock.epoch()
+        await run(budget=PREDICTION_INTERVAL * PREDICTION_BUDGET_FRACTION)
+        step = priority_interval()
+        while running and PREDICTION_INTERVAL - (clock.epoch() - t0) >= step * (1.0 + PRIORITY_BUDGET_FRACTION):
+            await clock_sleep(step)
+            if scheduler.hot: await run(focus=scheduler.hot, budget=step * PRIORITY_BUDGET_FRACTION)
+        await clock_sleep(max(0.0, PREDICTION_INTERVAL - (clock.epoch() - t0)))
+async def refresh_transit_strips():
+    """Keeps the render thread's requested transit strips current (see TransitStripCache)."""
+    loop = asyncio.get_running_loop()
+    while running:
+        if transit_strips.wanted:
+            try: await loop.run_in_executor(None, transit_strips.refresh)
+            except Exception as e: print(f"[!] Transit strip refresh failed: {e}"); traceback.print_exc()
+        else: transit_strips.entries.clear()
+        await asyncio.sleep(TRANSIT_STRIP_REFRESH_INTERVAL)
+async def refresh_shadow_heatmap():
+    """Rebuilds the shadow heatmap every SHADOW_HEATMAP_INTERVAL while the layer is shown."""
+    loop = asyncio.get_running_loop()
+    while running:
+        if SHOW_SHADOW_HEATMAP:
+            try: await loop.run_in_executor(None, shadow_heatmap.rebuild)
+            except Exception as e: print(f"[!] Shadow heatmap rebuild failed: {e}"); traceback.print_exc()
+        elif shadow_heatmap.image is not None: shadow_heatmap.clear()
+        await clock_sleep(SHADOW_HEATMAP_INTERVAL)
+async def sweep_events():
+    while running:
+        try: sweep_expired_events()
+        except Exception as e: print(f"[!] Expiry sweep failed: {e}"); traceback.print_exc()
+        await clock_sleep(EVENT_SWEEP_INTERVAL)
+async def async_core():
+    """
+    Single event loop owning the feed (live socket or capture replay), expiry sweeps, transit strip
+    and shadow heatmap refreshes and the prediction schedule. Prediction cycles run in a small thread pool; results reach the UI through
+    event_updates. Returns once `running` is cleared.
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="Predictor")
+    if PREDICTION_INTERVAL < priority_interval() * (1.0 + PRIORITY_BUDGET_FRACTION):
+        print(f"[!] Prediction interval {PREDICTION_INTERVAL:g}s leaves no room for focused refreshes every {priority_interval():g}s; hot aircraft only refresh with full cycles.")
+    start_prediction_pool(CLI.workers)
+    if CLI.replay: feed = loop.run_in_executor(None, start_replay, CLI.replay, CLI.speed, CLI.replay_from)
+    else: feed = asyncio.ensure_future(listen_feed())
+    tasks = [feed, asyncio.ensure_future(sweep_events()),
+             asyncio.ensure_future(schedule_predictor("AC-AC", functools.partial(predict_conflicts, max_cycles=1, cache=PredictionCache()), acac_scheduler, executor))]
+    if eph: tasks += [asyncio.ensure_future(schedule_predictor("Celestial", functools.partial(predict_celestial_conflicts, max_cycles=1, cache=PredictionCache()), celestial_scheduler, executor)),
+                      asyncio.ensure_future(refresh_transit_strips()), asyncio.ensure_future(refresh_shadow_heatmap())]
+    while running: await asyncio.sleep(0.2)
+    for task in tasks: task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    executor.shutdown(wait=False)
+    stop_prediction_pool()
+def run_async_core():
+    try: asyncio.run(async_core())
+    except Exception as e: print(f"Async core stopped with error: {e}"); traceback.print_exc()
+    print("Async core exiting.")
 
 class ConfigDialog(tk.Toplevel): # Structurally unchanged
     def __init__(self, master, current_config, result_container):
@@ -1227,7 +2527,7 @@ class ConfigDialog(tk.Toplevel): # Structurally unchanged
         self.notebook.add(self.frame_display, text='Display')
         self.notebook.add(self.frame_vector_map, text='Vector Map Layers')
         self.notebook.pack(expand=True, fill="both", padx=5, pady=5)
-        self.entries={};self.airport_checkboxes={};self.navaid_checkboxes={};self.show_history_cb=None;self.show_events_cb=None;self.error_label=None;self.show_glideslope_cb=None;self.show_range_rings_cb=None;self.range_ring_spacing_combo=None;self.show_all_transit_cb=None;self.show_velocity_vector_cb=None;self.velocity_vector_combo=None;self.vector_layer_checkboxes={}
+        self.entries={};self.airport_checkboxes={};self.navaid_checkboxes={};self.show_history_cb=None;self.show_events_cb=None;self.error_label=None;self.show_glideslope_cb=None;self.show_range_rings_cb=None;self.range_ring_spacing_combo=None;self.show_all_transit_cb=None;self.show_shadow_heatmap_cb=None;self.show_velocity_vector_cb=None;self.velocity_vector_combo=None;self.vector_layer_checkboxes={}
         self._create_user_widgets(current_config);self._create_predict_widgets(current_config);self._create_display_widgets(current_config);self._create_vector_map_widgets(current_config)
         button_frame=ttk.Frame(self);self.error_label=tk.Label(button_frame,text="",fg="red",justify=tk.LEFT,wraplength=350);self.error_label.pack(side=tk.LEFT,fill=tk.X,expand=True,padx=5)
         ok_button=ttk.Button(button_frame,text="OK",width=10,command=self.on_ok);ok_button.pack(side=tk.RIGHT,padx=5)
@@ -1265,6 +2565,7 @@ class ConfigDialog(tk.Toplevel): # Structurally unchanged
         self.show_events_cb=ttk.Checkbutton(gf,text="Show Event Locations");self.show_events_cb.grid(row=cr,column=0,columnspan=2,sticky="w",padx=5,pady=2);cr+=1;self.show_events_cb.state(['selected'if cfg.get("show_events",DEFAULT_SHOW_EVENT_LOCATIONS)else'!selected','!alternate'])
         self.show_glideslope_cb=ttk.Checkbutton(gf,text="Show Runway Glideslopes");self.show_glideslope_cb.grid(row=cr,column=0,columnspan=2,sticky="w",padx=5,pady=2);cr+=1;self.show_glideslope_cb.state(['selected'if cfg.get("show_glideslope",DEFAULT_SHOW_GLIDESLOPE)else'!selected','!alternate'])
         self.show_all_transit_cb=ttk.Checkbutton(gf,text="Show All Aircraft Transit Strips");self.show_all_transit_cb.grid(row=cr,column=0,columnspan=2,sticky="w",padx=5,pady=2);cr+=1;self.show_all_transit_cb.state(['selected'if cfg.get("show_all_transit_strips",DEFAULT_SHOW_ALL_TRANSIT_STRIPS)else'!selected','!alternate'])
+        self.show_shadow_heatmap_cb=ttk.Checkbutton(gf,text="Show Shadow Heatmap (All Aircraft)");self.show_shadow_heatmap_cb.grid(row=cr,column=0,columnspan=2,sticky="w",padx=5,pady=2);cr+=1;self.show_shadow_heatmap_cb.state(['selected'if cfg.get("show_shadow_heatmap",DEFAULT_SHOW_SHADOW_HEATMAP)else'!selected','!alternate'])
         ttk.Separator(gf).grid(row=cr,column=0,columnspan=2,sticky="ew",pady=(10,5));cr+=1
         self.show_range_rings_cb=ttk.Checkbutton(gf,text="Show Range Rings");self.show_range_rings_cb.grid(row=cr,column=0,columnspan=2,sticky="w",padx=5,pady=2);cr+=1;self.show_range_rings_cb.state(['selected'if cfg.get("show_range_rings",DEFAULT_SHOW_RANGE_RINGS)else'!selected','!alternate'])
         tk.Label(gf,text="Range Ring Spacing:").grid(row=cr,column=0,sticky="w",padx=5,pady=2)
@@ -1404,7 +2705,7 @@ class ConfigDialog(tk.Toplevel): # Structurally unchanged
             def is_sel(w):return w.instate(['selected'])if w and isinstance(w,ttk.Checkbutton)else False
             vc["show_history"]=is_sel(self.show_history_cb);vc["show_velocity_vector"]=is_sel(self.show_velocity_vector_cb)
             vc["show_events"]=is_sel(self.show_events_cb);vc["show_glideslope"]=is_sel(self.show_glideslope_cb)
-            vc["show_all_transit_strips"]=is_sel(self.show_all_transit_cb);vc["show_range_rings"]=is_sel(self.show_range_rings_cb)
+            vc["show_all_transit_strips"]=is_sel(self.show_all_transit_cb);vc["show_shadow_heatmap"]=is_sel(self.show_shadow_heatmap_cb);vc["show_range_rings"]=is_sel(self.show_range_rings_cb)
             svvd=self.velocity_vector_combo.get()
             try:
                 svvs=svvd.split(" ")[0];svvf=float(svvs)
@@ -1448,7 +2749,7 @@ class ConfigDialog(tk.Toplevel): # Structurally unchanged
     def destroy_and_cleanup_master(self):
         try:self.destroy()
         except:pass
-        refs=['entries','airport_checkboxes','navaid_checkboxes','show_history_cb','show_events_cb','show_glideslope_cb','show_range_rings_cb','range_ring_spacing_combo','show_all_transit_cb','velocity_vector_combo','show_velocity_vector_cb','vector_layer_checkboxes','error_label','frame_user','frame_predict','frame_display','frame_vector_map','notebook']
+        refs=['entries','airport_checkboxes','navaid_checkboxes','show_history_cb','show_events_cb','show_glideslope_cb','show_range_rings_cb','range_ring_spacing_combo','show_all_transit_cb','show_shadow_heatmap_cb','velocity_vector_combo','show_velocity_vector_cb','vector_layer_checkboxes','error_label','frame_user','frame_predict','frame_display','frame_vector_map','notebook']
         for an in refs:
             if hasattr(self,an):
                 av=getattr(self,an);
@@ -1515,7 +2816,7 @@ def draw_conflict_schematic(surface, event_data, screen_x, screen_y):
     txt = font_s.render(f"{min_dist:.2f}km", True, (255, 255, 255))
     s.blit(txt, (BOX_SIZE/2 - txt.get_width()/2, BOX_SIZE/2))
     dh_ft = ac2['altitude'] - ac1['altitude']
-    txt_dh = font_s.render(f"dH: {dh_ft:+}ft", True, (200, 200, 200))
+    txt_dh = font_s.render(f"dH: {dh_ft:+.0f}ft", True, (200, 200, 200))
     s.blit(txt_dh, (5, BOX_SIZE - 15))
     surface.blit(s, (CENTER_X, CENTER_Y))
 def draw_pov_schematic(surface, event_data, screen_x, screen_y):
@@ -1656,7 +2957,7 @@ def draw_selected_aircraft_detail(surface, icao, offset_x, offset_y):
         s.blit(ts_val, (WIDTH - PADDING - ts_val.get_width(), curr_y))      
         curr_y += LINE_HEIGHT
     # Last Seen
-    last_seen_s = (datetime.now(timezone.utc) - ac['timestamp']).total_seconds()
+    last_seen_s = (utc_now() - ac['timestamp']).total_seconds()
     ts_lbl_time = font_ui.render("Last Seen:", True, (180, 180, 180))
     ts_val_time = font_ui.render(f"{last_seen_s:.1f}s ago", True, (255, 255, 0) if last_seen_s > 10 else (0, 255, 0))
     s.blit(ts_lbl_time, (PADDING, curr_y))
@@ -1670,44 +2971,186 @@ def draw_selected_aircraft_detail(surface, icao, offset_x, offset_y):
         s.blit(ts_lbl_dist, (PADDING, curr_y))
         s.blit(ts_val_dist, (WIDTH - PADDING - ts_val_dist.get_width(), curr_y))
     surface.blit(s, (offset_x + PANEL_X, offset_y + PANEL_Y))  
+# --- Vector Layer Spatial Index ---
+MAP_TILE_DEG = 2.0 # Tile size of the per-layer grid index
+VECTOR_CACHE_FORMAT = 4 # Bump when the cached layer layout changes
+class VectorLayer:
+    """
+    One vector map layer as flat NumPy arrays: all feature points concatenated (points, offsets)
+    with per-feature bboxes (min_lon, max_lon, min_lat, max_lat), plus a MAP_TILE_DEG grid index in
+    CSR form: tile_features[tile_start[k]:tile_start[k + 1]] are the features touching tile k.
+    Built once from the parsed shapefile and cached as one .npy file per array; cached layers are
+    memory-mapped, so loading reads only the small header and pages are touched as features are drawn.
+    """
+    ARRAYS = ('points', 'offsets', 'bboxes', 'tile_start', 'tile_features')
+    def __init__(self, arrays, tile_deg=MAP_TILE_DEG):
+        for name in self.ARRAYS: setattr(self, name, arrays[name])
+        self.tile_deg = tile_deg
+        self.nx, self.ny = int(ceil(360.0 / tile_deg)), int(ceil(180.0 / tile_deg))
+    @classmethod
+    def from_features(cls, features, tile_deg=MAP_TILE_DEG):
+        """Build from a list of (pts_array, bbox) tuples (the parsed shapefile)."""
+        n = len(features)
+        sizes = np.array([len(pts) for pts, _ in features], dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(sizes)))
+        points = np.concatenate([pts for pts, _ in features]).astype(np.float32) if n else np.empty((0, 2), dtype=np.float32)
+        bboxes = np.array([bbox for _, bbox in features], dtype=np.float32).reshape(n, 4)
+        nx, ny = int(ceil(360.0 / tile_deg)), int(ceil(180.0 / tile_deg))
+        tx0, tx1 = cls._tile_range(bboxes[:, 0], bboxes[:, 1], -180.0, tile_deg, nx)
+        ty0, ty1 = cls._tile_range(bboxes[:, 2], bboxes[:, 3], -90.0, tile_deg, ny)
+        w, h = tx1 - tx0 + 1, ty1 - ty0 + 1
+        counts = w * h
+        fid = np.repeat(np.arange(n), counts)
+        j = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) # Index within each feature's tile block
+        tiles = (ty0[fid] + j // w[fid]) * nx + tx0[fid] + j % w[fid]
+        order = np.argsort(tiles, kind='stable')
+        tile_start = np.searchsorted(tiles[order], np.arange(nx * ny + 1))
+        return cls({'points': points, 'offsets': offsets, 'bboxes': bboxes, 'tile_start': tile_start, 'tile_features': fid[order]}, tile_deg)
+    @staticmethod
+    def _tile_range(lo, hi, origin, tile_deg, n):
+        return (np.clip(np.floor((lo - origin) / tile_deg), 0, n - 1).astype(np.int64),
+                np.clip(np.floor((hi - origin) / tile_deg), 0, n - 1).astype(np.int64))
+    def __len__(self): return len(self.bboxes)
+    def feature(self, k):
+        return self.points[self.offsets[k]:self.offsets[k + 1]]
+    def query(self, min_lon, max_lon, min_lat, max_lat):
+        """Sorted ids of the features whose bbox intersects the given lon/lat box."""
+        tx0, tx1 = self._tile_range(np.array([min_lon]), np.array([max_lon]), -180.0, self.tile_deg, self.nx)
+        ty0, ty1 = self._tile_range(np.array([min_lat]), np.array([max_lat]), -90.0, self.tile_deg, self.ny)
+        rows = np.arange(ty0[0], ty1[0] + 1) * self.nx
+        starts, ends = self.tile_start[rows + tx0[0]], self.tile_start[rows + tx1[0] + 1] # Tiles of one row are contiguous
+        if not (ends - starts).any(): return np.empty(0, dtype=np.int64)
+        ids = np.unique(np.concatenate([self.tile_features[s:e] for s, e in zip(starts, ends)]))
+        b = self.bboxes[ids]
+        return ids[(b[:, 1] >= min_lon) & (b[:, 0] <= max_lon) & (b[:, 3] >= min_lat) & (b[:, 2] <= max_lat)]
+    def save(self, cache_dir, source):
+        """Write the arrays plus meta.json (format, tile size, source stamp); meta goes last and marks the cache complete."""
+        meta_path = os.path.join(cache_dir, "meta.json")
+        os.makedirs(cache_dir, exist_ok=True)
+        if os.path.exists(meta_path): os.remove(meta_path)
+        for name in self.ARRAYS: np.save(os.path.join(cache_dir, f"{name}.npy"), getattr(self, name))
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump({'format': VECTOR_CACHE_FORMAT, 'tile_deg': self.tile_deg, 'source': source}, f)
+    @classmethod
+    def load(cls, cache_dir, source):
+        """Memory-mapped layer from cache_dir, or None if missing or stale. source=None accepts any stamp."""
+        try:
+            with open(os.path.join(cache_dir, "meta.json"), 'r', encoding='utf-8') as f: meta = json.load(f)
+        except (OSError, ValueError): return None
+        if meta.get('format') != VECTOR_CACHE_FORMAT or meta.get('tile_deg') != MAP_TILE_DEG: return None
+        if source is not None and meta.get('source') != source: return None
+        return cls({name: np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode='r') for name in cls.ARRAYS}, meta['tile_deg'])
+def simplify_features(layer, tolerance_deg):
+    """Douglas-Peucker (shapely) copy of a VectorLayer as a (pts_array, bbox) list; parts left with < 2 points are dropped."""
+    features = []
+    for k in range(len(layer)):
+        pts = np.asarray(layer.feature(k))
+        if len(pts) > 2:
+            try: pts = np.asarray(LineString(pts).simplify(tolerance_deg, preserve_topology=False).coords, dtype=np.float32)
+            except Exception: pass
+        if len(pts) < 2: continue
+        features.append((pts, (pts[:, 0].min(), pts[:, 0].max(), pts[:, 1].min(), pts[:, 1].max())))
+    return features
+class VectorLayerPyramid:
+    """
+    Levels of detail of one layer: levels[k] is the VectorLayer simplified with tolerances[k]
+    degrees (level 0 is the shapefile as parsed, each coarser level is simplified from the one
+    before). level_for() picks the coarsest level whose tolerance stays under
+    VECTOR_LOD_PIXEL_TOLERANCE screen pixels, so a redraw feeds roughly the same number of vertices
+    at every zoom. Levels are cached in lod<k>/ subdirectories next to a meta.json of their own.
+    """
+    def __init__(self, levels, tolerances):
+        self.levels, self.tolerances = levels, tuple(tolerances)
+        self.source = None # Shapefile stamp the layer was built from (part of the map tile key)
+    @classmethod
+    def build(cls, features, is_point=False):
+        tolerances = (0.0,) if is_point else VECTOR_LOD_TOLERANCES_DEG
+        levels = [VectorLayer.from_features(features)]
+        for tol in tolerances[1:]: levels.append(VectorLayer.from_features(simplify_features(levels[-1], tol)))
+        return cls(levels, tolerances)
+    def __len__(self): return len(self.levels[0])
+    def level_for(self, px_per_km):
+        """VectorLayer to draw at a map scale of px_per_km."""
+        deg_per_px = 1.0 / (max(px_per_km, 1e-9) * EARTH_RADIUS_KM * radians(1))
+        k = 0
+        while k + 1 < len(self.levels) and self.tolerances[k + 1] <= VECTOR_LOD_PIXEL_TOLERANCE * deg_per_px: k += 1
+        return self.levels[k]
+    def save(self, cache_dir, source):
+        meta_path = os.path.join(cache_dir, "meta.json")
+        os.makedirs(cache_dir, exist_ok=True)
+        if os.path.exists(meta_path): os.remove(meta_path)
+        for k, level in enumerate(self.levels): level.save(os.path.join(cache_dir, f"lod{k}"), source)
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump({'format': VECTOR_CACHE_FORMAT, 'tolerances': list(self.tolerances), 'source': source}, f)
+    @classmethod
+    def load(cls, cache_dir, source, is_point=False):
+        """Memory-mapped pyramid from cache_dir, or None if missing or stale (see VectorLayer.load)."""
+        try:
+            with open(os.path.join(cache_dir, "meta.json"), 'r', encoding='utf-8') as f: meta = json.load(f)
+        except (OSError, ValueError): return None
+        tolerances = (0.0,) if is_point else VECTOR_LOD_TOLERANCES_DEG
+        if meta.get('format') != VECTOR_CACHE_FORMAT or tuple(meta.get('tolerances', ())) != tolerances: return None
+        if source is not None and meta.get('source') != source: return None
+        levels = [VectorLayer.load(os.path.join(cache_dir, f"lod{k}"), source) for k in range(len(tolerances))]
+        return None if any(level is None for level in levels) else cls(levels, tolerances)
 class MapDataManager:
     def __init__(self, data_dir):
         self.data_dir = data_dir
         self.cache_dir = os.path.join(data_dir, "cache")
         if not os.path.exists(self.cache_dir):
             os.makedirs(self.cache_dir)
-        # datatype: { 'layer_key': [ (numpy_points_nx2, bbox_tuple), ... ] }
+        # datatype: { 'layer_key': VectorLayerPyramid }
         self.layers_data = {}
     def get_cache_path(self, layer_key):
-        return os.path.join(self.cache_dir, f"{layer_key}.pkl")
-    def load_layer(self, layer_key, config):
-        """Load from cache or fallback to Shapefile parsing and cache generation."""
+        return os.path.join(self.cache_dir, layer_key)
+    def _shapefile_path(self, layer_key, config):
+        base_vector_path = resource_path(os.path.join("data", "map_vectors"))
+        return os.path.join(base_vector_path, layer_key, config.get("shp_filename", layer_key) + ".shp")
+    def load_layer(self, layer_key, config, build_pool=None):
+        """
+        Load from cache or fallback to Shapefile parsing and cache generation; returns 'cache' or 'parsed'.
+        build_pool() may supply a process pool so a cold cache is built outside this process and mapped in.
+        """
         cache_path = self.get_cache_path(layer_key)
-        if os.path.exists(cache_path):
-            try:
-                with open(cache_path, 'rb') as f:
-                    print(f"Loading {layer_key} from fast cache...")
-                    self.layers_data[layer_key] = pickle.load(f)
-                    return True
-            except Exception as e:
-                print(f"Cache load failed for {layer_key}, rebuilding... ({e})")
-        raw_data = self._read_shapefile(layer_key, config)
+        shapefile_path = self._shapefile_path(layer_key, config)
+        try:
+            st = os.stat(shapefile_path); source = [st.st_size, st.st_mtime_ns]
+        except OSError: source = None # No shapefile: any cache built earlier is the best there is
+        is_point = config.get("type") == "point"
         try:
-            with open(cache_path, 'wb') as f:
-                pickle.dump(raw_data, f)
-            print(f"Built cache for {layer_key}")
+            layer = VectorLayerPyramid.load(cache_path, source, is_point)
+            if layer is not None:
+                layer.source = source
+                print(f"Loading {layer_key} from fast cache...")
+                self.layers_data[layer_key] = layer
+                return "cache"
         except Exception as e:
-            print(f"Failed to write cache for {layer_key}: {e}")
+            print(f"Cache load failed for {layer_key}, rebuilding... ({e})")
+        pool = build_pool() if build_pool and source is not None else None
+        if pool is not None:
+            try:
+                pool.submit(build_vector_layer_cache, self.data_dir, layer_key, config).result()
+                layer = VectorLayerPyramid.load(cache_path, source, is_point)
+                if layer is not None:
+                    layer.source = source; self.layers_data[layer_key] = layer
+                    return "parsed"
+            except Exception as e:
+                print(f"Build process failed for {layer_key}, parsing here... ({e})")
+        layer = VectorLayerPyramid.build(self._read_shapefile(layer_key, config), is_point); layer.source = source
+        if source is not None:
+            try:
+                layer.save(cache_path, source)
+                print(f"Built cache for {layer_key}")
+            except Exception as e:
+                print(f"Failed to write cache for {layer_key}: {e}")
 
-        self.layers_data[layer_key] = raw_data
-        return True
+        self.layers_data[layer_key] = layer
+        return "parsed" if source is not None else "missing"
     def _read_shapefile(self, layer_key, config):
         """Read the raw Shapefile and convert it to a NumPy-optimized format"""
         processed_features = []
-        base_vector_path = resource_path(os.path.join("data", "map_vectors"))
-        layer_dir_path = os.path.join(base_vector_path, layer_key)
+        shapefile_path = self._shapefile_path(layer_key, config)
         shapefile_name = config.get("shp_filename", layer_key)
-        shapefile_path = os.path.join(layer_dir_path, shapefile_name + ".shp")
 
         if not os.path.exists(shapefile_path):
             print(f"Shapefile not found: {shapefile_path}")
@@ -1747,6 +3190,169 @@ class MapDataManager:
             
         return processed_features
 
+# --- Map Tile Cache ---
+MAP_TILE_PX = 256 # Side of one background tile (pixels)
+MAP_TILE_LRU_SIZE = 192 # Tiles kept in memory (256 KB each)
+MAP_TILE_DISK_CACHE = True # Also keep rendered tiles as PNG files under data/cache/tiles
+MAP_TILE_DISK_BUDGET_MB = 200 # Least recently used tiles are deleted beyond this
+MAP_TILE_ZOOM_STEPS = 8 # Tile zoom levels per doubling of scale; the panel rescales tiles by < 4.5% to its exact scale
+MAP_TILE_FORMAT = 2 # Bump when tile rendering changes
+MAP_BACKGROUND_COLOR = (15, 18, 26)
+MAP_POINT_FEATURE_RADIUS = 2
+def draw_vector_layers(surface, layers_data, visibility, scale, user_lat, user_lon, origin_px):
+    """
+    Draw the visible vector layers onto surface in the map panel's projection (local equirectangular
+    around the user, scale px/km). origin_px is the pixel offset, relative to the user's position, of
+    the surface's top-left corner. Returns the number of features drawn.
+    """
+    w, h = surface.get_size()
+    km_per_deg = effective_radius_at_lat(user_lat, 0) * radians(1)
+    lon_factor = max(0.01, cos(radians(user_lat)))
+    proj_factors = np.array([km_per_deg * lon_factor, -km_per_deg], dtype=np.float32) * scale
+    user_pos = np.array([user_lon, user_lat], dtype=np.float32)
+    offset = -np.array(origin_px, dtype=np.float32)
+    # Geographic box of the surface, padded so lines entering from outside are still drawn
+    pad = 2 * MAP_POINT_FEATURE_RADIUS
+    lon_a, lon_b = user_lon + (origin_px[0] - pad) / proj_factors[0], user_lon + (origin_px[0] + w + pad) / proj_factors[0]
+    lat_a, lat_b = user_lat + (origin_px[1] + h + pad) / proj_factors[1], user_lat + (origin_px[1] - pad) / proj_factors[1]
+    drawn = 0
+    for layer_key, is_visible in visibility.items():
+        if not is_visible or layer_key not in layers_data: continue
+        config = VECTOR_LAYER_CONFIGS.get(layer_key, {})
+        color = config.get("color", (100, 100, 100))
+        is_polygon = config.get("type", "line") == "polygon"
+        is_point = config.get("type", "line") == "point"
+        layer = layers_data[layer_key].level_for(scale) # Level of detail for this zoom
+        for feature_id in layer.query(float(lon_a), float(lon_b), float(lat_a), float(lat_b)): # Tile index + bbox test
+            try:
+                screen_pts = np.floor((layer.feature(feature_id) - user_pos) * proj_factors + offset).astype(np.int32) # floor keeps tile seams exact
+                if is_point:
+                    for pt in screen_pts:
+                        if -pad <= pt[0] <= w + pad and -pad <= pt[1] <= h + pad: pygame.draw.circle(surface, color, pt, MAP_POINT_FEATURE_RADIUS)
+                elif len(screen_pts) > 1:
+                    pygame.draw.lines(surface, color, is_polygon, screen_pts, 1)
+                drawn += 1
+            except Exception as e:
+                print(f"[Draw Error] Layer: {layer_key}, Error: {e}")
+    return drawn
+class MapTileCache:
+    """
+    Pre-rendered map background tiles. The map is projected around the user, so at zoom level z
+    (scale 2 ** (z / MAP_TILE_ZOOM_STEPS) px/km) tile (tx, ty) covers pixels [tx, tx + 1) x [ty, ty + 1)
+    * MAP_TILE_PX relative to the user's position. get() returns a ready tile or queues it for the
+    worker thread, which renders the nearest wanted tiles first and drops requests for a level or
+    style no longer on screen. Tiles live in an in-memory LRU and, with MAP_TILE_DISK_CACHE, as PNGs
+    in one directory per style (user position, visible layers and their shapefile stamps). The disk
+    cache drops styles built from other shapefiles or tile formats and is trimmed to
+    MAP_TILE_DISK_BUDGET_MB by file mtime, which reads refresh. `version` changes whenever a tile becomes ready.
+    """
+    def __init__(self, disk_dir=None):
+        self.tiles = collections.OrderedDict(); self.pending = set(); self.requests = queue.Queue()
+        self.wanted = None; self.version = 0; self.rendered = 0; self.disk_hits = 0
+        self.disk_dir = disk_dir; self.thread = None; self.lock = threading.Lock()
+        self.written = 0; self.checked_styles = set()
+    def style(self, layers_data):
+        return (MAP_TILE_FORMAT, USER_LAT, USER_LON, tuple((k, tuple(layers_data[k].source or ())) for k, vis in VECTOR_LAYERS_VISIBILITY.items() if vis and k in layers_data))
+    @staticmethod
+    def zoom_level(scale):
+        """Nearest tile zoom level for a scale in px/km."""
+        return int(round(np.log2(max(scale, 1e-9)) * MAP_TILE_ZOOM_STEPS))
+    @staticmethod
+    def level_scale(level):
+        return 2.0 ** (level / MAP_TILE_ZOOM_STEPS)
+    def get(self, style, level, tx, ty):
+        key = (style, level, tx, ty)
+        with self.lock:
+            self.wanted = (style, level)
+            tile = self.tiles.get(key)
+            if tile is not None: self.tiles.move_to_end(key); return tile
+            if key not in self.pending: self.pending.add(key); self.requests.put(key)
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._worker, name="MapTiles", daemon=True); self.thread.start()
+        return None
+    @staticmethod
+    def _style_dir_name(style):
+        return hashlib.sha1(repr(style).encode()).hexdigest()[:16]
+    def _disk_path(self, key):
+        style, level, tx, ty = key
+        return os.path.join(self.disk_dir, self._style_dir_name(style), f"{level}_{tx}_{ty}.png")
+    def _worker(self):
+        while running:
+            try: key = self.requests.get(timeout=0.5)
+            except queue.Empty: continue
+            with self.lock: stale = key[:2] != self.wanted
+            tile = None
+            if not stale:
+                try: tile = self.render(key)
+                except Exception as e: print(f"Map tile render failed: {e}")
+            with self.lock:
+                self.pending.discard(key)
+                if tile is not None:
+                    self.tiles[key] = tile; self.version += 1
+                    while len(self.tiles) > MAP_TILE_LRU_SIZE: self.tiles.popitem(last=False)
+    def render(self, key):
+        style, level, tx, ty = key
+        path = self._disk_path(key) if self.disk_dir and MAP_TILE_DISK_CACHE else None
+        if path and style not in self.checked_styles: self._open_style(style)
+        if path and os.path.exists(path):
+            try:
+                tile = pygame.image.load(path)
+                try: tile = tile.convert() # Display pixel format, so blits need no conversion
+                except pygame.error: pass # No display mode set (headless use)
+                os.utime(path); self.disk_hits += 1 # mtime doubles as the LRU stamp
+                return tile
+            except Exception: pass
+        tile = pygame.Surface((MAP_TILE_PX, MAP_TILE_PX)); tile.fill(MAP_BACKGROUND_COLOR)
+        layers_data = map_manager.layers_data if map_manager else {}
+        visibility = {k: True for k, _ in style[3]}
+        draw_vector_layers(tile, layers_data, visibility, self.level_scale(level), style[1], style[2], (tx * MAP_TILE_PX, ty * MAP_TILE_PX))
+        self.rendered += 1
+        if path:
+            try: pygame.image.save(tile, path); self.written += 1
+            except Exception as e: print(f"Map tile cache write failed: {e}")
+            if self.written % 64 == 0: self.trim_disk()
+        return tile
+    def _open_style(self, style):
+        """First use of a style this session: create its directory and purge styles that can no longer be hit."""
+        self.checked_styles.add(style)
+        style_dir = os.path.join(self.disk_dir, self._style_dir_name(style))
+        try:
+            os.makedirs(style_dir, exist_ok=True)
+            with open(os.path.join(style_dir, "style.json"), 'w', encoding='utf-8') as f:
+                json.dump({'format': style[0], 'layers': {k: list(src) for k, src in style[3]}}, f)
+        except OSError as e: print(f"Map tile cache write failed: {e}"); return
+        self.purge_stale_styles(dict(style[3]))
+        self.trim_disk()
+    def purge_stale_styles(self, sources):
+        """Delete style directories of another tile format or built from other shapefiles than `sources` (layer -> stamp)."""
+        for name in os.listdir(self.disk_dir):
+            style_dir = os.path.join(self.disk_dir, name)
+            if not os.path.isdir(style_dir): continue
+            try:
+                with open(os.path.join(style_dir, "style.json"), 'r', encoding='utf-8') as f: meta = json.load(f)
+                stale = meta.get('format') != MAP_TILE_FORMAT or any(tuple(src) != sources[k] for k, src in meta.get('layers', {}).items() if k in sources)
+            except (OSError, ValueError, TypeError, AttributeError): stale = True # Unreadable or from an older layout
+            if stale: shutil.rmtree(style_dir, ignore_errors=True)
+        for name in os.listdir(self.disk_dir): # Flat PNGs of the first tile format
+            if name.endswith(".png"):
+                try: os.remove(os.path.join(self.disk_dir, name))
+                except OSError: pass
+    def trim_disk(self):
+        """Delete the least recently used tiles until the cache fits MAP_TILE_DISK_BUDGET_MB."""
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if not name.endswith(".png"): continue
+                path = os.path.join(root, name)
+                try: st = os.stat(path); files.append((st.st_mtime, st.st_size, path))
+                except OSError: pass
+        excess = sum(f[1] for f in files) - MAP_TILE_DISK_BUDGET_MB * 1024 * 1024
+        for _, size, path in sorted(files):
+            if excess <= 0: break
+            try: os.remove(path); excess -= size
+            except OSError: pass
+map_tiles = None # MapTileCache, created with map_manager
+
 class RunwayGlideslopeToggleDialog(tk.Toplevel):
     def __init__(self, master, runway_details, result_container):
         super().__init__(master); self.transient(master); self.title("Toggle Runway Glideslopes")
@@ -1810,8 +3416,8 @@ data_loading_thread = None; data_load_result = [None]
 def reload_geographic_data_threaded_target(airport_filter_list, navaid_filter_list, result_container): # Unchanged
     loaded_data = {'airports': [], 'runways': collections.defaultdict(list), 'navaids': []}
     try:
-        current_airports = load_airports(types_to_show=airport_filter_list); loaded_data['airports'] = current_airports
-        airport_idents = {apt['ident'] for apt in current_airports}; loaded_data['runways'] = load_runways(airport_idents_to_load=airport_idents)
+        loaded_data['airports'] = load_airports(types_to_show=airport_filter_list)
+        loaded_data['runways'] = load_runways() # Cached table: the lookup does not depend on the filters
         loaded_data['navaids'] = load_navaids(types_to_show=navaid_filter_list)
         result_container[:] = [loaded_data]
     except Exception as e: print(f"Data Load ERROR: {e}"); traceback.print_exc(); result_container[:] = [{"error": f"Data Load Error: {e}"}]
@@ -1834,73 +3440,113 @@ def screen_to_geo(screen_x, screen_y, left_rect, scale, center_lat, center_lon):
     click_lat = max(-90.0, min(90.0, center_lat + degrees(delta_lat_rad)))
     return click_lat, click_lon
 
-# --- VECTOR DATA LOADING (uses fixed tolerance) ---
-def load_specific_vector_layer_data(layer_key_to_load, config_for_layer, simplification_tolerance):
-    global map_features_geodata
-    map_features_geodata[layer_key_to_load] = []
-
-    base_vector_path = resource_path(os.path.join("data", "map_vectors"))
-    layer_dir_path = os.path.join(base_vector_path, layer_key_to_load)
-    shapefile_name = config_for_layer.get("shp_filename", layer_key_to_load)
-    shapefile_path = os.path.join(layer_dir_path, shapefile_name + ".shp")
-
-    if os.path.exists(shapefile_path):
-        try:
-            with shapefile.Reader(shapefile_path) as sf:
-                loaded_features_count = 0
-                for shape_rec in sf.iterShapeRecords():
-                    shape_type = shape_rec.shape.shapeType
-                    if shape_type in [shapefile.POLYLINE, shapefile.POLYLINEZ, shapefile.POLYLINEM]:
-                        for i in range(len(shape_rec.shape.parts)):
-                            start_idx = shape_rec.shape.parts[i]
-                            end_idx = shape_rec.shape.parts[i+1] if i < len(shape_rec.shape.parts) - 1 else len(shape_rec.shape.points)
-                            segment_orig = [(lon, lat) for lon, lat in shape_rec.shape.points[start_idx:end_idx]]
-                            if len(segment_orig) >= 2:
-                                try:
-                                    line_g = LineString(segment_orig)
-                                    s_line = line_g.simplify(simplification_tolerance, preserve_topology=True)
-                                    if s_line.geom_type == 'LineString': map_features_geodata[layer_key_to_load].append(list(s_line.coords)); loaded_features_count+=1
-                                    elif s_line.geom_type == 'MultiLineString':
-                                        for part in s_line.geoms: map_features_geodata[layer_key_to_load].append(list(part.coords)); loaded_features_count+=1
-                                except Exception: map_features_geodata[layer_key_to_load].append(segment_orig); loaded_features_count+=1
-                    elif shape_type in [shapefile.POLYGON, shapefile.POLYGONZ, shapefile.POLYGONM]:
-                        s_poly_parts = []
-                        for i in range(len(shape_rec.shape.parts)):
-                            start_idx = shape_rec.shape.parts[i]
-                            end_idx = shape_rec.shape.parts[i+1] if i < len(shape_rec.shape.parts) - 1 else len(shape_rec.shape.points)
-                            ring_orig = [(lon, lat) for lon, lat in shape_rec.shape.points[start_idx:end_idx]]
-                            if len(ring_orig) >= 3:
-                                try:
-                                    ring_line_g = LineString(ring_orig)
-                                    s_ring_line = ring_line_g.simplify(simplification_tolerance, preserve_topology=True)
-                                    if s_ring_line.geom_type == 'LineString': s_poly_parts.append(list(s_ring_line.coords))
-                                    elif s_ring_line.geom_type == 'MultiLineString':
-                                        for part in s_ring_line.geoms: s_poly_parts.append(list(part.coords))
-                                except Exception: s_poly_parts.append(ring_orig)
-                        if s_poly_parts: map_features_geodata[layer_key_to_load].append(s_poly_parts); loaded_features_count+=1
-                    elif shape_type == shapefile.POINT and config_for_layer["type"] == "point":
-                        map_features_geodata[layer_key_to_load].append(shape_rec.shape.points[0]); loaded_features_count+=1
-        except shapefile.ShapefileException as e: print(f"Error reading shapefile {shapefile_path}: {e}")
-        except Exception as e: print(f"Unexpected error loading layer {layer_key_to_load}: {e}")
+# --- Startup Loader ---
+STARTUP_LOADER_WORKERS = max(1, min(4, os.cpu_count() or 1)) # Threads running independent startup stages side by side
+STARTUP_BUILD_PROCESSES = max(0, min(4, (os.cpu_count() or 1) - 1)) # Processes parsing shapefiles with a cold cache (0 = parse on the loader threads)
+def build_vector_layer_cache(data_dir, layer_key, config):
+    """Process-pool entry: parse one shapefile and write its cache, which the caller then maps in."""
+    MapDataManager(data_dir).load_layer(layer_key, config)
+    return layer_key
+class StartupLoader:
+    """
+    Runs the startup stages on a thread pool, each one as soon as the stages it depends on are done.
+    A stage is {'key', 'name', 'run', 'deps', 'apply', 'essential'}: run(*dep_results) executes on a
+    worker, apply(result) runs on the main thread from poll(), so the loading screen can close once
+    the essential stages are in and the rest stream into the running app. Per-stage timings are printed.
+    """
+    def __init__(self, stages, workers=STARTUP_LOADER_WORKERS):
+        self.stages = {s['key']: s for s in stages}
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="Loader")
+        self.build_pool = None # Created on the first cold layer cache only
+        self.lock = threading.RLock() # A done-callback can fire inside _submit_ready itself
+        self.futures = {}; self.timings = {}; self.done = []; self.results = {}
+        self.t0 = time.perf_counter(); self.finished_ms = None
+        self._submit_ready()
+    def _submit_ready(self):
+        with self.lock:
+            for key, stage in self.stages.items():
+                if key in self.futures or not all(d in self.futures and self.futures[d].done() for d in stage['deps']): continue
+                try: self.futures[key] = self.executor.submit(self._run, key)
+                except RuntimeError: return # Shut down
+                self.futures[key].add_done_callback(lambda f: self._submit_ready())
+    def _run(self, key):
+        stage = self.stages[key]; t = time.perf_counter()
+        try: return stage['run'](*[self.futures[d].result() for d in stage['deps']])
+        finally: self.timings[key] = ((t - self.t0) * 1000.0, (time.perf_counter() - t) * 1000.0)
+    def vector_build_pool(self):
+        with self.lock:
+            if self.build_pool is None and STARTUP_BUILD_PROCESSES > 0:
+                try: self.build_pool = ProcessPoolExecutor(max_workers=STARTUP_BUILD_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+                except Exception as e: print(f"Loader: no build processes ({e}); parsing on loader threads.")
+            return self.build_pool
+    def poll(self):
+        """Apply the stages finished since the last call (main thread); returns their keys."""
+        new = [k for k, f in list(self.futures.items()) if f.done() and k not in self.results]
+        for key in new:
+            stage = self.stages[key]; start_ms, dur_ms = self.timings.get(key, (0.0, 0.0))
+            try:
+                result = self.results[key] = self.futures[key].result()
+                if stage.get('apply'): stage['apply'](result)
+                print(f"Loaded {stage['name']} in {dur_ms:.0f} ms (started +{start_ms:.0f} ms){' [' + result + ']' if isinstance(result, str) else ''}")
+            except Exception as e_load:
+                self.results[key] = None
+                print(f"Error during loading stage '{stage['name']}': {e_load}"); traceback.print_exc()
+            self.done.append(key)
+        if new and self.finished() and self.finished_ms is None: self._report()
+        return new
+    def essentials_ready(self):
+        return all(k in self.results for k, s in self.stages.items() if s.get('essential'))
+    def finished(self):
+        return len(self.results) == len(self.stages)
+    def pending_names(self):
+        return [s['name'] for k, s in self.stages.items() if k in self.futures and k not in self.results]
+    def _report(self):
+        self.finished_ms = (time.perf_counter() - self.t0) * 1000.0
+        tags = [r for r in self.results.values() if isinstance(r, str)]
+        print(f"All loading stages complete in {self.finished_ms:.0f} ms (stage total {sum(d for _, d in self.timings.values()):.0f} ms; "
+              f"map layers: {tags.count('cache')} cached, {tags.count('parsed')} parsed, {tags.count('missing')} missing).")
+        self.shutdown()
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.build_pool is not None: self.build_pool.shutdown(wait=False, cancel_futures=True)
+startup_loader = None
+def startup_stages():
+    """The startup stages: ephemeris (essential), the OurAirports CSVs and each vector layer."""
+    def skyfield_run():
+        ephemeris = load(resource_path(os.path.join('data', 'de421.bsp')))
+        return ephemeris, load.timescale(), Topos(latitude_degrees=USER_LAT, longitude_degrees=USER_LON, elevation_m=USER_ALT)
+    def skyfield_apply(result):
+        global eph, ts, observer_topos
+        eph, ts, observer_topos = result
+    def airports_apply(result):
+        global airports_data
+        airports_data = result
+    def runways_apply(result):
+        global runways_data
+        runways_data = result
+    def navaids_apply(result):
+        global navaids_data
+        navaids_data = result
+    def layer_run(layer_key, config):
+        if not map_manager: raise RuntimeError("map_manager is not initialized!")
+        return map_manager.load_layer(layer_key, config, build_pool=startup_loader.vector_build_pool if startup_loader else None)
+    stages = [
+        {'key': 'skyfield', 'name': "Skyfield", 'run': skyfield_run, 'deps': (), 'apply': skyfield_apply, 'essential': True},
+        {'key': 'airports', 'name': "Airport Data", 'run': lambda: load_airports(filename=AIRPORTS_CSV, types_to_show=SHOW_AIRPORT_TYPES), 'deps': (), 'apply': airports_apply},
+        {'key': 'runways', 'name': "Runway Data", 'run': lambda: load_runways(filename=RUNWAYS_CSV), 'deps': (), 'apply': runways_apply},
+        {'key': 'navaids', 'name': "Navaid Data", 'run': lambda: load_navaids(filename=NAVAIDS_CSV, types_to_show=SHOW_NAVAID_TYPES), 'deps': (), 'apply': navaids_apply},
+    ]
+    for layer_key, config in VECTOR_LAYER_CONFIGS.items():
+        stages.append({'key': f"layer:{layer_key}", 'name': f"Map: {config.get('label', layer_key)}", 'run': functools.partial(layer_run, layer_key, config), 'deps': ()})
+    return stages
 
 # --- LOADING SCREEN FUNCTION ---
 def show_loading_screen_and_load_data(screen, font, info_font):
-    global running, airports_data, runways_data, navaids_data, eph, ts, observer_topos
-    # Note: map_features_geodata is populated by load_specific_vector_layer_data
-
-    loading_stages = [
-        {"name": "Initializing Skyfield...", "action": "skyfield"},
-        {"name": "Loading Airport Data...", "action": "airports"},
-        {"name": "Loading Runway Data...", "action": "runways"},
-        {"name": "Loading Navaid Data...", "action": "navaids"},
-    ]
-    for layer_key, config in VECTOR_LAYER_CONFIGS.items():
-        loading_stages.append({
-            "name": f"Loading Map: {config.get('label', layer_key)}...",
-            "action": "vector_layer", "layer_key": layer_key, "layer_config": config
-        })
+    """Start the startup loader and show its progress until the essential stages are in."""
+    global running, startup_loader
 
-    num_stages = len(loading_stages)
+    startup_loader = StartupLoader(startup_stages())
+    num_stages = len(startup_loader.stages)
     progress_bar_width = screen.get_width() * 0.8
     progress_bar_height = 30
     progress_bar_x = (screen.get_width() - progress_bar_width) / 2
@@ -1909,23 +3555,24 @@ def show_loading_screen_and_load_data(screen, font, info_font):
 
     DARK_BLUE_LOADING = (15, 18, 26); WHITE_LOADING = (220, 220, 220)
     GREEN_LOADING = (0, 180, 0); GREY_LOADING = (80, 80, 80)
+    frame_clock = pygame.time.Clock()
 
-    print(f"Using fixed vector map simplification tolerance: {DEFAULT_SIMPLIFICATION_TOLERANCE_DEG}°")
-
-    for i, stage in enumerate(loading_stages):
-        if not running: return False
+    while not startup_loader.essentials_ready():
+        if not running: startup_loader.shutdown(); return False
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
-                print("Loading aborted by user."); running = False; return False
+                print("Loading aborted by user."); running = False; startup_loader.shutdown(); return False
+        startup_loader.poll()
 
         screen.fill(DARK_BLUE_LOADING)
         title_surf = font.render("ADS-B Transit Predictor", True, WHITE_LOADING)
         title_rect = title_surf.get_rect(center=(screen.get_width() / 2, title_y))
         screen.blit(title_surf, title_rect)
-        msg_surface = info_font.render(stage["name"], True, WHITE_LOADING)
+        pending = startup_loader.pending_names()
+        msg_surface = info_font.render("Loading " + (", ".join(pending[:3]) + ("..." if len(pending) > 3 else "") if pending else "..."), True, WHITE_LOADING)
         msg_rect = msg_surface.get_rect(center=(screen.get_width() / 2, progress_bar_y - 30))
         screen.blit(msg_surface, msg_rect)
-        progress = (i + 1) / num_stages
+        progress = len(startup_loader.done) / num_stages
         current_progress_width = progress_bar_width * progress
         pygame.draw.rect(screen, GREY_LOADING, (progress_bar_x, progress_bar_y, progress_bar_width, progress_bar_height))
         pygame.draw.rect(screen, GREEN_LOADING, (progress_bar_x, progress_bar_y, current_progress_width, progress_bar_height))
@@ -1933,35 +3580,14 @@ def show_loading_screen_and_load_data(screen, font, info_font):
         percent_rect = percent_text.get_rect(center=(progress_bar_x + progress_bar_width / 2, progress_bar_y + progress_bar_height / 2))
         screen.blit(percent_text, percent_rect)
         pygame.display.flip()
-
-        action = stage["action"]
-        print(f"Loading stage [{i+1}/{num_stages}]: {stage['name']}")
-        try:
-            if action == "skyfield":
-                ephemeris_path = resource_path(os.path.join('data', 'de421.bsp'))
-                eph = load(ephemeris_path); ts = load.timescale()
-                observer_topos = Topos(latitude_degrees=USER_LAT, longitude_degrees=USER_LON, elevation_m=USER_ALT)
-            elif action == "airports":
-                airports_data = load_airports(filename=AIRPORTS_CSV, types_to_show=SHOW_AIRPORT_TYPES)
-            elif action == "runways":
-                initial_airport_idents = {apt['ident'] for apt in airports_data}
-                runways_data = load_runways(filename=RUNWAYS_CSV, airport_idents_to_load=initial_airport_idents)
-            elif action == "navaids":
-                navaids_data = load_navaids(filename=NAVAIDS_CSV, types_to_show=SHOW_NAVAID_TYPES)
-            elif action == "vector_layer":
-                #load_specific_vector_layer_data(stage["layer_key"], stage["layer_config"], DEFAULT_SIMPLIFICATION_TOLERANCE_DEG) # Use fixed tolerance
-                if map_manager:
-                    map_manager.load_layer(stage["layer_key"], stage["layer_config"])
-                else:
-                    print("Error: map_manager is not initialized!")                
-        except Exception as e_load:
-            print(f"Error during loading stage '{stage['name']}': {e_load}"); traceback.print_exc()
-    print("All loading stages complete.")
+        frame_clock.tick(30)
+    print(f"Essential stages ready after {(time.perf_counter() - startup_loader.t0) * 1000.0:.0f} ms; "
+          f"{num_stages - len(startup_loader.done)} stage(s) continue in the background.")
     return True
 
 
 def visualization_loop(screen, current_screen_width, current_screen_height):
-    global running, current_display_range_km, HOST, PORT, DUMP1090_DEVICE_INDEX, DUMP1090_GAIN, USER_LAT, USER_LON, USER_ALT, USER_ALT_FT, AIRCRAFT_TIMEOUT, PREDICTION_INTERVAL, PREDICTION_HORIZON, PREDICTION_STEP, CONFLICT_ANGLE_DEG, EVENT_TIMEOUT, CONFLICT_RADIUS_KM, AIRCRAFT_HISTORY_MINUTES, SHOW_AIRPORT_TYPES, SHOW_NAVAID_TYPES, SHOW_AIRCRAFT_HISTORY, SHOW_EVENT_LOCATIONS, SHOW_GLIDESLOPE, SHOW_RANGE_RINGS, RANGE_RING_SPACING_NM_STR, RANGE_RING_SPACING_KM, MAX_RANGE_RINGS, observer_topos, eph, ts, config_file_full_path, aircraft_dict, event_dict, history_event_count, DUMP1090_CONNECTED, start_time, lock, dialog_result_storage, dialog_thread, airports_data, runways_data, navaids_data, data_loading_thread, data_load_result, active_glideslopes, dialog_runway_end_result_storage, dialog_runway_end_thread, selected_aircraft_for_transit_icao, SHOW_ALL_TRANSIT_STRIPS, VELOCITY_VECTOR_SECONDS, VELOCITY_VECTOR_MINUTES, SHOW_VELOCITY_VECTOR, VECTOR_LAYERS_VISIBILITY, map_features_geodata, last_clicked_transit_coord, last_clicked_transit_time
+    global running, current_display_range_km, HOST, PORT, DUMP1090_DEVICE_INDEX, DUMP1090_GAIN, USER_LAT, USER_LON, USER_ALT, USER_ALT_FT, AIRCRAFT_TIMEOUT, PREDICTION_INTERVAL, PREDICTION_HORIZON, PREDICTION_STEP, CONFLICT_ANGLE_DEG, EVENT_TIMEOUT, CONFLICT_RADIUS_KM, AIRCRAFT_HISTORY_MINUTES, SHOW_AIRPORT_TYPES, SHOW_NAVAID_TYPES, SHOW_AIRCRAFT_HISTORY, SHOW_EVENT_LOCATIONS, SHOW_GLIDESLOPE, SHOW_RANGE_RINGS, RANGE_RING_SPACING_NM_STR, RANGE_RING_SPACING_KM, MAX_RANGE_RINGS, observer_topos, eph, ts, config_file_full_path, aircraft_dict, event_dict, history_event_count, DUMP1090_CONNECTED, start_time, lock, dialog_result_storage, dialog_thread, airports_data, runways_data, navaids_data, data_loading_thread, data_load_result, active_glideslopes, dialog_runway_end_result_storage, dialog_runway_end_thread, selected_aircraft_for_transit_icao, SHOW_ALL_TRANSIT_STRIPS, SHOW_SHADOW_HEATMAP, VELOCITY_VECTOR_SECONDS, VELOCITY_VECTOR_MINUTES, SHOW_VELOCITY_VECTOR, VECTOR_LAYERS_VISIBILITY, map_features_geodata, last_clicked_transit_coord, last_clicked_transit_time
 
     # screen_width and screen_height will track the current dimensions of the 'screen' surface.
     # Initialize with the dimensions passed from __main__
@@ -2001,7 +3627,6 @@ def visualization_loop(screen, current_screen_width, current_screen_height):
     TRANSIT_STRIP_SUN_COLOR_CENTER = pygame.Color(255, 100, 0, 180)
     TRANSIT_STRIP_MOON_COLOR_CENTER = pygame.Color(80, 130, 180, 180)
     CLICKED_COORD_COLOR = pygame.Color(255, 255, 150)
-    POINT_FEATURE_RADIUS = 2
 
     def fade_color(color, alpha=HISTORY_ALPHA): r,g,b = pygame.colordict.THECOLORS.get(color,(255,255,255)) if isinstance(color, str) else color; factor=alpha/255.0; inv_factor=1.0-factor; grey_val=100; return (int(r*factor+grey_val*inv_factor), int(g*factor+grey_val*inv_factor), int(b*factor+grey_val*inv_factor))
     HISTORY_COLOR_GREEN=fade_color(GREEN);HISTORY_COLOR_YELLOW=fade_color(YELLOW);HISTORY_COLOR_RED=fade_color(RED)
@@ -2018,8 +3643,10 @@ def visualization_loop(screen, current_screen_width, current_screen_height):
     
     running_inner = True; clicked_runway_cache = None; plane_size = 3
     prev_frame_transit_polys_info = []
+    heatmap_surface = None; heatmap_surface_key = None # Scaled shadow heatmap, rebuilt when the image or zoom changes
     current_frame_transit_polys_info_temp = []
     map_background_surface = None
+    composed_tile_version = -1; tile_base_surface = None; tile_base_key = None # Last fully tiled background and its (style, scale, centre)
     redraw_map_background = True
     last_drawn_range_km = -1.0
     last_drawn_user_lat = -1.0
@@ -2029,6 +3656,7 @@ def visualization_loop(screen, current_screen_width, current_screen_height):
     while running_inner:
         if not running: running_inner = False; continue
         current_frame_transit_polys_info_temp.clear()
+        apply_event_updates()
 
         if current_display_range_km != last_drawn_range_km or \
            USER_LAT != last_drawn_user_lat or \
@@ -2036,6 +3664,7 @@ def visualization_loop(screen, current_screen_width, current_screen_height):
            (left_rect.width, left_rect.height) != last_drawn_left_rect_size: # left_rect size change triggers redraw
             redraw_map_background = True
 
+        if startup_loader and not startup_loader.finished() and startup_loader.poll(): redraw_map_background = True # Stages streaming in after the window opened
         if data_loading_thread and not data_loading_thread.is_alive():
             new_data=data_load_result[0]
             if new_data and isinstance(new_data,dict) and "error" not in new_data: airports_data=new_data.get('airports',[]);runways_data=new_data.get('runways',collections.defaultdict(list));navaids_data=new_data.get('navaids',[])
@@ -2052,6 +3681,7 @@ def visualization_loop(screen, current_screen_width, current_screen_height):
                 AIRCRAFT_TIMEOUT=new_config['aircraft_timeout']; PREDICTION_INTERVAL=new_config['pred_interval']; PREDICTION_HORIZON=new_config['pred_horizon']; PREDICTION_STEP=new_config['pred_step']; CONFLICT_ANGLE_DEG=new_config['conflict_angle']; EVENT_TIMEOUT=new_config['event_timeout']; CONFLICT_RADIUS_KM=new_config['conflict_radius_km']; AIRCRAFT_HISTORY_MINUTES=new_config['history_minutes']; SHOW_AIRPORT_TYPES=new_config['show_airport_types']; SHOW_NAVAID_TYPES=new_config['show_navaid_types']; SHOW_AIRCRAFT_HISTORY=new_config['show_history']; SHOW_EVENT_LOCATIONS=new_config['show_events']
                 SHOW_GLIDESLOPE = new_config['show_glideslope']; SHOW_RANGE_RINGS = new_config['show_range_rings']; RANGE_RING_SPACING_NM_STR = new_config['range_ring_spacing_nm_str']; MAX_RANGE_RINGS = new_config['max_range_rings']
                 SHOW_ALL_TRANSIT_STRIPS = new_config['show_all_transit_strips']
+                SHOW_SHADOW_HEATMAP = new_config['show_shadow_heatmap']
                 VELOCITY_VECTOR_MINUTES = new_config['velocity_vector_minutes']; VELOCITY_VECTOR_SECONDS = VELOCITY_VECTOR_MINUTES * 60.0
                 SHOW_VELOCITY_VECTOR = new_config['show_velocity_vector']
                 VECTOR_LAYERS_VISIBILITY = new_config['vector_layers_visibility'].copy()
@@ -2097,7 +3727,7 @@ def visualization_loop(screen, current_screen_width, current_screen_height):
                 mouse_event_handled = False
                 if config_button_rect.collidepoint(event.pos):
                     if not (dialog_thread and dialog_thread.is_alive()):
-                        current_runtime_config={'host':HOST,'port':PORT,'device_index':DUMP1090_DEVICE_INDEX,'gain':DUMP1090_GAIN,'lat':USER_LAT,'lon':USER_LON,'alt_m':USER_ALT,'aircraft_timeout':AIRCRAFT_TIMEOUT,'pred_interval':PREDICTION_INTERVAL,'pred_horizon':PREDICTION_HORIZON,'pred_step':PREDICTION_STEP,'conflict_angle':CONFLICT_ANGLE_DEG,'event_timeout':EVENT_TIMEOUT,'conflict_radius_km':CONFLICT_RADIUS_KM,'history_minutes':AIRCRAFT_HISTORY_MINUTES,'show_airport_types':SHOW_AIRPORT_TYPES[:],'show_navaid_types':SHOW_NAVAID_TYPES[:],'show_history':SHOW_AIRCRAFT_HISTORY,'show_events':SHOW_EVENT_LOCATIONS, 'show_glideslope': SHOW_GLIDESLOPE, 'show_range_rings': SHOW_RANGE_RINGS, 'range_ring_spacing_nm_str': RANGE_RING_SPACING_NM_STR, 'max_range_rings': MAX_RANGE_RINGS, 'show_all_transit_strips': SHOW_ALL_TRANSIT_STRIPS, 'velocity_vector_minutes': VELOCITY_VECTOR_MINUTES, 'show_velocity_vector': SHOW_VELOCITY_VECTOR, 'vector_layers_visibility': VECTOR_LAYERS_VISIBILITY.copy()}
+                        current_runtime_config={'host':HOST,'port':PORT,'device_index':DUMP1090_DEVICE_INDEX,'gain':DUMP1090_GAIN,'lat':USER_LAT,'lon':USER_LON,'alt_m':USER_ALT,'aircraft_timeout':AIRCRAFT_TIMEOUT,'pred_interval':PREDICTION_INTERVAL,'pred_horizon':PREDICTION_HORIZON,'pred_step':PREDICTION_STEP,'conflict_angle':CONFLICT_ANGLE_DEG,'event_timeout':EVENT_TIMEOUT,'conflict_radius_km':CONFLICT_RADIUS_KM,'history_minutes':AIRCRAFT_HISTORY_MINUTES,'show_airport_types':SHOW_AIRPORT_TYPES[:],'show_navaid_types':SHOW_NAVAID_TYPES[:],'show_history':SHOW_AIRCRAFT_HISTORY,'show_events':SHOW_EVENT_LOCATIONS, 'show_glideslope': SHOW_GLIDESLOPE, 'show_range_rings': SHOW_RANGE_RINGS, 'range_ring_spacing_nm_str': RANGE_RING_SPACING_NM_STR, 'max_range_rings': MAX_RANGE_RINGS, 'show_all_transit_strips': SHOW_ALL_TRANSIT_STRIPS, 'show_shadow_heatmap': SHOW_SHADOW_HEATMAP, 'velocity_vector_minutes': VELOCITY_VECTOR_MINUTES, 'show_velocity_vector': SHOW_VELOCITY_VECTOR, 'vector_layers_visibility': VECTOR_LAYERS_VISIBILITY.copy()}
                         open_config_dialog_threaded(current_runtime_config)
                     mouse_event_handled = True
                 elif left_rect.collidepoint(event.pos):
@@ -2178,81 +3808,40 @@ def visualization_loop(screen, current_screen_width, current_screen_height):
         view_margin=1.1;min_lat_view=USER_LAT-lat_range_deg_view*view_margin;max_lat_view=USER_LAT+lat_range_deg_view*view_margin;min_lon_view=USER_LON-lon_range_deg_view*view_margin;max_lon_view=USER_LON+lon_range_deg_view*view_margin
 
 
-        if redraw_map_background or map_background_surface is None or map_background_surface.get_size() != (map_panel_draw_width, map_panel_draw_height):
-            # print("Redrawing map background surface (Accelerated)...") 
-            
+        tile_style = map_tiles.style(map_manager.layers_data) if map_tiles and map_manager else None
+        if redraw_map_background or map_background_surface is None or map_background_surface.get_size() != (map_panel_draw_width, map_panel_draw_height) or (map_tiles and map_tiles.version != composed_tile_version):
+            # Compose the background from cached tiles; missing ones are rendered by the tile worker and
+            # the background is recomposed when they arrive (map_tiles.version)
             map_background_surface = pygame.Surface((map_panel_draw_width, map_panel_draw_height), pygame.SRCALPHA)
             map_background_surface.fill(DARK_BLUE)
             
             surface_center_x = map_panel_draw_width // 2
             surface_center_y = map_panel_draw_height // 2
 
-            surface_center = np.array([surface_center_x, surface_center_y], dtype=np.float32)
-            user_pos = np.array([USER_LON, USER_LAT], dtype=np.float32)
-
-            km_per_deg = map_proj_local_radius * radians(1)
-            proj_factors = np.array([
-                km_per_deg * map_proj_lon_factor, 
-                -km_per_deg
-            ], dtype=np.float32) * scale
-
-            view_bbox_margin = 2.0 
-            v_min_lon = min_lon_view - view_bbox_margin
-            v_max_lon = max_lon_view + view_bbox_margin
-            v_min_lat = min_lat_view - view_bbox_margin
-            v_max_lat = max_lat_view + view_bbox_margin
-
-            # [Debug] 
-            # if pygame.time.get_ticks() % 5000 < 100:
-            #     print(f"[Map Debug] View BBox: Lon({v_min_lon:.2f}, {v_max_lon:.2f}) Lat({v_min_lat:.2f}, {v_max_lat:.2f})")
-
-            current_source_data = map_manager.layers_data if map_manager else {}
-            
-            total_features = 0
-            drawn_features = 0
-
-            for layer_key, is_visible in VECTOR_LAYERS_VISIBILITY.items():
-                if is_visible and layer_key in current_source_data:
-                    config = VECTOR_LAYER_CONFIGS.get(layer_key, {})
-                    color = config.get("color", GREY)
-                    layer_type = config.get("type", "line")
-                    is_polygon = (layer_type == "polygon")
-                    is_point = (layer_type == "point")
-
-                    features = current_source_data[layer_key]
-                    
-                    for pts_array, bbox in features:
-                        total_features += 1
-                        
-                        # bbox: (min_lon, max_lon, min_lat, max_lat)
-                        if (bbox[1] < v_min_lon or bbox[0] > v_max_lon or
-                            bbox[3] < v_min_lat or bbox[2] > v_max_lat):
-                            continue
-                        
-                        drawn_features += 1
-                        # Screen = (Geo - User) * Factors + Center
-                        try:
-                            screen_pts_float = (pts_array - user_pos) * proj_factors + surface_center
-                            
-                            #  int32
-                            screen_pts = screen_pts_float.astype(np.int32)
-
-                            if is_point:
-                                for pt in screen_pts:
-                                    if -100 <= pt[0] <= map_panel_draw_width + 100 and -100 <= pt[1] <= map_panel_draw_height + 100:
-                                        pygame.draw.circle(map_background_surface, color, pt, POINT_FEATURE_RADIUS)
-                            
-                            elif len(screen_pts) > 1:
-                                # pygame.draw.aalines(map_background_surface, color, is_polygon, screen_pts.tolist(), 1)
-                                pygame.draw.lines(map_background_surface, color, is_polygon, screen_pts, 1)
-
-                        except Exception as e:
-                            
-                            print(f"[Draw Error] Layer: {layer_key}, Error: {e}")
-            
-            # [Debug] 
-            # if total_features > 0 and drawn_features == 0:
-            #     print(f"[Map Warning] {total_features} features processed, but 0 inside view! Check USER_LAT/LON or BBox logic.")
+            if map_tiles and tile_style is not None:
+                composed_tile_version = map_tiles.version
+                # While tiles for a new zoom are rendering, show the last complete background rescaled
+                if tile_base_surface is not None and tile_base_key[:2] != (tile_style, scale) and tile_base_key[0] == tile_style:
+                    ratio = scale / tile_base_key[1]
+                    bw, bh = int(tile_base_surface.get_width() * ratio), int(tile_base_surface.get_height() * ratio)
+                    if 0 < bw < 8 * map_panel_draw_width and 0 < bh < 8 * map_panel_draw_height:
+                        map_background_surface.blit(pygame.transform.scale(tile_base_surface, (bw, bh)), (surface_center_x - int(tile_base_key[2][0] * ratio), surface_center_y - int(tile_base_key[2][1] * ratio)))
+                # Tiles come in discrete zoom levels: compose at the level's scale, then fit to the exact one
+                tile_level = map_tiles.zoom_level(scale); tile_ratio = scale / map_tiles.level_scale(tile_level)
+                canvas_w, canvas_h = int(ceil(map_panel_draw_width / tile_ratio)), int(ceil(map_panel_draw_height / tile_ratio))
+                canvas_cx, canvas_cy = canvas_w // 2, canvas_h // 2
+                tile_canvas = pygame.Surface((canvas_w, canvas_h), pygame.SRCALPHA) # Transparent gaps keep the placeholder visible
+                tx_range = range(-((canvas_cx + MAP_TILE_PX - 1) // MAP_TILE_PX), (canvas_w - canvas_cx + MAP_TILE_PX - 1) // MAP_TILE_PX)
+                ty_range = range(-((canvas_cy + MAP_TILE_PX - 1) // MAP_TILE_PX), (canvas_h - canvas_cy + MAP_TILE_PX - 1) // MAP_TILE_PX)
+                missing_tiles = 0
+                for tx, ty in sorted(((tx, ty) for tx in tx_range for ty in ty_range), key=lambda c: (c[0] + 0.5) ** 2 + (c[1] + 0.5) ** 2): # Centre first
+                    tile = map_tiles.get(tile_style, tile_level, tx, ty)
+                    if tile is None: missing_tiles += 1
+                    else: tile_canvas.blit(tile, (canvas_cx + tx * MAP_TILE_PX, canvas_cy + ty * MAP_TILE_PX))
+                if abs(tile_ratio - 1.0) > 1e-6: tile_canvas = pygame.transform.smoothscale(tile_canvas, (int(round(canvas_w * tile_ratio)), int(round(canvas_h * tile_ratio))))
+                map_background_surface.blit(tile_canvas, (surface_center_x - int(round(canvas_cx * tile_ratio)), surface_center_y - int(round(canvas_cy * tile_ratio))))
+                if not missing_tiles:
+                    tile_base_surface = map_background_surface.copy(); tile_base_key = (tile_style, scale, (surface_center_x, surface_center_y))
 
             # --- 4. Range Rings ---
             if SHOW_RANGE_RINGS and RANGE_RING_SPACING_KM > 0:
@@ -2289,7 +3878,7 @@ def visualization_loop(screen, current_screen_width, current_screen_height):
         screen.set_clip(left_rect)
 
         show_navaid_labels=current_display_range_km<NAVAID_LABEL_MIN_ZOOM_KM; nsym_sz=2
-        for nvd in navaids_data:
+        for nvd in points_in_view(navaids_data,min_lat_view,max_lat_view,min_lon_view,max_lon_view):
              n_lat,n_lon=nvd['lat'],nvd['lon']
              if min_lat_view<=n_lat<=max_lat_view and min_lon_view<=n_lon<=max_lon_view:
                  n_dx=(n_lon-USER_LON)*radians(1)*map_proj_local_radius*map_proj_lon_factor; n_dy=(n_lat-USER_LAT)*radians(1)*map_proj_local_radius
@@ -2300,7 +3889,7 @@ def visualization_loop(screen, current_screen_width, current_screen_height):
                  else: pygame.draw.rect(screen,NAVAID_COLOR,pygame.Rect(nsx-nsym_sz,nsy-nsym_sz,nsym_sz*2,nsym_sz*2),1)
                  if show_navaid_labels:nl_s=small_font.render(nvd.get('ident','?'),True,LABEL_COLOR);screen.blit(nl_s,nl_s.get_rect(center=(nsx,nsy-nsym_sz-small_font.get_height()//2-2)))
         show_ap_lbls=current_display_range_km<AIRPORT_LABEL_MIN_ZOOM_KM;show_rwys=current_display_range_km<RUNWAY_MIN_ZOOM_KM;show_rwy_lbls=current_display_range_km<RUNWAY_LABEL_MIN_ZOOM_KM;ap_sym_sz=3
-        for ap in airports_data:
+        for ap in points_in_view(airports_data,min_lat_view,max_lat_view,min_lon_view,max_lon_view):
             a_lat,a_lon=ap['lat'],ap['lon']
             if min_lat_view<=a_lat<=max_lat_view and min_lon_view<=a_lon<=max_lon_view:
                 a_dx=(a_lon-USER_LON)*radians(1)*map_proj_local_radius*map_proj_lon_factor;a_dy=(a_lat-USER_LAT)*radians(1)*map_proj_local_radius
@@ -2347,6 +3936,17 @@ def visualization_loop(screen, current_screen_width, current_screen_height):
                                 pygame.draw.aaline(screen,GLIDESLOPE_COLOR,(int(tbx+pvx_gs*GLIDESLOPE_TICK_HALF_LENGTH_PX),int(tby+pvy_gs*GLIDESLOPE_TICK_HALF_LENGTH_PX)),(int(tbx-pvx_gs*GLIDESLOPE_TICK_HALF_LENGTH_PX),int(tby-pvy_gs*GLIDESLOPE_TICK_HALF_LENGTH_PX)))
                 except:pass
 
+        if SHOW_SHADOW_HEATMAP and eph:
+            shadow_heatmap.extent_km = max(map_panel_draw_width, map_panel_draw_height) / 2.0 / scale
+            hm_img = shadow_heatmap.image
+            if hm_img is not None and hm_img[1][:2] == (USER_LAT, USER_LON):
+                hm_side = int(round(2.0 * hm_img[1][2] * scale))
+                if heatmap_surface_key != (hm_img[0], hm_side) and 0 < hm_side <= 4 * max(map_panel_draw_width, map_panel_draw_height):
+                    hm_raw = pygame.image.frombuffer(hm_img[2].tobytes(), hm_img[2].shape[1::-1], 'RGBA')
+                    heatmap_surface = pygame.transform.scale(hm_raw, (hm_side, hm_side)); heatmap_surface_key = (hm_img[0], hm_side)
+                if heatmap_surface_key == (hm_img[0], hm_side):
+                    screen.blit(heatmap_surface, (left_center_x_on_screen - hm_side // 2, left_center_y_on_screen - hm_side // 2))
+
         active_acs_list = get_active_aircraft(); transit_polys_to_draw = [] 
         
         if eph:            
@@ -2360,9 +3960,11 @@ def visualization_loop(screen, current_screen_width, current_screen_height):
                     if selected_aircraft_for_transit_icao and not SHOW_ALL_TRANSIT_STRIPS:
                         selected_aircraft_for_transit_icao = None
 
-            now_time = datetime.now(timezone.utc)
+            # Strips are computed on the async core; the frame only draws whatever is cached
+            transit_strips.request(aircraft_to_calc_transit)
             for icao_code in aircraft_to_calc_transit:
-                res = calculate_transit_rectangle_for_aircraft(icao_code, now_time)
+                res = transit_strips.get(icao_code)
+                if not res: continue
                 if res.get('sun'): transit_polys_to_draw.append((icao_code, 'sun', res['sun']))
                 if res.get('moon'): transit_polys_to_draw.append((icao_code, 'moon', res['moon']))
         for icao_code, body_type, geom_data in transit_polys_to_draw:
@@ -2372,12 +3974,10 @@ def visualization_loop(screen, current_screen_width, current_screen_height):
             strip_fill_color = TRANSIT_STRIP_SUN_COLOR_FILL if body_type == 'sun' else TRANSIT_STRIP_MOON_COLOR_FILL
             centerline_color = TRANSIT_STRIP_SUN_COLOR_CENTER if body_type == 'sun' else TRANSIT_STRIP_MOON_COLOR_CENTER
             
-            screen_poly_verts = []
-            for lat_g, lon_g in poly_geo:
-                if lat_g is None or lon_g is None: continue
-                p_dx = (lon_g - USER_LON) * radians(1) * map_proj_local_radius * map_proj_lon_factor
-                p_dy = (lat_g - USER_LAT) * radians(1) * map_proj_local_radius
-                screen_poly_verts.append((left_center_x_on_screen + int(p_dx * scale), left_center_y_on_screen - int(p_dy * scale)))
+            # Strip vertices are (K, 2) arrays of (lat, lon); project them in one go
+            p_dx = (poly_geo[:, 1] - USER_LON) * radians(1) * map_proj_local_radius * map_proj_lon_factor
+            p_dy = (poly_geo[:, 0] - USER_LAT) * radians(1) * map_proj_local_radius
+            screen_poly_verts = list(zip((left_center_x_on_screen + (p_dx * scale).astype(int)).tolist(), (left_center_y_on_screen - (p_dy * scale).astype(int)).tolist()))
             
             if len(screen_poly_verts) > 2:
                 xs = [p[0] for p in screen_poly_verts]
@@ -2394,11 +3994,9 @@ def visualization_loop(screen, current_screen_width, current_screen_height):
                             current_frame_transit_polys_info_temp.append((body_type, screen_poly_verts, poly_geo, scale, left_rect.copy()))
                     except: pass
             if len(center_geo) > 1:
-                screen_center_pts = []
-                for lat_g, lon_g in center_geo:
-                    p_dx = (lon_g - USER_LON) * radians(1) * map_proj_local_radius * map_proj_lon_factor
-                    p_dy = (lat_g - USER_LAT) * radians(1) * map_proj_local_radius
-                    screen_center_pts.append((left_center_x_on_screen + int(p_dx * scale), left_center_y_on_screen - int(p_dy * scale)))
+                p_dx = (center_geo[:, 1] - USER_LON) * radians(1) * map_proj_local_radius * map_proj_lon_factor
+                p_dy = (center_geo[:, 0] - USER_LAT) * radians(1) * map_proj_local_radius
+                screen_center_pts = list(zip((left_center_x_on_screen + (p_dx * scale).astype(int)).tolist(), (left_center_y_on_screen - (p_dy * scale).astype(int)).tolist()))
 
                 c_xs = [p[0] for p in screen_center_pts]
                 c_ys = [p[1] for p in screen_center_pts]
@@ -2406,7 +4004,7 @@ def visualization_loop(screen, current_screen_width, current_screen_height):
                      try: pygame.draw.aalines(screen, centerline_color, False, screen_center_pts, 1)
                      except: pass
         
-        displayed_ac_count = 0; hist_cutoff = datetime.now(timezone.utc)-timedelta(minutes=AIRCRAFT_HISTORY_MINUTES)
+        displayed_ac_count = 0; hist_cutoff = utc_now()-timedelta(minutes=AIRCRAFT_HISTORY_MINUTES)
         conflict_snap={}; involved_snap={}
         with lock:
              for icao,ac_d in aircraft_dict.items():conflict_snap[icao]=ac_d.get('conflict');involved_snap[icao]=bool(ac_d.get('event_ids'))
@@ -2459,19 +4057,10 @@ def visualization_loop(screen, current_screen_width, current_screen_height):
                 map_dt=cfl_txt[:27]+"..."if len(cfl_txt)>30 else cfl_txt
                 try: cfl_s=font.render(map_dt,True,RED); cfl_p=(tr3.left,tr3.bottom+1)if tr3.x>sx else(tr3.right-cfl_s.get_width(),tr3.bottom+1);screen.blit(cfl_s,cfl_p)
                 except:pass
-        active_total_count = 0
-        active_no_pos_count = 0
-        now_viz = datetime.now(timezone.utc)
-        
+        now_viz = utc_now()
         with lock:
-            # Iterate through all aircraft currently resident in memory
-            for ac in aircraft_dict.values():
-                # only aircraft seen within the last AIRCRAFT_TIMEOUT seconds are classified as "Active"
-                if (now_viz - ac['timestamp']).total_seconds() <= AIRCRAFT_TIMEOUT:
-                    active_total_count += 1
-                    # Among active aircraft, identify those missing valid position data (Lat/Lon)
-                    if ac.get('lat') is None or ac.get('lon') is None:
-                        active_no_pos_count += 1                
+            # Active = seen within the last AIRCRAFT_TIMEOUT seconds; NoPos = active but missing Lat/Lon
+            active_total_count, active_no_pos_count = aircraft_dict.activity_counts(now_viz.timestamp() - AIRCRAFT_TIMEOUT)
         if SHOW_EVENT_LOCATIONS:
             ev_m_sz=4
             with lock:evs_draw=[ev for ev in list(event_dict.values())if'lat'in ev and'lon'in ev and ev['lat']is not None]
@@ -2512,7 +4101,7 @@ def visualization_loop(screen, current_screen_width, current_screen_height):
         btn_c=GREY if config_button_rect.collidepoint(mouse_pos)else DARK_GREY; pygame.draw.rect(screen,btn_c,config_button_rect); pygame.draw.rect(screen,WHITE,config_button_rect,1)
         cfg_txt_s=info_f.render("Config",True,WHITE);screen.blit(cfg_txt_s,cfg_txt_s.get_rect(center=config_button_rect.center))
         y0=right_rect.top+config_button_rect.height+config_button_margin*2;x0=right_rect.left+10
-        with lock:conn_s_txt="Connected"if DUMP1090_CONNECTED else"Disconnected";ac_cnt_dict=len(aircraft_dict);hist_c=history_event_count;ev_lst_cpy=sorted(list(event_dict.values()),key=lambda ev:ev.get('time',datetime.min.replace(tzinfo=timezone.utc)))
+        with lock:conn_s_txt="Connected"if DUMP1090_CONNECTED else"Disconnected";ac_cnt_dict=len(aircraft_dict);hist_c=history_event_count;pair_stats=(prediction_stats.get('acac_pairs_total',0),prediction_stats.get('acac_pairs_candidates',0));solver_stats=[prediction_stats.get(k)for k in('acac_solver','celestial_solver')if prediction_stats.get(k)];reuse_stats=[prediction_stats.get(k)for k in('acac_reused','celestial_reused')];sched_stats=[prediction_stats.get(k)for k in('acac_schedule','celestial_schedule')];samp_stats=prediction_stats.get('celestial_samples');skip_stats=prediction_stats.get('celestial_skipped');feed_stats=(ingest_stats['msg_rate'],ingest_stats['capacity']);ev_lst_cpy=sorted(list(event_dict.values()),key=lambda ev:ev.get('time',datetime.min.replace(tzinfo=timezone.utc)))
         el_s=(datetime.now(timezone.utc)-start_time).total_seconds();el_str=str(timedelta(seconds=int(el_s)))
         range_str = f"{current_display_range_km:.0f}" if current_display_range_km >= 10 else f"{current_display_range_km:.1f}"
         #sts_lns=[f"Runtime: {el_str}",f"Dump1090: {conn_s_txt} ({HOST}:{PORT})",f"User Pos: {USER_LAT:.4f}, {USER_LON:.4f}, {USER_ALT_FT:.0f}ft",f"Tracked AC: {ac_cnt_dict} (Disp: {displayed_ac_count})",f"Map Range: {current_display_range_km:.1f} km (+/-)", f"Conflict Angle: {CONFLICT_ANGLE_DEG:.1f}°",f"History Events: {hist_c}"] # Updated Map Tol
@@ -2525,6 +4114,23 @@ def visualization_loop(screen, current_screen_width, current_screen_height):
             f"Conflict Angle: {CONFLICT_ANGLE_DEG:.1f}°",
             f"History Events: {hist_c}"
         ]        
+        if startup_loader and not startup_loader.finished():
+            sts_lns.append(f"Loading: {len(startup_loader.done)}/{len(startup_loader.stages)} stages")
+        if pair_stats[0]:
+            sts_lns.append(f"AC-AC Pairs: {pair_stats[1]}/{pair_stats[0]} ({100.0 * pair_stats[1] / pair_stats[0]:.1f}%)")
+        if feed_stats[0]:
+            sts_lns.append(f"Feed: {feed_stats[0]:.0f} msg/s (capacity ~{feed_stats[1]:.0f} msg/s)")
+        if any(reuse_stats):
+            sts_lns.append("Reused: " + ", ".join(f"{lbl} {st[0]}/{st[1]}" for lbl, st in zip(("AC-AC", "Celestial"), reuse_stats) if st))
+        if samp_stats and samp_stats[1]:
+            sts_lns.append(f"Sky samples: {samp_stats[0]}/{samp_stats[1]} ({100.0 * samp_stats[0] / samp_stats[1]:.1f}%)"
+                           + (f", skipped {skip_stats[0]}/{skip_stats[1]} AC-body" if skip_stats and skip_stats[1] else ""))
+        if any(st and st['budget'] for st in sched_stats):
+            sts_lns.append("Budget: " + ", ".join(f"{lbl} {100.0 * st['used'] / st['budget']:.0f}%" + (f" ({st['deferred']} deferred)" if st['deferred'] else "") for lbl, st in zip(("AC-AC", "Celestial"), sched_stats) if st and st['budget'])
+                           + f", hot {sum(st['hot'] for st in sched_stats if st)}, focus cycles {sum(st['focus'] for st in sched_stats if st)}")
+        solver_events = sum(st['events'] for st in solver_stats)
+        if solver_events:
+            sts_lns.append(f"Solver: {sum(st['analytic'] for st in solver_stats)}/{solver_events} analytic, {sum(st['evaluations'] for st in solver_stats) / solver_events:.1f} evals/event")
         if celestial_status_lines:
             sts_lns.append("-" * 20) 
             sts_lns.extend(celestial_status_lines)
@@ -2532,6 +4138,7 @@ def visualization_loop(screen, current_screen_width, current_screen_height):
         if SHOW_RANGE_RINGS:sts_lns.append(f"Range Rings: {RANGE_RING_SPACING_NM_STR}NM")
         if SHOW_VELOCITY_VECTOR: sts_lns.append(f"Velocity Vector: {VELOCITY_VECTOR_MINUTES} min")
         ac_disp_n = "All" if SHOW_ALL_TRANSIT_STRIPS else (selected_aircraft_for_transit_icao or "Selected")
+        if SHOW_SHADOW_HEATMAP and shadow_heatmap.image is not None: sts_lns.append(f"Shadow Map: {sum(1 for c in list(shadow_heatmap.cells.values()) if c[2])} AC ({shadow_heatmap.last_build_ms:.0f} ms)")
         if SHOW_ALL_TRANSIT_STRIPS: sts_lns.append("Transit View: All")
         elif selected_aircraft_for_transit_icao:
             ac_disp_n=selected_aircraft_for_transit_icao;
@@ -2556,7 +4163,7 @@ def visualization_loop(screen, current_screen_width, current_screen_height):
                      if y0<right_rect.bottom:screen.blit(info_f.render("[... more ...]",True,GREY),(x0,y0))
                      break
                  try:
-                     calls=' / '.join(ev.get('callsigns',['???']));ev_pred_t=ev.get('time',datetime.min.replace(tzinfo=timezone.utc));time_s=ev_pred_t.strftime('%H:%M:%S');ang_s=f"{ev.get('angle',0.0):.1f}°";ev_ty=ev.get('type','UNK');eta_s=(ev_pred_t-datetime.now(timezone.utc)).total_seconds();disp_eta_s=max(0,round(eta_s));eta_str=f"ETA: {disp_eta_s}s";txt=f"{time_s} {ev_ty}: {calls} ({ang_s}) {eta_str}"
+                     calls=' / '.join(ev.get('callsigns',['???']));ev_pred_t=ev.get('time',datetime.min.replace(tzinfo=timezone.utc));time_s=ev_pred_t.strftime('%H:%M:%S');ang_s=f"{ev.get('angle',0.0):.1f}°";ev_ty=ev.get('type','UNK');eta_s=(ev_pred_t-utc_now()).total_seconds();disp_eta_s=max(0,round(eta_s));eta_str=f"ETA: {disp_eta_s}s";txt=f"{time_s} {ev_ty}: {calls} ({ang_s}) {eta_str}"
                  except:txt="Error formatting event"
                  try:cw_aprx=info_f.size("X")[0]*0.7 if info_f.size("X")[0]>0 else 10;max_l=int((right_rect.width-30)//cw_aprx) if cw_aprx>0 else 30
                  except:max_l=30
@@ -2574,8 +4181,138 @@ def visualization_loop(screen, current_screen_width, current_screen_height):
 
 
 # --- Main Execution ---
+# --- Benchmark ---
+BENCH_TRANSIT_MIN_EL_DEG = 10.0 # A Sun/Moon transit is only planted when the body is at least this high
+BENCH_STAGES = ('ingest', 'acac', 'celestial', 'strips')
+def generate_synthetic_traffic(n, epoch, seed=0, radius_km=150.0):
+    """
+    Synthetic traffic around USER_LAT/USER_LON at `epoch`, as update_aircraft() message dicts.
+    Mix: converging pairs that meet near the observer, arrival/departure streams around a field
+    inside the area, en-route traffic filling the rest, and (ephemeris permitting) one aircraft per
+    Sun/Moon that crosses the body's line of sight within the prediction horizon.
+    Returns (messages, planted) where planted maps icao -> 'Sun'/'Moon'.
+    """
+    rng = np.random.default_rng(seed)
+    msgs = []; planted = {}
+    horizon = max(60.0, float(PREDICTION_HORIZON))
+    def add(lat, lon, alt_ft, spd, trk, vs, callsign):
+        d = dict.fromkeys(csv_headers)
+        d.update(msg_type='3', icao=f"{0xB00000 + len(msgs):06X}", callsign=callsign, altitude=int(max(0, alt_ft)), speed=float(spd),
+                 track=float(trk) % 360.0, lat=float(lat), lon=float(lon), vs=int(vs), timestamp=epoch)
+        msgs.append(d)
+        return d['icao']
+    def backtrack(lat, lon, trk, spd, t_sec):
+        """Start point that reaches (lat, lon) after t_sec on track trk at spd knots."""
+        return destination_point(lat, lon, (trk + 180.0) % 360.0, spd * 1.852 / 3600.0 * t_sec)
+    # Guaranteed transits: the crossing point lies on the body's line of sight at t_cross
+    if eph is not None and ts is not None:
+        obs = eph['earth'] + Topos(latitude_degrees=USER_LAT, longitude_degrees=USER_LON, elevation_m=USER_ALT)
+        for body, label in (('sun', 'Sun'), ('moon', 'Moon')):
+            if len(msgs) >= n: break
+            t_cross = float(rng.uniform(20.0, 0.6 * horizon))
+            b_alt, b_az, _ = obs.at(ts.utc(epoch + timedelta(seconds=t_cross))).observe(eph[body]).apparent().altaz()
+            if b_alt.degrees < BENCH_TRANSIT_MIN_EL_DEG: continue
+            h_km = min(feet_to_km(rng.uniform(8000, 36000)), 60.0 * tan(b_alt.radians)) # keep the crossing within 60 km
+            c_lat, c_lon = destination_point(USER_LAT, USER_LON, b_az.degrees, h_km / tan(b_alt.radians))
+            spd = float(rng.uniform(220, 460)); trk = (b_az.degrees + 90.0) % 360.0
+            s_lat, s_lon = backtrack(c_lat, c_lon, trk, spd, t_cross)
+            planted[add(s_lat, s_lon, USER_ALT_FT + h_km * 1000.0 / 0.3048, spd, trk, 0, f"TRN{label[0]}{len(planted)}")] = label
+    # Converging pairs: both aircraft reach a common point near the observer at the same time
+    for _ in range(max(0, n - len(msgs)) // 10):
+        m_lat, m_lon = destination_point(USER_LAT, USER_LON, rng.uniform(0, 360), rng.uniform(0, radius_km / 3.0))
+        t_meet = float(rng.uniform(30.0, 0.8 * horizon)); alt = float(rng.uniform(6000, 38000))
+        trk1 = float(rng.uniform(0, 360)); trk2 = trk1 + float(rng.choice([-1, 1]) * rng.uniform(45, 135))
+        for k, trk in enumerate((trk1, trk2)):
+            spd = float(rng.uniform(250, 480))
+            la, lo = backtrack(m_lat, m_lon, trk, spd, t_meet)
+            add(la, lo, alt + k * float(rng.uniform(-400, 400)), spd, trk, 0, f"XNG{len(msgs)}")
+    # Arrival/departure streams around a field inside the area
+    f_lat, f_lon = destination_point(USER_LAT, USER_LON, rng.uniform(0, 360), 0.2 * radius_km)
+    for k in range(max(0, n - len(msgs)) // 5):
+        brg = float(rng.uniform(0, 360))
+        if k % 2:
+            la, lo = destination_point(f_lat, f_lon, brg, rng.uniform(15, 60))
+            add(la, lo, rng.uniform(3000, 11000), rng.uniform(160, 250), (brg + 180.0) % 360.0, -rng.uniform(600, 1300), f"ARR{k}")
+        else:
+            la, lo = destination_point(f_lat, f_lon, brg, rng.uniform(1, 25))
+            add(la, lo, rng.uniform(1000, 9000), rng.uniform(160, 280), brg, rng.uniform(1200, 2800), f"DEP{k}")
+    # En-route traffic fills the remainder, uniformly over the disc
+    while len(msgs) < n:
+        la, lo = destination_point(USER_LAT, USER_LON, rng.uniform(0, 360), radius_km * sqrt(rng.uniform()))
+        add(la, lo, rng.uniform(18000, 41000), rng.uniform(350, 500), rng.uniform(0, 360), rng.choice([0, 0, 0, -1500, 1500]), None)
+    return msgs, planted
+def run_benchmark(args):
+    """
+    Headless benchmark of the prediction pipeline: for each traffic size, one cold cycle of
+    predict_conflicts, predict_celestial_conflicts and calculate_transit_strips (all
+    aircraft) per repeat, on a frozen virtual clock. Prints per-stage latency percentiles and the
+    scaling exponent of the median vs N. Returns a process exit code.
+    """
+    global eph, ts, observer_topos, aircraft_dict
+    try: sizes = sorted({int(s) for s in str(args.bench_sizes).split(',') if s.strip()})
+    except ValueError: print(f"Invalid --bench-sizes: {args.bench_sizes}"); return 2
+    try: epoch = datetime.fromisoformat(args.bench_epoch) if args.bench_epoch else datetime.now(timezone.utc)
+    except ValueError: print(f"Invalid --bench-epoch: {args.bench_epoch}"); return 2
+    if epoch.tzinfo is None: epoch = epoch.replace(tzinfo=timezone.utc)
+    repeats = max(1, args.bench_repeats)
+    try:
+        eph = load(resource_path(os.path.join('data', 'de421.bsp'))); ts = load.timescale()
+        observer_topos = Topos(latitude_degrees=USER_LAT, longitude_degrees=USER_LON, elevation_m=USER_ALT)
+    except Exception as e: print(f"Ephemeris unavailable ({e}); celestial stages will be skipped.")
+    clock.start_replay(epoch.timestamp(), None) # frozen: every stage sees the same "now"
+    start_prediction_pool(args.workers)
+    if prediction_pool:
+        for f in prediction_pool.warmup: f.result()
+    print(f"Benchmark: observer {USER_LAT:.4f},{USER_LON:.4f} at {epoch.isoformat()}, sizes {sizes}, {repeats} repeats, radius {args.bench_radius_km:g} km, {args.workers} workers")
+    quiet = lambda: contextlib.redirect_stdout(io.StringIO())
+    results = []
+    for n in sizes:
+        msgs, planted = generate_synthetic_traffic(n, epoch, args.bench_seed, args.bench_radius_km)
+        timings = {s: [] for s in BENCH_STAGES}
+        for _ in range(repeats):
+            with lock: aircraft_dict = AircraftStore(); event_dict.clear()
+            t0 = time.perf_counter()
+            for m in msgs: update_aircraft(m)
+            with lock: publish_aircraft_snapshot()
+            timings['ingest'].append(time.perf_counter() - t0)
+            with quiet():
+                t0 = time.perf_counter(); predict_conflicts(max_cycles=1); apply_event_updates(); timings['acac'].append(time.perf_counter() - t0)
+                if eph is not None:
+                    t0 = time.perf_counter(); predict_celestial_conflicts(max_cycles=1); apply_event_updates(); timings['celestial'].append(time.perf_counter() - t0)
+                    t0 = time.perf_counter()
+                    calculate_transit_strips(list(get_aircraft_snapshot().icao), epoch)
+                    timings['strips'].append(time.perf_counter() - t0)
+        with lock: events = list(event_dict.keys())
+        found = sum((icao, f'AC-{label}') in events for icao, label in planted.items())
+        row = {'n': n, 'acac_events': sum(e[-1] == 'AC-AC' for e in events), 'transits_planted': len(planted), 'transits_found': found, 'stages': {}}
+        for stage, v in timings.items():
+            if v: row['stages'][stage] = {q: float(np.percentile(v, p) * 1000.0) for q, p in (('p50', 50), ('p90', 90), ('p99', 99), ('max', 100))}
+        results.append(row)
+        print(f"  N={n:5d}  AC-AC events {row['acac_events']:4d}  transits found {found}/{len(planted)}")
+    print(f"\n{'stage':<10}{'N':>7}{'p50 ms':>11}{'p90 ms':>11}{'p99 ms':>11}{'max ms':>11}")
+    scaling = {}
+    for stage in BENCH_STAGES:
+        pts = [(r['n'], r['stages'][stage]['p50']) for r in results if stage in r['stages']]
+        for n, _ in pts:
+            q = next(r for r in results if r['n'] == n)['stages'][stage]
+            print(f"{stage:<10}{n:>7}{q['p50']:>11.2f}{q['p90']:>11.2f}{q['p99']:>11.2f}{q['max']:>11.2f}")
+        if len(pts) >= 2 and all(p > 0 for _, p in pts):
+            scaling[stage] = float(np.polyfit(np.log([n for n, _ in pts]), np.log([p for _, p in pts]), 1)[0])
+    if scaling: print("\nScaling (p50 ~ N^k): " + ", ".join(f"{s} k={k:.2f}" for s, k in scaling.items()))
+    if args.bench_json:
+        try:
+            with open(args.bench_json, 'w') as f:
+                json.dump({'epoch': epoch.isoformat(), 'observer': [USER_LAT, USER_LON, USER_ALT], 'repeats': repeats, 'seed': args.bench_seed, 'workers': args.workers,
+                           'radius_km': args.bench_radius_km, 'results': results, 'scaling': scaling}, f, indent=2)
+            print(f"Results written to {args.bench_json}")
+        except OSError as e: print(f"Cannot write {args.bench_json}: {e}"); stop_prediction_pool(); return 1
+    stop_prediction_pool()
+    return 0
+
 if __name__ == "__main__":
     running = True
+    dump1090_process = start_dump1090()
+    if CLI.benchmark: sys.exit(run_benchmark(CLI))
     pygame.init() 
 
     # --- Load fonts for the loading screen ---
@@ -2593,6 +4330,7 @@ if __name__ == "__main__":
     print("Initializing Map Data Manager...")
     try:
         map_manager = MapDataManager(os.path.join(app_dir, "data"))
+        map_tiles = MapTileCache(os.path.join(map_manager.cache_dir, "tiles"))
     except Exception as e:
         print(f"Failed to init MapDataManager: {e}")
 
@@ -2615,6 +4353,7 @@ if __name__ == "__main__":
 
     # --- Initialize main application window settings ---
     main_screen_surface = None 
+    core_thread = None
     actual_screen_width_main = 0
     actual_screen_height_main = 0
 
@@ -2665,11 +4404,8 @@ if __name__ == "__main__":
         print(f"Main window created. Requested size: ({main_screen_surface.get_width()}x{main_screen_surface.get_height()}), actual size for viz_loop: ({actual_screen_width_main}x{actual_screen_height_main})")
         
         # --- Launch background processing threads ---
-        print("Launching background threads...")
-        listener_thread = threading.Thread(target=start_listener, daemon=True, name="ListenerThread"); listener_thread.start()
-        conflict_thread = threading.Thread(target=predict_conflicts, daemon=True, name="ConflictThread"); conflict_thread.start()
-        if eph: celestial_thread = threading.Thread(target=predict_celestial_conflicts, daemon=True, name="CelestialConflictThread"); celestial_thread.start()
-        event_cleaner_thread = threading.Thread(target=clean_expired_events, daemon=True, name="EventCleanerThread"); event_cleaner_thread.start()
+        print("Launching background processing...")
+        core_thread = threading.Thread(target=run_async_core, daemon=True, name="AsyncCore"); core_thread.start()
         #map_manager = MapDataManager(os.path.join(app_dir, "data"))
         print("Background threads started. Launching main visualization...")
         try:
@@ -2690,12 +4426,12 @@ if __name__ == "__main__":
         except subprocess.TimeoutExpired: dump1090_process.kill(); dump1090_process.wait(timeout=2)
         except Exception as e_term: print(f"Error while terminating dump1090: {e_term}")
     
-    print("Waiting for threads to finish (0.5s)...")
-    running = False # Signal all threads to stop
-    # Give threads a moment to see the 'running = False' flag
-    # For threads with longer sleep intervals, this might not be enough, but it's a common practice.
-    # More robust cleanup would involve joining threads with a timeout.
-    time.sleep(0.5) 
+    print("Waiting for background processing to finish...")
+    running = False # Signal the async core to stop
+    if startup_loader is not None and not startup_loader.finished(): startup_loader.shutdown()
+    # The core polls 'running' every 0.2 s and cancels its tasks; an in-flight prediction cycle
+    # finishes on its own, so the wait is bounded rather than unconditional.
+    if core_thread is not None: core_thread.join(timeout=2.0)
     pygame.quit() 
     print("Exiting main application.")
     sys.exit(0)